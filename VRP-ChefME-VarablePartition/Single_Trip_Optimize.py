@@ -1,9 +1,21 @@
-from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
 import math
 import random as rd
-
-from location_util_osm import location_to_latlong, distance_matrix
+import time
+import numpy as np
+
+from utils import warehouse_loaded_orders, DISTANCE_SCALE
+
+from exact_solver import solve_exact, EXACT_MAX_ORDERS, EXACT_MAX_NODES
+from search_monitor import (
+    EarlyStopping,
+    ProgressReporter,
+    SearchTelemetry,
+    STOP_SEARCH_COMPLETED,
+)
+from solver_portfolio import portfolio_configs, search_parameters, solve_portfolio
+from solve_profiles import fit_deadline, response_deadline, solve_profile, solve_time_limit
+from location_util_osm import distance_matrix, MATRIX_FALLBACK
 
 # from location_util_google import distance_matrix
 
@@ -44,18 +56,37 @@ class Single_Trip:
             Important Note : make sure input validation is runned and data dict is in correct form.
             preprocess the data
         """
+        # search has to be finished by deadline of "respond_by" (see solve_profiles)
+        self.deadline = response_deadline(data)
+        self.solve_profile = data.get("solve_profile")
+        profile = solve_profile(data)
         self.AVG_SPEED = data.get("avg_speed", 50)  # in km/h
         self.DUTY_TIME = data.get("max_single_trip_duration", 12)  # in hr
-        self.MAX_DISTANCE_PER_TRIP = int(self.AVG_SPEED * self.DUTY_TIME)  # in km
+        self.MAX_DISTANCE_PER_TRIP = int(
+            self.AVG_SPEED * self.DUTY_TIME * DISTANCE_SCALE
+        )  # in DISTANCE_SCALE units
         self.AVG_HANDOVER_TIME = data.get("handover_time", 0)  # in minutes
         self.n_orders = len(data["delivery_sizes"]) // 2  # number of orders
         # converting time to distance
-        self.AVG_HANDOVER_DISTANCE = (self.AVG_HANDOVER_TIME / 60) * self.AVG_SPEED
+        self.AVG_HANDOVER_DISTANCE = int(
+            (self.AVG_HANDOVER_TIME / 60) * self.AVG_SPEED * DISTANCE_SCALE
+        )
         self.user_max_time = data.get("max_solver_time", 3 * 60)  # in seconds
         # time allocated to solver
-        self.SINGLE_TRIP_MAX_SOLVE_TIME = min(
-            60 * 5, 2 * self.n_orders, self.user_max_time
+        # (solve profile sets its own time budget, see solve_profiles)
+        self.SINGLE_TRIP_MAX_SOLVE_TIME = solve_time_limit(
+            data, min(60 * 5, 2 * self.n_orders, self.user_max_time)
         )  # in seconds
+        # search configrations, more than one are solved in parallel (portfolio)
+        self.search_configs = portfolio_configs(data.get("portfolio"), profile)
+        # stopping search once objective stops improving (time limit is the ceiling)
+        self.early_stopping = data.get("early_stopping", profile.get("early_stopping"))
+        # called with every improving plan found during search
+        self.progress = None
+        # search telemetry (objective trace, counters, build / search time) in response
+        self.telemetry = data.get("telemetry", False)
+        # small trips are solved exactly, "exact": false always uses ortools
+        self.exact = data.get("exact", True)
         self.data = self._preprocess(data)
 
     def _preprocess(self, raw_data):
@@ -66,77 +97,128 @@ class Single_Trip:
                 1. Adding dummy nodes
                 2. Adding positive and negative flows to maintain vehicle capacity
                 3. creating distance matrix
+                4. precomputing integer arc cost matrix
+
+            Delivery orders picked up at warehouse are loaded at start of route
+            (see warehouse_loaded_orders), they only have customer node and no
+            pickup and delivery pair. node_roles keeps operation of every node.
         """
         data = {}
         data["locations"], data["pickups_deliveries"] = [raw_data["depot_location"]], []
         data["demands"] = [0]
         data["do_info"] = [("warehouse", "init")]
+        data["node_roles"] = [""]
+        # customer nodes of orders loaded at start of route
+        data["loaded_nodes"] = []
+        # (pickup node, delivery node) of every order, pickup node is None if loaded
+        data["order_nodes"] = []
+        loaded_orders = warehouse_loaded_orders(raw_data)
+
         cnt = 1
-        for i, k, do in zip(
-            raw_data["locations_of_orders"],
-            raw_data["delivery_sizes"],
-            raw_data["do_numbers"],
+        for n, (i, k, do) in enumerate(
+            zip(
+                raw_data["locations_of_orders"],
+                raw_data["delivery_sizes"],
+                raw_data["do_numbers"],
+            )
         ):
+            if n in loaded_orders:
+                # depot loading step, only customer node with negative demand
+                data["locations"].append(i[1])
+                data["loaded_nodes"].append(cnt)
+                data["order_nodes"].append((None, cnt))
+                data["do_info"].append((do, "drop"))
+                data["node_roles"].append("deliver")
+                data["demands"].append(-math.ceil(k))
+                cnt += 1
+                continue
+
             data["locations"].append(i[0])
             data["locations"].append(i[1])
             data["pickups_deliveries"].append([cnt, cnt + 1])
+            data["order_nodes"].append((cnt, cnt + 1))
+            data["node_roles"].append("pickup")
+            data["node_roles"].append("deliver")
             # action defined based on node
             data["do_info"].append((do, "collect"))
             data["do_info"].append((do, "drop"))
             # positive, negative demand
-            data["demands"].append(k)
-            data["demands"].append(-k)
+            data["demands"].append(math.ceil(k))
+            data["demands"].append(-math.ceil(k))
             cnt += 2
 
         # calculating distance matrix
-        data["distance_matrix"] = distance_matrix(data["locations"])
+        data["distance_matrix"] = distance_matrix(
+            data["locations"],
+            mode=raw_data.get("distance_mode", "road"),
+            fallback=raw_data.get("matrix_fallback", MATRIX_FALLBACK),
+        )
+        data["travel_matrix"], data["transit_matrix"] = self._transit_matrices(data)
         data["num_vehicles"] = raw_data["no_vehicles"]
-        data["vehicle_capacities"] = raw_data["capacity_of_vehicles"]
+        data["vehicle_capacities"] = list(map(int, raw_data["capacity_of_vehicles"]))
         data["depot"] = 0
         data["type_of_orders"] = raw_data["type_of_orders"]
 
         return data
 
-    def generate_output(self, manager, routing, solution):
+    def _transit_matrices(self, data):
         """
-            generate important output plannig answer from optimized response
+            Precompute travel and arc cost matrices between all nodes, so that
+            ortools never calls back into python during search.
+
+            arc cost = travel distance + handover distance (if next node is delivery),
+            handover is not added for consecutive deliveries on same location.
         """
-        total_distance = 0
-        full_plan = []
+        travel = data["distance_matrix"].node_matrix().astype(np.int64)
+        travel = travel * DISTANCE_SCALE // 1000  # distance matrix is in meters
+
+        delivery_nodes = np.array(data["node_roles"]) == "deliver"
+        service = np.where(
+            delivery_nodes[None, :] & (travel != 0), self.AVG_HANDOVER_DISTANCE, 0
+        )
+
+        return travel, travel + service
+
+    def solution_routes(self, manager, routing, solution):
+        """
+            node list of every vehicle route (starting at warehouse, without final warehouse)
+        """
+        routes = []
         for vehicle_id in range(self.data["num_vehicles"]):
             index = routing.Start(vehicle_id)
+            route = []
+            while not routing.IsEnd(index):
+                route.append(manager.IndexToNode(index))
+                index = solution.Value(routing.NextVar(index))
+            routes.append(route)
+        return routes
+
+    def generate_output(self, routes):
+        """
+            generate important output plannig answer from vehicle routes
+        """
+        total_distance = 0
+        full_plan = []
+        loaded_nodes = set(self.data["loaded_nodes"])
+        for route in routes:
             vehicle_plan = []
+            loading_plan = []
             route_distance = 0
-            total_handover_excluded = 0
-            while not routing.IsEnd(index):
-                actual_id = manager.IndexToNode(index)
+            for actual_id, next_id in zip(route, route[1:] + [self.data["depot"]]):
+                # orders loaded at start of route are collected when leaving warehouse
+                if actual_id in loaded_nodes:
+                    loading_plan.append(
+                        {"operation": "collect", "order_id": self.data["do_info"][actual_id][0]}
+                    )
 
                 order_id, operation = self.data["do_info"][actual_id]
                 vehicle_plan.append({"operation": operation, "order_id": order_id})
-                # calculating distance
-                previous_index = index
-                index = solution.Value(routing.NextVar(index))
-                route_distance += routing.GetArcCostForVehicle(
-                    previous_index, index, vehicle_id
-                )
-                # checking continous delivery location
-                if (
-                    index % 2 == 0
-                    and index != 0
-                    and not routing.IsEnd(index)
-                    and self.data["distance_matrix"][previous_index][index] == 0
-                ):
-                    total_handover_excluded += 1
-
-            full_plan.append(vehicle_plan[1:])
-            # removing handover distance from total distance
-            route_distance = route_distance - self.AVG_HANDOVER_DISTANCE * (
-                len(vehicle_plan[1:]) // 2
-            )
-            # adding excluded handover distance back
-            route_distance += total_handover_excluded * self.AVG_HANDOVER_DISTANCE
+                # calculating travel distance (arc cost without handover distance)
+                route_distance += int(self.data["travel_matrix"][actual_id, next_id])
 
-            total_distance += route_distance
+            full_plan.append(loading_plan + vehicle_plan[1:])
+
+            total_distance += route_distance / DISTANCE_SCALE
 
         optimized_distance = total_distance
 
@@ -144,23 +226,119 @@ class Single_Trip:
         init_distance = 0
         last = 0  # starting from warehouse
 
-        N = len(self.data["type_of_orders"])
-
-        for i in range(N):
-            if self.data["type_of_orders"][i]:  # pick-up
-                curr = 2 * i + 1
+        for order_type, (pickup_node, delivery_node) in zip(
+            self.data["type_of_orders"], self.data["order_nodes"]
+        ):
+            if order_type:  # pick-up
+                curr = pickup_node
             else:  # delivery
-                curr = 2 * i + 2
-            init_distance += int(self.data["distance_matrix"][last][curr])
+                curr = delivery_node
+            init_distance += int(self.data["distance_matrix"].distance(last, curr))
             last = curr
 
-        init_distance += int(self.data["distance_matrix"][last][0])
+        init_distance += int(self.data["distance_matrix"].distance(last, 0))
         return full_plan, optimized_distance, init_distance
 
-    def solve(self):
+    def output_response(self, routes):
+        """
+            generate output response dict from given vehicle routes
+            (final solution, solution being found during search or exact solution)
+        """
+        data = dict()
+        full_plan, optimized_distance, init_distance = self.generate_output(routes)
+        # road distances or great circle estimates
+        data["distance_source"] = self.data["distance_matrix"].source
+        # osrm / route cache pair counts of matrix (None for estimates and reused matrix)
+        data["route_cache"] = getattr(self.data["distance_matrix"], "route_stats", None)
+        data["trips"] = full_plan
+        data["initial_distance"] = max(init_distance, 0)
+        data["optimized_distance"] = max(optimized_distance, 0)
+        data["initial_trip_duration"] = (
+            init_distance / self.AVG_SPEED
+        ) * 60  # in minutes
+        data["optimized_trip_duration"] = (
+            optimized_distance / self.AVG_SPEED
+        ) * 60  # in minutes
+
+        data["saved_distance"] = max(init_distance - optimized_distance, 0)  # in km
+        data["saved_time"] = (
+            data["saved_distance"] / self.AVG_SPEED
+        ) * 60  # in minutes
+
+        data["optimized_trip_duration"] = max(data["optimized_trip_duration"], 0)
+        data["initial_trip_duration"] = max(data["initial_trip_duration"], 0)
+        data["saved_time"] = max(data["saved_time"], 0)
+
+        return data
+
+    def solve(self, progress=None):
         """
         solving optimization
+        if portfolio is requested, all search configrations are solved in parallel processes
+        on the same preprocessed data and best solution is returned
+
+        progress(data) is called with improving intermediate plans during search
+        (it must be picklable, to be used by parallel portfolio processes)
+        """
+        self.progress = progress
+        budget = fit_deadline(self, "SINGLE_TRIP_MAX_SOLVE_TIME")
+        if self.use_exact():
+            data = self.solve_exact()
+        elif len(self.search_configs) > 1:
+            data = solve_portfolio(self, self.search_configs)
+        else:
+            data = self.solve_with_config(self.search_configs[0])
+        data["solve_budget"] = budget
+        return data
+
+    def use_exact(self):
+        """
+            exact solver is used for single vehicle trips with atmost EXACT_MAX_ORDERS orders
+        """
+        return (
+            self.exact
+            and self.data["num_vehicles"] == 1
+            and len(self.data["order_nodes"]) <= EXACT_MAX_ORDERS
+            and len(self.data["demands"]) - 1 <= EXACT_MAX_NODES
+        )
+
+    def solve_exact(self):
+        """
+        solving small trip exactly (bitmask dynamic programming), optimal plan is proven
+        """
+        t1 = time.time()
+        start_load = -sum(self.data["demands"][node] for node in self.data["loaded_nodes"])
+        result = solve_exact(
+            self.data["transit_matrix"],
+            self.data["pickups_deliveries"],
+            self.data["demands"],
+            self.data["vehicle_capacities"][0],
+            start_load,
+        )
+        summary = {
+            "engine": "exact",
+            "stop_reason": STOP_SEARCH_COMPLETED,
+            "search_time": round(time.time() - t1, 3),
+        }
+        # same duty limit as distance dimension of ortools model
+        if result is None or result[0] > self.MAX_DISTANCE_PER_TRIP:
+            data = {"optimized_status": False}
+            data.update(summary)
+            return data
+
+        objective, route = result
+        data = self.output_response([route])
+        data["optimized_status"] = True
+        data["proven_optimal"] = True
+        data.update(summary)
+        data["objective"] = objective
+        return data
+
+    def solve_with_config(self, config):
         """
+        solving optimization with given search configration
+        """
+        build_start = time.time()
         manager = pywrapcp.RoutingIndexManager(
             len(self.data["distance_matrix"]),
             self.data["num_vehicles"],
@@ -171,25 +349,10 @@ class Single_Trip:
         routing = pywrapcp.RoutingModel(manager)
 
         # Define cost of each arc.
-        def distance_callback(from_index, to_index):
-            """Returns the distance between the two nodes."""
-            # Convert from routing variable Index to distance matrix NodeIndex.
-            from_node = manager.IndexToNode(from_index)
-            to_node = manager.IndexToNode(to_index)
-            # checking continous delivery location
-            handover_time = (
-                self.AVG_HANDOVER_DISTANCE
-                if (
-                    to_node % 2 == 0
-                    and to_node != 0
-                    and self.data["distance_matrix"][from_node][to_node] != 0
-                )
-                else 0
-            )
-
-            return self.data["distance_matrix"][from_node][to_node] + handover_time
-
-        transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+        # (precomputed matrix, no python callback during search)
+        transit_callback_index = routing.RegisterTransitMatrix(
+            self.data["transit_matrix"].tolist()
+        )
         routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
 
         # Add Distance constraint.
@@ -217,67 +380,58 @@ class Single_Trip:
                 <= distance_dimension.CumulVar(delivery_index)
             )
 
-        def demand_callback(from_index):
-            """Returns the demand of the node."""
-            # Convert from routing variable Index to demands NodeIndex.
-            from_node = manager.IndexToNode(from_index)
-            return self.data["demands"][from_node]
-
-        demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
+        demand_callback_index = routing.RegisterUnaryTransitVector(self.data["demands"])
 
         routing.AddDimensionWithVehicleCapacity(
             demand_callback_index,
             0,  # null capacity slack
             self.data["vehicle_capacities"],  # vehicle maximum capacities
-            True,  # start cumul to zero
+            # start cumul is load of orders loaded at start of route
+            not self.data["loaded_nodes"],  # start cumul to zero
             "Capacity",
         )
 
-        # Setting first solution heuristic.
-        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-        search_parameters.first_solution_strategy = (
-            routing_enums_pb2.FirstSolutionStrategy.PARALLEL_CHEAPEST_INSERTION
-        )
-
-        search_parameters.local_search_metaheuristic = (
-            routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
-        )
-
-        search_parameters.time_limit.seconds = self.SINGLE_TRIP_MAX_SOLVE_TIME
-
-        solution = routing.SolveWithParameters(search_parameters)
+        # Setting first solution heuristic and metaheuristic.
+        params = search_parameters(config, self.SINGLE_TRIP_MAX_SOLVE_TIME)
+        if "seed" in config:
+            routing.solver().ReSeed(config["seed"])
+        monitor = EarlyStopping(routing, self.SINGLE_TRIP_MAX_SOLVE_TIME, self.early_stopping)
+        telemetry = None
+        if self.telemetry:
+            telemetry = SearchTelemetry(routing, time.time() - build_start)
+        if self.progress is not None:
+            ProgressReporter(
+                routing,
+                lambda solution: self.output_response(
+                    self.solution_routes(manager, routing, solution)
+                ),
+                self.progress,
+            )
 
-        data = dict()
+        # Solve the problem.
+        solution = routing.SolveWithParameters(params)
+        if telemetry is not None:
+            telemetry.stop()
 
         # generating response
         if solution:
-            full_plan, optimized_distance, init_distance = self.generate_output(
-                manager, routing, solution
-            )
+            data = self.output_response(self.solution_routes(manager, routing, solution))
             data["optimized_status"] = True
-            data["trips"] = full_plan
-            data["initial_distance"] = max(init_distance, 0)
-            data["optimized_distance"] = max(optimized_distance, 0)
-            data["initial_trip_duration"] = (
-                init_distance / self.AVG_SPEED
-            ) * 60  # in minutes
-            data["optimized_trip_duration"] = (
-                optimized_distance / self.AVG_SPEED
-            ) * 60  # in minutes
-
-            data["saved_distance"] = max(init_distance - optimized_distance, 0)  # in km
-            data["saved_time"] = (
-                data["saved_distance"] / self.AVG_SPEED
-            ) * 60  # in minutes
-
-            data["optimized_trip_duration"] = max(data["optimized_trip_duration"], 0)
-            data["initial_trip_duration"] = max(data["initial_trip_duration"], 0)
-            data["saved_time"] = max(data["saved_time"], 0)
-
+            data["proven_optimal"] = False
+            data["engine"] = "ortools"
+            data.update(monitor.summary())
+            data["objective"] = solution.ObjectiveValue()
+            if telemetry is not None:
+                data["telemetry"] = telemetry.summary()
             return data
 
         else:
+            data = dict()
             data["optimized_status"] = False
+            data["engine"] = "ortools"
+            data.update(monitor.summary())
+            if telemetry is not None:
+                data["telemetry"] = telemetry.summary()
             return data
 
 
@@ -1,10 +1,24 @@
-from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
 import math
+import time
 import random as rd
-from utils import possible_orderings
+from utils import possible_orderings, warehouse_loaded_orders, DISTANCE_SCALE
 import pprint
-from location_util_osm import location_to_latlong, distance_matrix
+from route_polish import local_problem, polish_solution
+from search_monitor import (
+    EarlyStopping,
+    GapStopping,
+    ProgressReporter,
+    SearchTelemetry,
+    STOP_TARGET_GAP,
+)
+from lower_bound import LowerBound, gap_summary
+from solver_portfolio import portfolio_configs, search_parameters, solve_portfolio
+from warm_start import initial_assignment, map_routes
+from fleet_sweep import required_nodes, restrict_fleet
+from fast_engine import solve_fast
+from solve_profiles import fit_deadline, response_deadline, solve_profile, solve_time_limit
+from location_util_osm import distance_matrix, MATRIX_FALLBACK
 import numpy as np
 import logging
 
@@ -40,6 +54,10 @@ class VRPSPDTW_ortools:
         """
             Important Note : make sure input validation is runned and data dict is in correct form.
         """
+        # search has to be finished by deadline of "respond_by" (see solve_profiles)
+        self.deadline = response_deadline(data)
+        self.solve_profile = data.get("solve_profile")
+        profile = solve_profile(data)
         self.AVG_SPEED = data.get("avg_speed", 50)  # in km/h
 
         self.ROUNDTRIP = data.get("round",1) # 0 if not round trip, 1 if it is; default value 1
@@ -49,15 +67,44 @@ class VRPSPDTW_ortools:
         self.DUTY_TIME = data.get("max_single_trip_duration", 8)  # in hr
 
         self.AVG_PICKUP_TIME = data.get("pickup_time", 0)  # in minutes
-        # converting time to distance
-        self.AVG_PICKUP_DISTANCE = (self.AVG_PICKUP_TIME / 60) * self.AVG_SPEED
+        # converting time to distance (in DISTANCE_SCALE units)
+        self.AVG_PICKUP_DISTANCE = int(
+            (self.AVG_PICKUP_TIME / 60) * self.AVG_SPEED * DISTANCE_SCALE
+        )
 
         self.n_orders = len(data["delivery_sizes"]) // 2
         self.user_max_time = data.get("max_solver_time", 20 * 60)  # in seconds: Change: Default solver time from  min to min
-        self.MAX_SOLVE_TIME = min( 
-            20 * 60, self.n_orders * 3, self.user_max_time
+        # (solve profile sets its own time budget, see solve_profiles)
+        self.MAX_SOLVE_TIME = solve_time_limit(
+            data, min(20 * 60, self.n_orders * 3, self.user_max_time)
         )  # in seconds : Change: Default solve time from  5 min to  20 min
+        # search configrations, more than one are solved in parallel (portfolio)
+        self.search_configs = portfolio_configs(data.get("portfolio"), profile)
+        # stopping search once objective stops improving (time limit is the ceiling)
+        self.early_stopping = data.get("early_stopping", profile.get("early_stopping"))
+        # called with every improving plan found during search
+        self.progress = None
+        # search telemetry (objective trace, counters, build / search time) in response
+        self.telemetry = data.get("telemetry", False)
+        # re-sequencing routes after search, "polish": false disables it
+        self.polish = data.get("polish", profile.get("polish"))
+        # "fast": savings construction + 2-opt / or-opt instead of ortools search (see fast_engine)
+        self.engine = data.get("engine", "ortools")
+        # search stops once plan is within target_gap percent of lower bound
+        self.target_gap = data.get("target_gap")
+        # lower bound of objective, started once (see lower_bound), partitions of
+        # decomposed requests ("report_gap": false) do not compute it
+        self.report_gap = data.get("report_gap", True)
+        self.bound = None
+        # fleet sweep candidate: only first fleet_limit vehicles are used (see fleet_sweep)
+        self.fleet_limit = None
+        self.stop_when_feasible = False
         self.data = self._preprocess(data)
+        # stored plan of recurring instance (see warm_start), mapped onto today's nodes
+        self.warm_start = data.get("warm_start_plan")
+        self.warm_routes = None
+        if self.warm_start:
+            self.warm_routes = map_routes(self.warm_start["steps"], data, self.data)
 
     def _preprocess(self, raw_data):
         """
@@ -67,21 +114,48 @@ class VRPSPDTW_ortools:
                 1. Adding dummy nodes
                 2. Adding positive and negative flows to maintain vehicle capacity
                 3. creating distance matrix
+                4. precomputing integer arc cost matrix
+
+            All distances are integers in DISTANCE_SCALE units
+
+            Delivery orders picked up at warehouse are loaded at start of route
+            (see warehouse_loaded_orders), they only have customer node and no
+            pickup and delivery pair. node_roles keeps operation of every node.
+
+            Optional per vehicle inputs (eg. re-optimization of running plan):
+                vehicle_start_locations : current location of vehicle (None if at warehouse),
+                                          vehicle starts from own start node
+                onboard_orders          : order ids already picked up by vehicle, only
+                                          their drop node is added and only that vehicle
+                                          can serve them
+                vehicle_available       : false for drivers which can not be used
         """
 
         def change_time_to_dist(time):
             """
                 converting time to distance scale
             """
-            return tuple(map(lambda x: int((x / 60) * self.AVG_SPEED), time))
+            return tuple(
+                map(lambda x: int((x / 60) * self.AVG_SPEED * DISTANCE_SCALE), time)
+            )
 
         data = {}
         data["locations"], data["pickups_deliveries"] = [raw_data["depot_location"]], []
         data["demands"] = [0]
         data["do_info"] = [("warehouse", "")]
+        data["node_roles"] = [""]
+        # order ids served on every node (more than one for aggregate nodes)
+        data["node_orders"] = [["warehouse"]]
+        # customer nodes of orders loaded at start of route
+        data["loaded_nodes"] = []
+        # drop node -> vehicle of orders already on vehicle
+        data["onboard_nodes"] = dict()
+        onboard = self._onboard_vehicles(raw_data)
+        # (pickup node, delivery node) of every order, pickup node is None if loaded
+        data["order_nodes"] = []
         # adding warehouse window to 24*7
         # this parameter is ignore and doesn't effect solver
-        data["time_windows"] = [(0, 24 * self.AVG_SPEED)]
+        data["time_windows"] = [(0, 24 * self.AVG_SPEED * DISTANCE_SCALE)]
         data["type_of_orders"] = raw_data["type_of_orders"]
         # converting timings to distance
         data["duty_time"] = list(map(change_time_to_dist, raw_data["duty_time"]))
@@ -100,23 +174,81 @@ class VRPSPDTW_ortools:
 
 
         
+        loaded_orders = warehouse_loaded_orders(raw_data)
+
+        # storage type of every order group (None if storage types are not provided)
+        data["group_storage"] = []
+        order_storage = raw_data.get("order_storage") or []
+
         cnt = 1
-        for i, k, do, order_type, time_window, handover_time in zip(
-            raw_data["locations_of_orders"],
-            raw_data["delivery_sizes"],
-            raw_data["do_numbers"],
-            raw_data["type_of_orders"],
-            raw_data["delivery_windows"],
-            raw_data["customer_handover_time"],
-        ):
+        for group in self._merge_orders(raw_data):
+            # aggregate node of co-located orders (or single order)
+            n = group[0]
+            data["group_storage"].append(
+                order_storage[n] if len(order_storage) == len(raw_data["do_numbers"]) else None
+            )
+            i = raw_data["locations_of_orders"][n]
+            do = raw_data["do_numbers"][n]
+            order_type = raw_data["type_of_orders"][n]
+            time_window = raw_data["delivery_windows"][n]
+            orders = [raw_data["do_numbers"][m] for m in group]
+            k = sum(math.ceil(raw_data["delivery_sizes"][m]) for m in group)
+            handover_times = [raw_data["customer_handover_time"][m] for m in group]
+            # orders on same stop are handed over once, unless REPEAT_HANDOVER
+            handover_time = (
+                sum(handover_times) if self.REPEAT_HANDOVER else max(handover_times)
+            )
+            pickup_distance = self.AVG_PICKUP_DISTANCE * (
+                len(group) if self.REPEAT_HANDOVER else 1
+            )
+
+            if do in onboard and order_type:
+                # picked up from customer already, only warehouse drop node
+                data["locations"].append(i[1])
+                data["onboard_nodes"][cnt] = onboard[do]
+                data["order_nodes"].append((None, cnt))
+                data["do_info"].append((do, "deliver"))
+                data["node_orders"].append(orders)
+                data["node_roles"].append("deliver")
+                data["demands"].append(-math.ceil(k))
+                data["time_windows"].append(data["warehouse_drop_time"])
+                data["extra_distance"].append(pickup_distance)
+                cnt += 1
+                continue
+
+            if n in loaded_orders or do in onboard:
+                # depot loading step (or already on vehicle), only customer node
+                # with negative demand
+                data["locations"].append(i[1])
+                if do in onboard:
+                    data["onboard_nodes"][cnt] = onboard[do]
+                else:
+                    data["loaded_nodes"].append(cnt)
+                data["order_nodes"].append((None, cnt))
+                data["do_info"].append((do, "deliver"))
+                data["node_orders"].append(orders)
+                data["node_roles"].append("deliver")
+                data["demands"].append(-math.ceil(k))
+                data["time_windows"].append(change_time_to_dist(time_window))
+                data["extra_distance"].append(
+                    int((handover_time / 60) * self.AVG_SPEED * DISTANCE_SCALE)
+                )
+                cnt += 1
+                continue
+
             data["locations"].append(i[0])
             data["locations"].append(i[1])
             data["pickups_deliveries"].append([cnt, cnt + 1])
+            data["order_nodes"].append((cnt, cnt + 1))
             data["do_info"].append((do, "pickup"))
             data["do_info"].append((do, "deliver"))
+            data["node_orders"].append(orders)
+            data["node_orders"].append(orders)
+            data["node_roles"].append("pickup")
+            data["node_roles"].append("deliver")
             # positive and negative demand
-            data["demands"].append(k)
-            data["demands"].append(-k)
+            data["demands"].append(math.ceil(k))
+            data["demands"].append(-math.ceil(k))
 
             # creatingtime constraints for locations from inputs
             # extra)distance represent either pickup time or handover time
@@ -129,9 +261,9 @@ class VRPSPDTW_ortools:
                     
                 data["time_windows"].append(data["warehouse_drop_time"])
                 data["extra_distance"].append(
-                    int((handover_time / 60) * self.AVG_SPEED)
+                    int((handover_time / 60) * self.AVG_SPEED * DISTANCE_SCALE)
                 )
-                data["extra_distance"].append(self.AVG_PICKUP_DISTANCE)
+                data["extra_distance"].append(pickup_distance)
             else:  # deliver
                 
                 if not self.REPEAT_HANDOVER:
@@ -139,9 +271,9 @@ class VRPSPDTW_ortools:
                     
                 data["time_windows"].append(data["warehouse_pickup_time"])
                 data["time_windows"].append(change_time_to_dist(time_window))
-                data["extra_distance"].append(self.AVG_PICKUP_DISTANCE)
+                data["extra_distance"].append(pickup_distance)
                 data["extra_distance"].append(
-                    int((handover_time / 60) * self.AVG_SPEED)
+                    int((handover_time / 60) * self.AVG_SPEED * DISTANCE_SCALE)
                 )
 
             cnt += 2
@@ -149,15 +281,36 @@ class VRPSPDTW_ortools:
 
 
 
+        # start node of every vehicle, warehouse unless vehicle is on the way
+        data["vehicle_starts"] = [0] * raw_data["no_vehicles"]
+        for vehicle_id, location in enumerate(raw_data.get("vehicle_start_locations") or []):
+            if location and location != raw_data["depot_location"]:
+                data["vehicle_starts"][vehicle_id] = cnt
+                data["locations"].append(location)
+                data["do_info"].append(("warehouse", ""))
+                data["node_orders"].append(["warehouse"])
+                data["node_roles"].append("")
+                data["demands"].append(0)
+                data["time_windows"].append(data["duty_time"][vehicle_id])
+                data["extra_distance"].append(0)
+                cnt += 1
+        data["vehicle_available"] = raw_data.get("vehicle_available") or [
+            True
+        ] * raw_data["no_vehicles"]
+
         # calculating distance matix
-        data["distance_matrix"] = distance_matrix(data["locations"])
+        # (reusing road distances of previous plan if given)
+        data["distance_matrix"] = distance_matrix(
+            data["locations"],
+            mode=raw_data.get("distance_mode", "road"),
+            fallback=raw_data.get("matrix_fallback", MATRIX_FALLBACK),
+            base=raw_data.get("reuse_matrix"),
+        )
+
+        data["travel_matrix"], data["transit_matrix"] = self._transit_matrices(data)
 
-        #if not a round-trip -> tweaking the distance matrix accordingly
-        if not self.ROUNDTRIP:
-            for row in data["distance_matrix"]:
-                row[0] = 0
         data["num_vehicles"] = raw_data["no_vehicles"]
-        data["vehicle_capacities"] = raw_data["capacity_of_vehicles"]
+        data["vehicle_capacities"] = list(map(int, raw_data["capacity_of_vehicles"]))
         data["depot"] = 0
 
         try:
@@ -168,30 +321,228 @@ class VRPSPDTW_ortools:
             logger.exception(e)
             logger.debug("Storage type not provided")
 
+        self._presolve(data)
+
         return data
 
-    def generate_output(self, manager, routing, solution):
+    def _presolve(self, data):
         """
-            generate output plannig dict from optimized response
+            Vectorized feasibility and reduction pass before search
+
+            For every vehicle and node, earliest arrival (leaving start node at duty start)
+            and latest departure (returning to warehouse by duty end) are propagated from
+            vehicle start and along pickup -> delivery pairs. Then
+                1. order groups which no vehicle can serve are excluded with reason:
+                   storage type not carried, demand over every capacity, no available
+                   driver or delivery window not reachable within any driver's duty time
+                2. node windows are tightened to earliest arrival / latest departure
+                   over vehicles which can serve the order
+                3. vehicles which can not serve an order (storage type, capacity,
+                   availability, duty time) are removed from order's vehicle domain,
+                   orders on vehicle are only served by that vehicle
+
+            data["infeasible_groups"] : group index -> reason
+            data["group_vehicles"]    : allowed vehicles of every group (None if all)
         """
-        
-        #Only include those vehicles in consideration for certain orders which
-        #have the required storage type
-        #If storage type is not 
-        try:
-            for k in range(len(self.data["order_storage"])):
-                temp_drivers = [-1]
-                for i in range(len(self.data["vehicle_storage"])):
-                    if self.data["order_storage"][k] in self.data["vehicle_storage"][i]:
-                        temp_drivers.append(i)
-                index = manager.NodeToIndex(k)
-                routing.VehicleVar(index).SetValues(temp_drivers)
+        transit = data["transit_matrix"]
+        windows = np.array(data["time_windows"], dtype=np.int64)
+        duty = np.array(data["duty_time"], dtype=np.int64).reshape(-1, 2)
+        starts, ends = duty[:, 0], duty[:, 1]
+        warehouse_start, warehouse_end = data["warehouse_pickup_time"]
+
+        loaded = np.zeros(len(windows), dtype=bool)
+        loaded[data["loaded_nodes"]] = True
+        # orders loaded at start of route -> vehicle leaves in warehouse pickup window
+        leave = np.where(
+            loaded[None, :], np.maximum(starts, warehouse_start)[:, None], starts[:, None]
+        )
 
-        except Exception as e:
-            logger.exception(e)
-            logger.debug("Storage type not provided")
+        # vehicles x nodes
+        vehicle_starts = np.array(data["vehicle_starts"], dtype=np.int64)
+        arrival = np.maximum(windows[None, :, 0], leave + transit[vehicle_starts])
+        departure = np.minimum(windows[None, :, 1], ends[:, None] - transit[:, 0][None, :])
+        pairs = np.array(data["pickups_deliveries"], dtype=np.int64).reshape(-1, 2)
+        if len(pairs):
+            pickups, deliveries = pairs[:, 0], pairs[:, 1]
+            pair_transit = transit[pickups, deliveries]
+            arrival[:, deliveries] = np.maximum(
+                arrival[:, deliveries], arrival[:, pickups] + pair_transit
+            )
+            departure[:, pickups] = np.minimum(
+                departure[:, pickups], departure[:, deliveries] - pair_transit
+            )
+        reachable = arrival <= departure
+        reachable[:, loaded] &= (
+            (np.maximum(starts, warehouse_start) <= np.minimum(ends, warehouse_end))
+            # vehicles on the way can not load at warehouse anymore
+            & (vehicle_starts == 0)
+        )[:, None]
+        available = np.array(data["vehicle_available"], dtype=bool)
+
+        vehicle_storage = data.get("vehicle_storage") or []
+        capacities = np.array(data["vehicle_capacities"])
+        data["infeasible_groups"] = dict()
+        data["group_vehicles"] = []
+        for g, (nodes, storage) in enumerate(zip(data["order_nodes"], data["group_storage"])):
+            nodes = [node for node in nodes if node is not None]
+            demand = max(abs(data["demands"][node]) for node in nodes)
+            storage_ok = np.array(
+                [
+                    storage is None
+                    or len(vehicle_storage) != len(capacities)
+                    or storage in vehicle_storage[v]
+                    for v in range(len(capacities))
+                ]
+            )
+            capacity_ok = capacities >= demand
+            usable = available.copy()
+            if nodes[-1] in data["onboard_nodes"]:
+                usable &= np.arange(len(capacities)) == data["onboard_nodes"][nodes[-1]]
+            allowed = storage_ok & capacity_ok & usable & reachable[:, nodes].all(axis=1)
+
+            if not storage_ok.any():
+                reason = f"no vehicle carries storage type {storage}"
+            elif not (capacity_ok & storage_ok).any():
+                reason = "quantity exceeds capacity of every vehicle"
+            elif not (capacity_ok & storage_ok & usable).any():
+                reason = "no available driver can serve the order"
+            elif not allowed.any():
+                reason = "delivery window can not be reached within any driver's duty time"
+            else:
+                reason = None
 
+            if reason is not None:
+                data["infeasible_groups"][g] = reason
+                data["group_vehicles"].append(None)
+                continue
+
+            data["group_vehicles"].append(
+                None if allowed.all() else np.flatnonzero(allowed).tolist()
+            )
+            # tightening windows over vehicles which can serve the order
+            for node in nodes:
+                data["time_windows"][node] = (
+                    int(arrival[allowed, node].min()),
+                    int(departure[allowed, node].max()),
+                )
+
+        if data["infeasible_groups"]:
+            logger.info(f"presolve excluded order groups {data['infeasible_groups']}")
+
+    @staticmethod
+    def _onboard_vehicles(raw_data):
+        """
+            order id -> vehicle of orders already on vehicles
+        """
+        return {
+            order_id: vehicle_id
+            for vehicle_id, orders in enumerate(raw_data.get("onboard_orders") or [])
+            for order_id in orders
+        }
+
+    def _merge_orders(self, raw_data):
+        """
+            Group orders sharing source, destination, order type, delivery window and
+            storage type, each group is served as one aggregate node with summed demand.
+            Sum of group's demand must fit into smallest eligible vehicle (vehicle with
+            order's storage type), otherwise a new group is started.
 
+            return list of groups (list of order indexes), "merge_orders": false in
+            request keeps every order as separate group
+        """
+        n_orders = len(raw_data["do_numbers"])
+        if not raw_data.get("merge_orders", True):
+            return [[n] for n in range(n_orders)]
+
+        capacities = raw_data["capacity_of_vehicles"]
+        order_storage = raw_data.get("order_storage") or []
+        vehicle_storage = raw_data.get("vehicle_storage") or []
+        with_storage = len(order_storage) == n_orders and len(vehicle_storage) == len(
+            capacities
+        )
+
+        onboard = self._onboard_vehicles(raw_data)
+        groups = []
+        open_groups = dict()  # key -> (group, load)
+        for n in range(n_orders):
+            storage = order_storage[n] if with_storage else None
+            key = (
+                tuple(raw_data["locations_of_orders"][n]),
+                raw_data["type_of_orders"][n],
+                tuple(raw_data["delivery_windows"][n]),
+                storage,
+                onboard.get(raw_data["do_numbers"][n]),
+            )
+            eligible = [
+                capacity
+                for v, capacity in enumerate(capacities)
+                if not with_storage or storage in vehicle_storage[v]
+            ]
+            size = math.ceil(raw_data["delivery_sizes"][n])
+
+            group, load = open_groups.get(key, (None, 0))
+            if group is not None and load + size <= min(eligible, default=0):
+                group.append(n)
+                open_groups[key] = (group, load + size)
+            else:
+                group = [n]
+                groups.append(group)
+                open_groups[key] = (group, size)
+
+        if len(groups) < n_orders:
+            logger.info(f"merged {n_orders} orders into {len(groups)} aggregate nodes")
+        return groups
+
+    def _transit_matrices(self, data):
+        """
+            Precompute travel and arc cost matrices between all nodes, so that
+            ortools never calls back into python during search.
+
+            arc cost = travel distance
+                        + handover distance (if next node is delivery)
+                        + pickup distance (if next node is pickup)
+            If not REPEAT_HANDOVER, handover/pickup distance is not added for
+            consecutive stops on same location (including warehouse).
+        """
+        travel = data["distance_matrix"].node_matrix().astype(np.int64)
+        travel = travel * DISTANCE_SCALE // 1000  # distance matrix is in meters
+
+        # if not a round-trip -> returning to warehouse is not counted
+        if not self.ROUNDTRIP:
+            travel[:, 0] = 0
+
+        service = np.tile(
+            np.array(data["extra_distance"], dtype=np.int64), (len(travel), 1)
+        )
+        if not self.REPEAT_HANDOVER:
+            service[travel == 0] = 0
+        service[:, 0] = 0
+
+        return travel, travel + service
+
+    def restrict_vehicles(self, manager, routing):
+        """
+            Only include those vehicles in consideration for orders which have the
+            required storage type, capacity and duty time (from presolve), applied
+            on both pickup and delivery node before search. Orders no vehicle can
+            serve are never visited.
+        """
+        for g, nodes in enumerate(self.data["order_nodes"]):
+            for node in nodes:
+                if node is None:
+                    continue
+                index = manager.NodeToIndex(node)
+                if g in self.data["infeasible_groups"]:
+                    routing.ActiveVar(index).SetValue(0)
+                elif self.data["group_vehicles"][g] is not None:
+                    routing.VehicleVar(index).SetValues(
+                        [-1] + self.data["group_vehicles"][g]
+                    )
+
+    def generate_output(self, manager, routing, solution):
+        """
+            generate output plannig dict from optimized response
+        """
         full_plan = []
         distance_covered_by_vehicles = []
         max_capacity_used_by_vehicles = []
@@ -199,112 +550,83 @@ class VRPSPDTW_ortools:
         final_working_time = []
 
         distance_dimension = routing.GetDimensionOrDie("Distance")
+        loaded_nodes = set(self.data["loaded_nodes"])
 
         for vehicle_id in range(self.data["num_vehicles"]):
             index = routing.Start(vehicle_id)
             vehicle_plan = []
+            route_nodes = []
             route_distance = 0
-            cap = 0
-            max_cap = 0
-            total_handover_excluded = 0
             distance_spend_on_pickup = 0
             distance_spend_on_handover = 0
             while not routing.IsEnd(index):
                 actual_id = manager.IndexToNode(index)
+                route_nodes.append(actual_id)
 
                 distance_var = distance_dimension.CumulVar(index)
 
-                order_id, operation = self.data["do_info"][actual_id]
-                # appending trip information
+                _, operation = self.data["do_info"][actual_id]
+                # appending trip information, aggregate node is split back into orders
                 # estimated time is to complete including operation
-                vehicle_plan.append(
-                    {
-                        "operation": operation,
-                        "order_id": order_id,
-                        "estimated_time": (solution.Max(distance_var) / self.AVG_SPEED)
-                        * 60,
-                    }
-                )
+                estimated_time = (
+                    solution.Max(distance_var) / DISTANCE_SCALE / self.AVG_SPEED
+                ) * 60
+                for order_id in self.data["node_orders"][actual_id]:
+                    vehicle_plan.append(
+                        {
+                            "operation": operation,
+                            "order_id": order_id,
+                            "estimated_time": estimated_time,
+                        }
+                    )
 
-                previous_index = index
                 index = solution.Value(routing.NextVar(index))
+                next_id = manager.IndexToNode(index)
 
-                # removing handover time where we have contiouns delivery to same location
-                handover_excluded_flag = False
-                pickup_exlucded_flag = False
-                
-                if not self.REPEAT_HANDOVER:
-                    if (
-                        index % 2 == 0
-                        and index != 0
-                        and not routing.IsEnd(index)
-                        and self.data["distance_matrix"][previous_index][index] == 0
-                    ):
-                        total_handover_excluded += 1
-                        handover_excluded_flag = True
-
-                    if (
-                        index % 2 == 1
-                        and index not in self.warehouse_locations_set
-                        and not routing.IsEnd(index)
-                        and self.data["distance_matrix"][previous_index][index] == 0
-                    ):
-                        pickup_exlucded_flag = True
-                        # total_handover_excluded += 1
-                else:
-                    if (
-                        index % 2 == 0
-                        and index != 0
-                        and not routing.IsEnd(index)
-                        #and self.data["distance_matrix"][previous_index][index] == 0
-                    ):
-                        total_handover_excluded += 1
-                        handover_excluded_flag = True
-
-                    if (
-                        index % 2 == 1
-                        #and index not in self.warehouse_locations_set
-                        and not routing.IsEnd(index)
-                        #and self.data["distance_matrix"][previous_index][index] == 0
-                    ):
-                        # total_handover_excluded += 1
-                        pickup_exlucded_flag = True
-                
-                route_distance += routing.GetArcCostForVehicle(
-                    previous_index, index, vehicle_id
-                )
-                # removing handover distance from travel distance
-                remove_handover_distance = (
-                    self.data["extra_distance"][index]
-                    if not routing.IsEnd(index)
-                    and index % 2 == 0
-                    and not handover_excluded_flag
-                    else 0
-                )
-                # removing pickup distance from travel distance
-                remove_pickup_distance = (
-                    self.data["extra_distance"][index]
-                    if not routing.IsEnd(index) and index % 2 == 1
-                    and not pickup_exlucded_flag
-                    else 0
-                )
-
-                route_distance = route_distance - (
-                    remove_pickup_distance + remove_handover_distance
+                # splitting arc cost into travel and handover/pickup distance
+                travel_distance = int(self.data["travel_matrix"][actual_id, next_id])
+                service_distance = (
+                    int(self.data["transit_matrix"][actual_id, next_id]) - travel_distance
                 )
-                # calculating total handover and pickup distance for further calculating
-                distance_spend_on_handover += remove_handover_distance
-                distance_spend_on_pickup += remove_pickup_distance
-                # calculating current vehicle capacity
-                cap += self.data["demands"][actual_id]
-                max_cap = max(cap, max_cap)
+                route_distance += travel_distance
+                if self.data["node_roles"][next_id] == "pickup":
+                    distance_spend_on_pickup += service_distance
+                else:
+                    distance_spend_on_handover += service_distance
 
             distance_var = distance_dimension.CumulVar(index)
             final_working_time.append(
-                (solution.Max(distance_var) / self.AVG_SPEED) * 60
+                (solution.Max(distance_var) / DISTANCE_SCALE / self.AVG_SPEED) * 60
             )
 
-            full_plan.append(vehicle_plan[1:])
+            # orders loaded at start of route are picked up when leaving warehouse
+            loaded = [node for node in route_nodes if node in loaded_nodes]
+            loading_plan = [
+                {
+                    "operation": "pickup",
+                    "order_id": order_id,
+                    "estimated_time": vehicle_plan[0]["estimated_time"],
+                }
+                for node in loaded
+                for order_id in self.data["node_orders"][node]
+            ]
+            full_plan.append(loading_plan + vehicle_plan[1:])
+
+            # calculating vehicle capacity, starting with loaded and onboard orders
+            cap = -sum(
+                self.data["demands"][node]
+                for node in route_nodes
+                if node in loaded_nodes or node in self.data["onboard_nodes"]
+            )
+            max_cap = cap
+            for node in route_nodes:
+                cap += self.data["demands"][node]
+                max_cap = max(cap, max_cap)
+
+            # converting distances to km
+            route_distance = route_distance / DISTANCE_SCALE
+            distance_spend_on_handover = distance_spend_on_handover / DISTANCE_SCALE
+            distance_spend_on_pickup = distance_spend_on_pickup / DISTANCE_SCALE
             # covertnig distance to time
             time_spend_on_distance = (route_distance / self.AVG_SPEED) * 60
             time_spend_on_handover = (distance_spend_on_handover * 60) / self.AVG_SPEED
@@ -329,87 +651,298 @@ class VRPSPDTW_ortools:
             final_working_time,
         )
 
-    def solve(self):
+    def output_response(self, manager, routing, solution):
+        """
+            generate output response dict from given solution
+            (final solution or solution being found during search)
+        """
+        (
+            full_plan,
+            distance_covered_by_vehicles,
+            max_capacity_used_by_vehicles,
+            total_working_hour_of_vehicles,
+            final_working_time,
+        ) = self.generate_output(manager, routing, solution)
+
+        # creating output response dict
+        data = dict()
+
+        total_optimized_distance = sum(distance_covered_by_vehicles)
+        data["optimized_distance"] = total_optimized_distance
+        # road distances or great circle estimates
+        data["distance_source"] = self.data["distance_matrix"].source
+        # osrm / route cache pair counts of matrix (None for estimates and reused matrix)
+        data["route_cache"] = getattr(self.data["distance_matrix"], "route_stats", None)
+        data["no_driver_utilized"] = sum([1 for plan in full_plan if len(plan) > 0])
+
+        # data["trips"] = full_plan
+        # data["total_working_hour_of_vehicles"] = []
+
+        # for dist_time, drop_time, pickup_time in total_working_hour_of_vehicles:
+        #     temp_dict = dict()
+        #     temp_dict["time_spend_on_driving"] = dist_time
+        #     temp_dict["time_spend_on_pickup"] = pickup_time
+        #     temp_dict["time_spend_on_drop"] = drop_time
+        #     data["total_working_hour_of_vehicles"].append(temp_dict)
+
+        # data["driver_trip_completed_time"] = final_working_time
+        # data["optimized_trip_duration"] = max(final_working_time)
+
+        # data["max_capacity_used_by_vehicles"] = max_capacity_used_by_vehicles
+        # avg_load = list(filter(lambda x: x > 0, max_capacity_used_by_vehicles))
+
+        # data["distance_covered_by_vehicles"] = distance_covered_by_vehicles
+
+        # generating nested dict for output response
+        # check API documentation
+        data["driver_trips"] = []
+        for (
+            trip,
+            working_hours,
+            distance_covered,
+            max_cap,
+            duty_complete_time,
+        ) in zip(
+            full_plan,
+            total_working_hour_of_vehicles,
+            distance_covered_by_vehicles,
+            max_capacity_used_by_vehicles,
+            final_working_time,
+        ):
+            temp_dict = dict()
+            temp_dict["trip_detail"] = trip
+
+            temp_vehicle_dict = dict()
+            temp_vehicle_dict["max_capacity_used"] = max_cap
+            temp_vehicle_dict["distance_covered"] = distance_covered
+            temp_dict["vehicle"] = temp_vehicle_dict
+
+            temp_driver_dict = dict()
+            temp_driver_dict["duty_completed_time"] = duty_complete_time
+            temp_driver_dict["time_spend_on_driving"] = working_hours[0]
+            temp_driver_dict["time_spend_on_drop"] = working_hours[1]
+            temp_driver_dict["time_spend_on_pickup"] = working_hours[2]
+            temp_dict["driver"] = temp_driver_dict
+
+            data["driver_trips"].append(temp_dict)
+
+        (
+            data["all_possible_orderings"],
+            data["tried_orderings"],
+        ) = possible_orderings(len(self.data["demands"][1:]) // 2)
+
+        # clamping values
+        def clamp(A, min_val, max_val):
+            return sorted([A, min_val, max_val])[1]
+
+        data["optimized_distance"] = max(data["optimized_distance"], 0)
+
+        # calculating dropped orders
+        total_orders = set(
+            [order_id for orders in self.data["node_orders"] for order_id in orders]
+        )
+        completed_orders = set(
+            [orders["order_id"] for trip in full_plan for orders in trip]
+        )
+
+        # orders excluded by presolve with reason
+        data["infeasible_orders"] = [
+            {"order_id": order_id, "reason": reason}
+            for g, reason in self.data["infeasible_groups"].items()
+            for node in self.data["order_nodes"][g][-1:]
+            for order_id in self.data["node_orders"][node]
+        ]
+
+        # if solver dropped any order due to penalty
+        data["dropped_orders_by_solver"] = list(
+            total_orders - completed_orders - set(["warehouse"])
+        )
+
+        return data
+
+    def route_limits(self):
+        """
+            duty time of every vehicle (in DISTANCE_SCALE units)
+        """
+        return [end - start for start, end in self.data["duty_time"]]
+
+    def polish_problem(self, vehicle_id, route):
+        """
+            single vehicle re-sequencing problem of route (see route_polish),
+            vehicle leaves warehouse within warehouse pickup window if orders are loaded
+        """
+        # routes of vehicles on the way do not start at warehouse
+        if self.data["vehicle_starts"][vehicle_id] != self.data["depot"]:
+            return None
+        start_window = self.data["duty_time"][vehicle_id]
+        if set(route) & set(self.data["loaded_nodes"]):
+            start_window = (
+                max(start_window[0], self.data["warehouse_pickup_time"][0]),
+                min(start_window[1], self.data["warehouse_pickup_time"][1]),
+            )
+        return local_problem(
+            self.data["transit_matrix"],
+            route,
+            self.data["pickups_deliveries"],
+            self.data["demands"],
+            self.data["vehicle_capacities"][vehicle_id],
+            loaded_nodes=self.data["loaded_nodes"] + list(self.data["onboard_nodes"]),
+            windows=self.data["time_windows"],
+            start_window=start_window,
+            end_window=self.data["duty_time"][vehicle_id],
+        )
+
+    def warm_start_assignment(self, manager, routing):
+        """
+            initial solution from stored plan of recurring instance, orders which
+            can not be served by their stored vehicle today are inserted again
+            with new orders (cheapest insertion)
+        """
+        node_groups = {
+            node: g
+            for g, nodes in enumerate(self.data["order_nodes"])
+            for node in nodes
+            if node is not None
+        }
+
+        def allowed(node, vehicle_id):
+            g = node_groups[node]
+            vehicles = self.data["group_vehicles"][g]
+            return g not in self.data["infeasible_groups"] and (
+                vehicles is None or vehicle_id in vehicles
+            )
+
+        routes = [
+            [node for node in route if allowed(node, vehicle_id)]
+            for vehicle_id, route in enumerate(self.warm_routes)
+        ]
+        groups = [
+            g
+            for g in range(len(self.data["order_nodes"]))
+            if g not in self.data["infeasible_groups"]
+        ]
+        assignment, inserted = initial_assignment(
+            manager,
+            routing,
+            routes,
+            [self.data["order_nodes"][g] for g in groups],
+            self.data["transit_matrix"],
+            [self.data["group_vehicles"][g] for g in groups],
+            self.data["vehicle_starts"],
+        )
+        summary = {
+            "task_id": self.warm_start["task_id"],
+            "overlap": self.warm_start["overlap"],
+            "used": assignment is not None,
+            "inserted_orders": inserted,
+        }
+        logger.info(f"warm start: {summary}")
+        return assignment, summary
+
+    def drop_penalty(self):
+        """
+            penalty of dropping one node of an order
+        """
+        return int(
+            (
+                # self.AVG_SPEED
+                int(self.data["travel_matrix"].max())
+                + self.AVG_PICKUP_DISTANCE
+                + max(self.data["extra_distance"])
+            )
+        )
+
+    def lower_bound(self):
+        """
+            LowerBound of objective, started on first call and shared by portfolio
+            members and fleet sweep candidates, None if gap is not reported
+        """
+        if self.bound is None and self.report_gap:
+            self.bound = LowerBound(self.bound_problem())
+        return self.bound
+
+    def bound_problem(self):
+        """
+            assignment relaxation of routing model (see lower_bound.assignment_bound),
+            orders presolve excluded are never visited and always pay their penalty
+        """
+        penalty = self.drop_penalty()
+        nodes, penalties, fixed = [], [], 0
+        for g, (pickup_node, delivery_node) in enumerate(self.data["order_nodes"]):
+            if pickup_node is None:
+                group, node_penalty = [delivery_node], 2 * penalty
+            else:
+                group, node_penalty = [pickup_node, delivery_node], penalty
+            if g in self.data["infeasible_groups"]:
+                fixed += node_penalty * len(group)
+                continue
+            nodes += group
+            penalties += [node_penalty] * len(group)
+        return {
+            "transit": self.data["transit_matrix"],
+            "nodes": nodes,
+            "starts": self.data["vehicle_starts"],
+            "depot": self.data["depot"],
+            "penalties": penalties,
+            "fixed": fixed,
+        }
+
+    def fast_data(self):
+        """
+            preprocessed data for fast engine (see fast_engine)
+        """
+        return self.data
+
+    def solve(self, progress=None):
         """
         solving optimization
+        if portfolio is requested, all search configrations are solved in parallel processes
+        on the same preprocessed data and best solution is returned
+
+        progress(data) is called with improving intermediate plans during search
+        (it must be picklable, to be used by parallel portfolio processes)
+        """
+        self.progress = progress
+        budget = fit_deadline(self, "MAX_SOLVE_TIME")
+        # bound is computed while searching
+        self.lower_bound()
+        if self.engine == "fast":
+            data = solve_fast(self)
+        elif len(self.search_configs) > 1:
+            data = solve_portfolio(self, self.search_configs)
+        else:
+            data = self.solve_with_config(self.search_configs[0])
+        data["solve_budget"] = budget
+        return data
+
+    def build_model(self):
+        """
+        routing model of preprocessed data with all constraints, without search parameters
+        return (manager, routing)
         """
         manager = pywrapcp.RoutingIndexManager(
             len(self.data["distance_matrix"]),
             self.data["num_vehicles"],
-            self.data["depot"],
+            self.data["vehicle_starts"],
+            [self.data["depot"]] * self.data["num_vehicles"],
         )
 
         # Create Routing Model.
         routing = pywrapcp.RoutingModel(manager)
 
         # Define cost of each arc.
-        def distance_callback(from_index, to_index):
-            """Returns the distance between the two nodes."""
-            # Convert from routing variable Index to distance matrix NodeIndex.
-            from_node = manager.IndexToNode(from_index)
-            to_node = manager.IndexToNode(to_index)
-            
-            if not self.REPEAT_HANDOVER:
-                # if to_node location is customers where we have to handover time
-                handover_time = (
-                    self.data["extra_distance"][to_node]
-                    if (
-                        to_node % 2 == 0
-                        and to_node != 0
-                        and self.data["distance_matrix"][from_node][to_node] != 0
-                    )
-                    else 0
-                )
-                # if to_node location has pickup operation
-                pickup_time = (
-                    self.data["extra_distance"][to_node] if to_node % 2 == 1 else 0
-                )
-                # removing pickup distance from same locations including warehouse
-                delta_pickup_time = (
-                    self.data["extra_distance"][to_node] 
-                    if (to_node % 2 == 1 #and to_node not in self.warehouse_locations_set #if want to add every pickup time at warehouse, uncomment
-                        and self.data["distance_matrix"][from_node][to_node] == 0 ) 
-                    else 0
-                )
-                
-            else:
-                handover_time = (
-                    self.data["extra_distance"][to_node]
-                    if (
-                        to_node % 2 == 0
-                        and to_node != 0
-                        #and self.data["distance_matrix"][from_node][to_node] != 0
-                    )
-                    else 0
-                )
-                # if to_node location has pickup operation
-                pickup_time = (
-                    self.data["extra_distance"][to_node] if to_node % 2 == 1 else 0
-                )
-                
-                # delta was to remove the extra pickup time from same location, which will be zero here in case we require each additional handover to be added.
-                #In case you need to add additional handover on top of the one provided, to add dynamically
-                #Assign a negative value to delta_pickup_time or any function which outputs negative value
-                delta_pickup_time = 0
-                
-                
-            # returning total distance
-            return (
-                self.data["distance_matrix"][from_node][to_node]
-                + handover_time
-                + pickup_time
-                - delta_pickup_time
-            )
-
-        transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+        # (precomputed matrix, no python callback during search)
+        transit_callback_index = routing.RegisterTransitMatrix(
+            self.data["transit_matrix"].tolist()
+        )
         routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
 
         # Add Distance constraint.
         dimension_name = "Distance"
         routing.AddDimension(
             transit_callback_index,
-            24 * self.AVG_SPEED,  # waiting time
-            24 * self.AVG_SPEED,  # vehicle maximum travel distance
+            24 * self.AVG_SPEED * DISTANCE_SCALE,  # waiting time
+            24 * self.AVG_SPEED * DISTANCE_SCALE,  # vehicle maximum travel distance
             False,  # start cumul to zero
             dimension_name,
         )
@@ -428,27 +961,24 @@ class VRPSPDTW_ortools:
                 <= distance_dimension.CumulVar(delivery_index)
             )
 
-        def demand_callback(from_index):
-            """Returns the demand of the node."""
-            # Convert from routing variable Index to demands NodeIndex.
-            from_node = manager.IndexToNode(from_index)
-            return self.data["demands"][from_node]
-
-        demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
+        demand_callback_index = routing.RegisterUnaryTransitVector(self.data["demands"])
 
         routing.AddDimensionWithVehicleCapacity(
             demand_callback_index,
             0,  # null capacity slack
             self.data["vehicle_capacities"],  # vehicle maximum capacities
-            True,  # start cumul to zero
+            # start cumul is load of orders loaded at start of route (or onboard)
+            not (self.data["loaded_nodes"] or self.data["onboard_nodes"]),
             "Capacity",
         )
 
         # adding timing constraints
         # --------------------------------------------
         # adding locations timing constraints
+        start_nodes = set(self.data["vehicle_starts"])
         for location_idx, time_window in enumerate(self.data["time_windows"]):
-            if location_idx == 0:
+            # vehicle start nodes are bound by duty time
+            if location_idx == 0 or location_idx in start_nodes:
                 continue
             index = manager.NodeToIndex(location_idx)
             distance_dimension.CumulVar(index).SetRange(time_window[0], time_window[1])
@@ -462,6 +992,21 @@ class VRPSPDTW_ortools:
             index = routing.End(vehicle_id)
             distance_dimension.CumulVar(index).SetRange(*time_window)
 
+        # orders loaded at start of route -> vehicle leaves warehouse in warehouse pickup window
+        if self.data["loaded_nodes"]:
+            solver = routing.solver()
+            start_cumuls = [
+                distance_dimension.CumulVar(routing.Start(vehicle_id))
+                for vehicle_id in range(self.data["num_vehicles"])
+            ]
+            # start of "no vehicle" for dropped orders (vehicle var is -1)
+            unperformed_start = solver.IntVar(*self.data["warehouse_pickup_time"])
+            for node in self.data["loaded_nodes"]:
+                vehicle = routing.VehicleVar(manager.NodeToIndex(node))
+                start = solver.Element([unperformed_start] + start_cumuls, (vehicle + 1).Var())
+                solver.Add(start >= self.data["warehouse_pickup_time"][0])
+                solver.Add(start <= self.data["warehouse_pickup_time"][1])
+
         # adding condition to complete trip in less time
         for i in range(self.data["num_vehicles"]):
             routing.AddVariableMinimizedByFinalizer(
@@ -471,130 +1016,101 @@ class VRPSPDTW_ortools:
                 distance_dimension.CumulVar(routing.End(i))
             )
 
+        # storage type, capacity and duty time restrictions from presolve
+        self.restrict_vehicles(manager, routing)
+
         # --------------------------------------------------------------------
         # penatly
-        penalty = int(
-            (
-                # self.AVG_SPEED
-                max([max(row) for row in self.data["distance_matrix"]])
-                + self.AVG_PICKUP_DISTANCE
-                + max(self.data["extra_distance"])
-            )
-        )
+        penalty = self.drop_penalty()
 
-        for node in range(1, len(self.data["distance_matrix"])):
-            routing.AddDisjunction([manager.NodeToIndex(node)], penalty)
+        # dropping order loaded at start of route (or onboard) costs same as
+        # dropping both pickup and delivery nodes
+        for pickup_node, delivery_node in self.data["order_nodes"]:
+            if pickup_node is None:
+                routing.AddDisjunction([manager.NodeToIndex(delivery_node)], 2 * penalty)
+                continue
+            routing.AddDisjunction([manager.NodeToIndex(pickup_node)], penalty)
+            routing.AddDisjunction([manager.NodeToIndex(delivery_node)], penalty)
 
         # ---------------------------------------------------------------------
 
-        # Setting first solution heuristic.
-        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-        search_parameters.first_solution_strategy = (
-            routing_enums_pb2.FirstSolutionStrategy.PARALLEL_CHEAPEST_INSERTION
-        )
-
-        search_parameters.local_search_metaheuristic = (
-            routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
-        )
-
-        search_parameters.time_limit.seconds = self.MAX_SOLVE_TIME
-        # Solve the problem.
-        solution = routing.SolveWithParameters(search_parameters)
-
-        if solution:
-            (
-                full_plan,
-                distance_covered_by_vehicles,
-                max_capacity_used_by_vehicles,
-                total_working_hour_of_vehicles,
-                final_working_time,
-            ) = self.generate_output(manager, routing, solution)
-
-            # creating output response dict
-            data = dict()
-
-            total_optimized_distance = sum(distance_covered_by_vehicles)
-            data["optimized_distance"] = total_optimized_distance
-            data["optimized_status"] = True
-            data["no_driver_utilized"] = sum([1 for plan in full_plan if len(plan) > 0])
-
-            # data["trips"] = full_plan
-            # data["total_working_hour_of_vehicles"] = []
-
-            # for dist_time, drop_time, pickup_time in total_working_hour_of_vehicles:
-            #     temp_dict = dict()
-            #     temp_dict["time_spend_on_driving"] = dist_time
-            #     temp_dict["time_spend_on_pickup"] = pickup_time
-            #     temp_dict["time_spend_on_drop"] = drop_time
-            #     data["total_working_hour_of_vehicles"].append(temp_dict)
-
-            # data["driver_trip_completed_time"] = final_working_time
-            # data["optimized_trip_duration"] = max(final_working_time)
-
-            # data["max_capacity_used_by_vehicles"] = max_capacity_used_by_vehicles
-            # avg_load = list(filter(lambda x: x > 0, max_capacity_used_by_vehicles))
-
-            # data["distance_covered_by_vehicles"] = distance_covered_by_vehicles
-
-            # generating nested dict for output response
-            # check API documentation
-            data["driver_trips"] = []
-            for (
-                trip,
-                working_hours,
-                distance_covered,
-                max_cap,
-                duty_complete_time,
-            ) in zip(
-                full_plan,
-                total_working_hour_of_vehicles,
-                distance_covered_by_vehicles,
-                max_capacity_used_by_vehicles,
-                final_working_time,
-            ):
-                temp_dict = dict()
-                temp_dict["trip_detail"] = trip
-
-                temp_vehicle_dict = dict()
-                temp_vehicle_dict["max_capacity_used"] = max_cap
-                temp_vehicle_dict["distance_covered"] = distance_covered
-                temp_dict["vehicle"] = temp_vehicle_dict
-
-                temp_driver_dict = dict()
-                temp_driver_dict["duty_completed_time"] = duty_complete_time
-                temp_driver_dict["time_spend_on_driving"] = working_hours[0]
-                temp_driver_dict["time_spend_on_drop"] = working_hours[1]
-                temp_driver_dict["time_spend_on_pickup"] = working_hours[2]
-                temp_dict["driver"] = temp_driver_dict
-
-                data["driver_trips"].append(temp_dict)
-
-            (
-                data["all_possible_orderings"],
-                data["tried_orderings"],
-            ) = possible_orderings(len(self.data["demands"][1:]) // 2)
+        return manager, routing
 
-            # clamping values
-            def clamp(A, min_val, max_val):
-                return sorted([A, min_val, max_val])[1]
+    def solve_with_config(self, config):
+        """
+        solving optimization with given search configration
+        (lower bound of objective is computed in parallel, see lower_bound method)
+        """
+        build_start = time.time()
+        bound = self.lower_bound()
+        manager, routing = self.build_model()
+
+        # Setting first solution heuristic and metaheuristic.
+        params = search_parameters(config, self.MAX_SOLVE_TIME)
+        if "seed" in config:
+            routing.solver().ReSeed(config["seed"])
+        monitor = EarlyStopping(routing, self.MAX_SOLVE_TIME, self.early_stopping)
+        telemetry = None
+        if self.telemetry:
+            telemetry = SearchTelemetry(routing, time.time() - build_start)
+        gap_monitor = None
+        if self.target_gap is not None and bound is not None:
+            gap_monitor = GapStopping(routing, bound, self.target_gap)
+        if self.fleet_limit is not None:
+            restrict_fleet(
+                manager,
+                routing,
+                self.fleet_limit,
+                self.stop_when_feasible,
+                required_nodes(self.data),
+            )
+        if self.progress is not None:
+            ProgressReporter(
+                routing,
+                lambda solution: self.output_response(manager, routing, solution),
+                self.progress,
+            )
 
-            data["optimized_distance"] = max(data["optimized_distance"], 0)
+        # Solve the problem, starting from stored plan of recurring instance if available.
+        initial, warm_start = None, None
+        if self.warm_routes is not None:
+            routing.CloseModelWithParameters(params)
+            initial, warm_start = self.warm_start_assignment(manager, routing)
+        if initial is not None:
+            solution = routing.SolveFromAssignmentWithParameters(initial, params)
+        else:
+            solution = routing.SolveWithParameters(params)
 
-            # calculating dropped orders
-            total_orders = set([do_id for do_id, operations in self.data["do_info"]])
-            completed_orders = set(
-                [orders["order_id"] for trip in full_plan for orders in trip]
-            )
+        if telemetry is not None:
+            telemetry.stop()
 
-            # if solver dropped any order due to penalty
-            data["dropped_orders_by_solver"] = list(
-                total_orders - completed_orders - set(["warehouse"])
+        if solution:
+            summary = monitor.summary()
+            if gap_monitor is not None and gap_monitor.reached:
+                summary["stop_reason"] = STOP_TARGET_GAP
+            solution, polish_summary = polish_solution(
+                manager, routing, solution, self.polish_problem, self.polish
             )
-
+            data = self.output_response(manager, routing, solution)
+            data["optimized_status"] = True
+            data["engine"] = "ortools"
+            data.update(summary)
+            data.update(polish_summary)
+            if warm_start is not None:
+                data["warm_start"] = warm_start
+            data["objective"] = solution.ObjectiveValue()
+            if telemetry is not None:
+                data["telemetry"] = telemetry.summary()
+            if bound is not None:
+                data.update(gap_summary(bound, data["objective"]))
             return data
         else:
             data = dict()
             data["optimized_status"] = False
+            data["engine"] = "ortools"
+            data.update(monitor.summary())
+            if telemetry is not None:
+                data["telemetry"] = telemetry.summary()
             return data
 
 
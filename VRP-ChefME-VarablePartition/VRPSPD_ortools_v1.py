@@ -1,10 +1,24 @@
-from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
 import math
+import time
 import random as rd
-from utils import possible_orderings
-
-from location_util_osm import location_to_latlong, distance_matrix
+import numpy as np
+from utils import warehouse_loaded_orders, possible_orderings, DISTANCE_SCALE
+
+from route_polish import local_problem, polish_solution
+from search_monitor import (
+    EarlyStopping,
+    GapStopping,
+    ProgressReporter,
+    SearchTelemetry,
+    STOP_TARGET_GAP,
+)
+from lower_bound import LowerBound, gap_summary
+from solver_portfolio import portfolio_configs, search_parameters, solve_portfolio
+from location_util_osm import distance_matrix, MATRIX_FALLBACK
+from fleet_sweep import required_nodes, restrict_fleet
+from fast_engine import solve_fast
+from solve_profiles import fit_deadline, response_deadline, solve_profile, solve_time_limit
 
 # from location_util_google import distance_matrix
 
@@ -39,18 +53,48 @@ class VRPSPD_ortools:
         """
             Important Note : make sure input validation is runned and data dict is in correct form.
         """
+        # search has to be finished by deadline of "respond_by" (see solve_profiles)
+        self.deadline = response_deadline(data)
+        self.solve_profile = data.get("solve_profile")
+        profile = solve_profile(data)
         self.AVG_SPEED = data.get("avg_speed", 50)  # in km/h
         self.DUTY_TIME = data.get("max_single_trip_duration", 8)  # in hr
-        self.MAX_DISTANCE_PER_TRIP = int(self.AVG_SPEED * self.DUTY_TIME)  # in km
+        self.MAX_DISTANCE_PER_TRIP = int(
+            self.AVG_SPEED * self.DUTY_TIME * DISTANCE_SCALE
+        )  # in DISTANCE_SCALE units
         self.AVG_HANDOVER_TIME = data.get("handover_time", 15)  # in minutes
         # converting time to distanece
-        self.AVG_HANDOVER_DISTANCE = (self.AVG_HANDOVER_TIME / 60) * self.AVG_SPEED
+        self.AVG_HANDOVER_DISTANCE = int(
+            (self.AVG_HANDOVER_TIME / 60) * self.AVG_SPEED * DISTANCE_SCALE
+        )
         self.n_orders = len(data["delivery_sizes"]) // 2
         self.user_max_time = data.get("max_solver_time", 20 * 60)  # in seconds: Change: Changed default 5 min to 20 min
         # solver time
-        self.V1_MAX_SOLVE_TIME = min(
-            20 * 60, self.n_orders * 3, self.user_max_time      
+        # (solve profile sets its own time budget, see solve_profiles)
+        self.V1_MAX_SOLVE_TIME = solve_time_limit(
+            data, min(20 * 60, self.n_orders * 3, self.user_max_time)
         )  # in seconds: Change: Changed default 5 min to 20 min
+        # search configrations, more than one are solved in parallel (portfolio)
+        self.search_configs = portfolio_configs(data.get("portfolio"), profile)
+        # stopping search once objective stops improving (time limit is the ceiling)
+        self.early_stopping = data.get("early_stopping", profile.get("early_stopping"))
+        # called with every improving plan found during search
+        self.progress = None
+        # search telemetry (objective trace, counters, build / search time) in response
+        self.telemetry = data.get("telemetry", False)
+        # re-sequencing routes after search, "polish": false disables it
+        self.polish = data.get("polish", profile.get("polish"))
+        # "fast": savings construction + 2-opt / or-opt instead of ortools search (see fast_engine)
+        self.engine = data.get("engine", "ortools")
+        # search stops once plan is within target_gap percent of lower bound
+        self.target_gap = data.get("target_gap")
+        # lower bound of objective, started once (see lower_bound), partitions of
+        # decomposed requests ("report_gap": false) do not compute it
+        self.report_gap = data.get("report_gap", True)
+        self.bound = None
+        # fleet sweep candidate: only first fleet_limit vehicles are used (see fleet_sweep)
+        self.fleet_limit = None
+        self.stop_when_feasible = False
         self.data = self._preprocess(data)
 
     def _preprocess(self, raw_data):
@@ -61,37 +105,90 @@ class VRPSPD_ortools:
                 1. Adding dummy nodes
                 2. Adding positive and negative flows to maintain vehicle capacity
                 3. creating distance matrix
+                4. precomputing integer arc cost matrix
+
+            Delivery orders picked up at warehouse are loaded at start of route
+            (see warehouse_loaded_orders), they only have customer node and no
+            pickup and delivery pair. node_roles keeps operation of every node.
         """
         data = {}
         data["locations"], data["pickups_deliveries"] = [raw_data["depot_location"]], []
         data["demands"] = [0]
         data["do_info"] = [("warehouse", "")]
+        data["node_roles"] = [""]
+        # customer nodes of orders loaded at start of route
+        data["loaded_nodes"] = []
+        # (pickup node, delivery node) of every order, pickup node is None if loaded
+        data["order_nodes"] = []
+        loaded_orders = warehouse_loaded_orders(raw_data)
+
         cnt = 1
-        for i, k, do in zip(
-            raw_data["locations_of_orders"],
-            raw_data["delivery_sizes"],
-            raw_data["do_numbers"],
+        for n, (i, k, do) in enumerate(
+            zip(
+                raw_data["locations_of_orders"],
+                raw_data["delivery_sizes"],
+                raw_data["do_numbers"],
+            )
         ):
+            if n in loaded_orders:
+                # depot loading step, only customer node with negative demand
+                data["locations"].append(i[1])
+                data["loaded_nodes"].append(cnt)
+                data["order_nodes"].append((None, cnt))
+                data["do_info"].append((do, "deliver"))
+                data["node_roles"].append("deliver")
+                data["demands"].append(-math.ceil(k))
+                cnt += 1
+                continue
+
             data["locations"].append(i[0])
             data["locations"].append(i[1])
             data["pickups_deliveries"].append([cnt, cnt + 1])
+            data["order_nodes"].append((cnt, cnt + 1))
+            data["node_roles"].append("pickup")
+            data["node_roles"].append("deliver")
             # action defined base on node
             data["do_info"].append((do, "pickup"))
             data["do_info"].append((do, "deliver"))
             # positive negative demand
-            data["demands"].append(k)
-            data["demands"].append(-k)
+            data["demands"].append(math.ceil(k))
+            data["demands"].append(-math.ceil(k))
             cnt += 2
 
         # calculating distance matrix
-        data["distance_matrix"] = distance_matrix(data["locations"])
+        # (shared matrix of same locations is reused if given, eg. scenarios)
+        data["distance_matrix"] = distance_matrix(
+            data["locations"],
+            mode=raw_data.get("distance_mode", "road"),
+            fallback=raw_data.get("matrix_fallback", MATRIX_FALLBACK),
+            base=raw_data.get("reuse_matrix"),
+        )
+        data["travel_matrix"], data["transit_matrix"] = self._transit_matrices(data)
         # print (data['distance_matrix'])
         data["num_vehicles"] = raw_data["no_vehicles"]
-        data["vehicle_capacities"] = raw_data["capacity_of_vehicles"]
+        data["vehicle_capacities"] = list(map(int, raw_data["capacity_of_vehicles"]))
         data["depot"] = 0
 
         return data
 
+    def _transit_matrices(self, data):
+        """
+            Precompute travel and arc cost matrices between all nodes, so that
+            ortools never calls back into python during search.
+
+            arc cost = travel distance + handover distance (if next node is delivery),
+            handover is not added for consecutive deliveries on same location.
+        """
+        travel = data["distance_matrix"].node_matrix().astype(np.int64)
+        travel = travel * DISTANCE_SCALE // 1000  # distance matrix is in meters
+
+        delivery_nodes = np.array(data["node_roles"]) == "deliver"
+        service = np.where(
+            delivery_nodes[None, :] & (travel != 0), self.AVG_HANDOVER_DISTANCE, 0
+        )
+
+        return travel, travel + service
+
     def generate_output(self, manager, routing, solution):
         """
             generate important output plannig answer from optimized response
@@ -101,55 +198,50 @@ class VRPSPD_ortools:
         distance_covered_by_vehicles = []
         max_capacity_used_by_vehicles = []
         total_working_hour_of_vehicles = []
+        loaded_nodes = set(self.data["loaded_nodes"])
 
         for vehicle_id in range(self.data["num_vehicles"]):
             index = routing.Start(vehicle_id)
             vehicle_plan = []
+            route_nodes = []
             route_distance = 0
-            cap = 0
-            max_cap = 0
-            total_handover_excluded = 0
+            total_handovers = 0
             while not routing.IsEnd(index):
                 actual_id = manager.IndexToNode(index)
+                route_nodes.append(actual_id)
 
                 order_id, operation = self.data["do_info"][actual_id]
                 vehicle_plan.append({"operation": operation, "order_id": order_id})
 
-                previous_index = index
                 index = solution.Value(routing.NextVar(index))
-
-                # checking continous delivery location
-                if (
-                    index % 2 == 0
-                    and index != 0
-                    and not routing.IsEnd(index)
-                    and self.data["distance_matrix"][previous_index][index] == 0
-                ):
-                    total_handover_excluded += 1
-
-                # calculating distance
-                route_distance += routing.GetArcCostForVehicle(
-                    previous_index, index, vehicle_id
-                )
-                # calculating current capacity of vehicle
-                cap += self.data["demands"][actual_id]
+                next_id = manager.IndexToNode(index)
+
+                # calculating travel distance (arc cost without handover distance)
+                travel_distance = int(self.data["travel_matrix"][actual_id, next_id])
+                route_distance += travel_distance
+                # checking handover, it is not added for continous delivery location
+                if int(self.data["transit_matrix"][actual_id, next_id]) != travel_distance:
+                    total_handovers += 1
+
+            # orders loaded at start of route are picked up when leaving warehouse
+            loaded = [node for node in route_nodes if node in loaded_nodes]
+            loading_plan = [
+                {"operation": "pickup", "order_id": self.data["do_info"][node][0]}
+                for node in loaded
+            ]
+            full_plan.append(loading_plan + vehicle_plan[1:])
+
+            # calculating capacity of vehicle, starting with loaded orders
+            cap = -sum(self.data["demands"][node] for node in loaded)
+            max_cap = cap
+            for node in route_nodes:
+                cap += self.data["demands"][node]
                 max_cap = max(cap, max_cap)
 
-            full_plan.append(vehicle_plan[1:])
-
-            # calculting route distance for each vehicle
-            # by subtracting all orders handover time plus consecutive order
-            # which is going to save time
-            total_orders_done_by_vehicle = len(vehicle_plan[1:]) // 2
-            route_distance = route_distance - self.AVG_HANDOVER_DISTANCE * (
-                total_orders_done_by_vehicle
-            )
-            route_distance += total_handover_excluded * self.AVG_HANDOVER_DISTANCE
+            route_distance = route_distance / DISTANCE_SCALE
             # converting distance to time
             time_spend_on_distance = (route_distance / self.AVG_SPEED) * 60
-            time_spend_on_handover = self.AVG_HANDOVER_TIME * (
-                total_orders_done_by_vehicle - total_handover_excluded
-            )
+            time_spend_on_handover = self.AVG_HANDOVER_TIME * total_handovers
             # combining timings information
             total_working_hour_of_vehicles.append(
                 (time_spend_on_distance, time_spend_on_handover)
@@ -164,9 +256,139 @@ class VRPSPD_ortools:
             total_working_hour_of_vehicles,
         )
 
-    def solve(self):
+    def output_response(self, manager, routing, solution):
+        """
+            generate output response dict from given solution
+            (final solution or solution being found during search)
+        """
+        (
+            full_plan,
+            distance_covered_by_vehicles,
+            max_capacity_used_by_vehicles,
+            total_working_hour_of_vehicles,
+        ) = self.generate_output(manager, routing, solution)
+
+        data = dict()
+        # generating output response dict
+        total_optimized_distance = sum(distance_covered_by_vehicles)
+        data["optimized_distance"] = total_optimized_distance
+        # road distances or great circle estimates
+        data["distance_source"] = self.data["distance_matrix"].source
+        # osrm / route cache pair counts of matrix (None for estimates and reused matrix)
+        data["route_cache"] = getattr(self.data["distance_matrix"], "route_stats", None)
+        data["trips"] = full_plan
+        # calculating driver utilized
+        data["no_driver_utilized"] = sum([1 for plan in full_plan if len(plan) > 0])
+
+        data["total_working_hour_of_vehicles"] = total_working_hour_of_vehicles
+        # calculating total trip duration from distace travelled time and handover time
+        data["optimized_trip_duration"] = max(
+            [x + y for x, y in total_working_hour_of_vehicles]
+        )  # in minutes
+
+        data["max_capacity_used_by_vehicles"] = max_capacity_used_by_vehicles
+        # calculating avg load of vehicles by filter only used vehivles
+        avg_load = list(filter(lambda x: x > 0, max_capacity_used_by_vehicles))
+        data["avg_load_of_vehicles"] = sum(avg_load) / len(avg_load)
+        data["distance_covered_by_vehicles"] = distance_covered_by_vehicles
+
+        (
+            data["all_possible_orderings"],
+            data["tried_orderings"],
+        ) = possible_orderings(len(self.data["demands"][1:]) // 2)
+
+        data["optimized_trip_duration"] = clamp(
+            data["optimized_trip_duration"], 0, self.DUTY_TIME * 60
+        )
+        data["optimized_distance"] = max(data["optimized_distance"], 0)
+
+        return data
+
+    def route_limits(self):
+        """
+            max route length of every vehicle (in DISTANCE_SCALE units)
+        """
+        return [self.MAX_DISTANCE_PER_TRIP] * self.data["num_vehicles"]
+
+    def polish_problem(self, vehicle_id, route):
+        """
+            single vehicle re-sequencing problem of route (see route_polish)
+        """
+        return local_problem(
+            self.data["transit_matrix"],
+            route,
+            self.data["pickups_deliveries"],
+            self.data["demands"],
+            self.data["vehicle_capacities"][vehicle_id],
+            loaded_nodes=self.data["loaded_nodes"],
+            max_transit=self.MAX_DISTANCE_PER_TRIP,
+        )
+
+    def lower_bound(self):
+        """
+            LowerBound of objective, started on first call and shared by portfolio
+            members and fleet sweep candidates, None if gap is not reported
+        """
+        if self.bound is None and self.report_gap:
+            self.bound = LowerBound(self.bound_problem())
+        return self.bound
+
+    def bound_problem(self):
+        """
+            assignment relaxation of routing model (see lower_bound.assignment_bound),
+            every node has to be visited
+        """
+        return {
+            "transit": self.data["transit_matrix"],
+            "nodes": list(range(1, len(self.data["demands"]))),
+            "starts": [self.data["depot"]] * self.data["num_vehicles"],
+            "depot": self.data["depot"],
+        }
+
+    def fast_data(self):
+        """
+            preprocessed data in VRPSPDTW layout for fast engine (see fast_engine),
+            max trip length is the only time limit and every vehicle starts at warehouse
+        """
+        n_nodes = len(self.data["demands"])
+        n_vehicles = self.data["num_vehicles"]
+        trip = (0, self.MAX_DISTANCE_PER_TRIP)
+        return dict(
+            self.data,
+            time_windows=[trip] * n_nodes,
+            duty_time=[trip] * n_vehicles,
+            warehouse_pickup_time=trip,
+            vehicle_starts=[self.data["depot"]] * n_vehicles,
+            onboard_nodes=dict(),
+            group_vehicles=[None] * len(self.data["order_nodes"]),
+        )
+
+    def solve(self, progress=None):
         """
         solving optimization
+        if portfolio is requested, all search configrations are solved in parallel processes
+        on the same preprocessed data and best solution is returned
+
+        progress(data) is called with improving intermediate plans during search
+        (it must be picklable, to be used by parallel portfolio processes)
+        """
+        self.progress = progress
+        budget = fit_deadline(self, "V1_MAX_SOLVE_TIME")
+        # bound is computed while searching
+        self.lower_bound()
+        if self.engine == "fast":
+            data = solve_fast(self)
+        elif len(self.search_configs) > 1:
+            data = solve_portfolio(self, self.search_configs)
+        else:
+            data = self.solve_with_config(self.search_configs[0])
+        data["solve_budget"] = budget
+        return data
+
+    def build_model(self):
+        """
+        routing model of preprocessed data with all constraints, without search parameters
+        return (manager, routing)
         """
         manager = pywrapcp.RoutingIndexManager(
             len(self.data["distance_matrix"]),
@@ -178,24 +400,10 @@ class VRPSPD_ortools:
         routing = pywrapcp.RoutingModel(manager)
 
         # Define cost of each arc.
-        def distance_callback(from_index, to_index):
-            """Returns the distance between the two nodes."""
-            # Convert from routing variable Index to distance matrix NodeIndex.
-            from_node = manager.IndexToNode(from_index)
-            to_node = manager.IndexToNode(to_index)
-            # checking continous delivery location
-            handover_time = (
-                self.AVG_HANDOVER_DISTANCE
-                if (
-                    to_node % 2 == 0
-                    and to_node != 0
-                    and self.data["distance_matrix"][from_node][to_node] != 0
-                )
-                else 0
-            )
-            return self.data["distance_matrix"][from_node][to_node] + handover_time
-
-        transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+        # (precomputed matrix, no python callback during search)
+        transit_callback_index = routing.RegisterTransitMatrix(
+            self.data["transit_matrix"].tolist()
+        )
         routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
 
         # Add Distance constraint.
@@ -222,79 +430,85 @@ class VRPSPD_ortools:
                 <= distance_dimension.CumulVar(delivery_index)
             )
 
-        def demand_callback(from_index):
-            """Returns the demand of the node."""
-            # Convert from routing variable Index to demands NodeIndex.
-            from_node = manager.IndexToNode(from_index)
-            return self.data["demands"][from_node]
-
-        demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
+        demand_callback_index = routing.RegisterUnaryTransitVector(self.data["demands"])
 
         routing.AddDimensionWithVehicleCapacity(
             demand_callback_index,
             0,  # null capacity slack
             self.data["vehicle_capacities"],  # vehicle maximum capacities
-            True,  # start cumul to zero
+            # start cumul is load of orders loaded at start of route
+            not self.data["loaded_nodes"],  # start cumul to zero
             "Capacity",
         )
 
-        # Setting first solution heuristic.
-        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-        search_parameters.first_solution_strategy = (
-            routing_enums_pb2.FirstSolutionStrategy.PARALLEL_CHEAPEST_INSERTION
-        )
+        return manager, routing
 
-        search_parameters.local_search_metaheuristic = (
-            routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
-        )
+    def solve_with_config(self, config):
+        """
+        solving optimization with given search configration
+        (lower bound of objective is computed in parallel, see lower_bound method)
+        """
+        build_start = time.time()
+        bound = self.lower_bound()
+        manager, routing = self.build_model()
+
+        # Setting first solution heuristic and metaheuristic.
+        params = search_parameters(config, self.V1_MAX_SOLVE_TIME)
+        if "seed" in config:
+            routing.solver().ReSeed(config["seed"])
+        monitor = EarlyStopping(routing, self.V1_MAX_SOLVE_TIME, self.early_stopping)
+        telemetry = None
+        if self.telemetry:
+            telemetry = SearchTelemetry(routing, time.time() - build_start)
+        gap_monitor = None
+        if self.target_gap is not None and bound is not None:
+            gap_monitor = GapStopping(routing, bound, self.target_gap)
+        if self.fleet_limit is not None:
+            restrict_fleet(
+                manager,
+                routing,
+                self.fleet_limit,
+                self.stop_when_feasible,
+                required_nodes(self.data),
+            )
+        if self.progress is not None:
+            ProgressReporter(
+                routing,
+                lambda solution: self.output_response(manager, routing, solution),
+                self.progress,
+            )
 
-        search_parameters.time_limit.seconds = self.V1_MAX_SOLVE_TIME
         # Solve the problem.
-        solution = routing.SolveWithParameters(search_parameters)
+        solution = routing.SolveWithParameters(params)
 
-        if solution:
-            (
-                full_plan,
-                distance_covered_by_vehicles,
-                max_capacity_used_by_vehicles,
-                total_working_hour_of_vehicles,
-            ) = self.generate_output(manager, routing, solution)
+        if telemetry is not None:
+            telemetry.stop()
 
-            data = dict()
-            # generating output response dict
-            total_optimized_distance = sum(distance_covered_by_vehicles)
-            data["optimized_distance"] = total_optimized_distance
-            data["optimized_status"] = True
-            data["trips"] = full_plan
-            # calculating driver utilized
-            data["no_driver_utilized"] = sum([1 for plan in full_plan if len(plan) > 0])
-
-            data["total_working_hour_of_vehicles"] = total_working_hour_of_vehicles
-            # calculating total trip duration from distace travelled time and handover time
-            data["optimized_trip_duration"] = max(
-                [x + y for x, y in total_working_hour_of_vehicles]
-            )  # in minutes
-
-            data["max_capacity_used_by_vehicles"] = max_capacity_used_by_vehicles
-            # calculating avg load of vehicles by filter only used vehivles
-            avg_load = list(filter(lambda x: x > 0, max_capacity_used_by_vehicles))
-            data["avg_load_of_vehicles"] = sum(avg_load) / len(avg_load)
-            data["distance_covered_by_vehicles"] = distance_covered_by_vehicles
-
-            (
-                data["all_possible_orderings"],
-                data["tried_orderings"],
-            ) = possible_orderings(len(self.data["demands"][1:]) // 2)
-
-            data["optimized_trip_duration"] = clamp(
-                data["optimized_trip_duration"], 0, self.DUTY_TIME * 60
+        if solution:
+            summary = monitor.summary()
+            if gap_monitor is not None and gap_monitor.reached:
+                summary["stop_reason"] = STOP_TARGET_GAP
+            solution, polish_summary = polish_solution(
+                manager, routing, solution, self.polish_problem, self.polish
             )
-            data["optimized_distance"] = max(data["optimized_distance"], 0)
-
+            data = self.output_response(manager, routing, solution)
+            data["optimized_status"] = True
+            data["engine"] = "ortools"
+            data.update(summary)
+            data.update(polish_summary)
+            data["objective"] = solution.ObjectiveValue()
+            if telemetry is not None:
+                data["telemetry"] = telemetry.summary()
+            if bound is not None:
+                data.update(gap_summary(bound, data["objective"]))
             return data
         else:
             data = dict()
             data["optimized_status"] = False
+            data["engine"] = "ortools"
+            data.update(monitor.summary())
+            if telemetry is not None:
+                data["telemetry"] = telemetry.summary()
             return data
 
 
@@ -1,6 +1,6 @@
 import json
 import time
-import osrm
+from functools import partial
 
 from celery import Celery
 from copy import deepcopy
@@ -9,10 +9,27 @@ from flask import Flask, request, jsonify, url_for, redirect
 from VRPSPD_ortools_v1 import VRPSPD_ortools
 from Single_Trip_Optimize import Single_Trip
 from VRPSPDTW_ortools import VRPSPDTW_ortools
-from validation_json_schema import VRPSPD_data_schema, VRPSPDTW_data_schema
+from decomposition import vrpspdtw_solver
+from warm_start import fingerprint, plan_steps, select_plan, WARM_START_CANDIDATES
+from reoptimize import updated_request, merge_frozen_trips
+from order_insertion import insertion_options, INSERTION_OPTIONS
+from scenarios import scenario_request, solve_scenarios, VRPSPD_VEHICLE_KEYS
+from fleet_sweep import sweep_fleet
+from validation_json_schema import (
+    VRPSPD_data_schema,
+    VRPSPDTW_data_schema,
+    VRPSPDTW_reoptimize_schema,
+    VRPSPDTW_insertion_schema,
+    VRPSPD_scenarios_schema,
+    VRPSPDTW_scenarios_schema,
+    VRPSPD_data_format,
+    VRPSPDTW_data_format,
+    format_errors,
+)
 from celery.utils.log import get_task_logger
 from persistent_storage import CeleryTask_model, CeleryTask_Query, db_Session, engine
 from location_util_osm import haversine
+from routing_client import get_client
 
 from rdp import rdp 
 from statistics import mean
@@ -51,6 +68,35 @@ def celery_task_id_verify(task_id):
     return False
 
 
+def exclude_orders_without_location(data):
+    """
+        exclude orders without source or destination location (inplace),
+        excluded order ids are kept in data["excluded_orders"]
+    """
+    last_n = len(data["orders"])
+    # check if orders don't have location
+    data["new_orders"] = [
+        order
+        for order in data["orders"]
+        if not (
+            "none" in order["source"].lower()
+            or "none" in order["destination"].lower()
+        )
+    ]
+    # if some orders has no location, excluded those order
+    # and remove those orders list
+    if last_n != len(data["new_orders"]):
+        data["excluded_orders"] = [
+            order["order_id"]
+            for order in data["orders"]
+            if (
+                "none" in order["source"].lower()
+                or "none" in order["destination"].lower()
+            )
+        ]
+        data["orders"] = data["new_orders"]
+
+
 def check_data_v1(req):
     """
         check VRPSPD request data format
@@ -59,28 +105,7 @@ def check_data_v1(req):
     data = req.json
 
     if inputs.validate():
-        last_n = len(data["orders"])
-        # check if orders don't have location
-        data["new_orders"] = [
-            order
-            for order in data["orders"]
-            if not (
-                "none" in order["source"].lower()
-                or "none" in order["destination"].lower()
-            )
-        ]
-        # if some orders has no location, excluded those order
-        # and remove those orders list
-        if last_n != len(data["new_orders"]):
-            data["excluded_orders"] = [
-                order["order_id"]
-                for order in data["orders"]
-                if (
-                    "none" in order["source"].lower()
-                    or "none" in order["destination"].lower()
-                )
-            ]
-            data["orders"] = data["new_orders"]
+        exclude_orders_without_location(data)
         return True, None
     else:
         return False, inputs.errors
@@ -167,7 +192,7 @@ def match_endpoint_v1():
     for i in range(len(douglas)):
         r.append(20.0)
 
-    act_route = osrm.match(douglas, radius=r, overview='simplified', geometry='geojson', tidy=True)     #generating the snapped points
+    act_route = get_client().match(douglas, radiuses=r, overview='simplified', geometries='geojson', tidy='true')     #generating the snapped points
 
     out_snapped = mkjson(act_route)
 
@@ -215,9 +240,14 @@ def eta_endpoint():
     stat = {"Current Location": "{},{}".format(current_loc[0],current_loc[1]), "Current Time":current_time, "ETA Table": []}
 
 
+    # calculating all legs concurrently
+    leg_distances = get_client().map(
+        haversine, [current_loc] + locations[:-1], locations
+    )
+
     for d in range(len(locations)):
 
-        distance = haversine(current_loc,locations[d])
+        distance = leg_distances[d]
         time = distance/float(avg_speed) + float(handover_times[d])
         stat["ETA Table"].append({"OrderID":order_ids[d],"handover_time": handover_times[d], "ETA":round(time + current_time)})#time+current_time
         current_loc = locations[d]
@@ -241,15 +271,15 @@ def eta_endpoint():
 # --------------------Ideal Route Plotting--------------------------
 # ------------------------------------------------------------------ 
 
-#Extracting lat long from LINESTRING output of simple_route function
+#Extracting lat long from geojson geometry of osrm route
 def mkjson_ideal(ideal_route):
 
     lat = []
     lon = []
 
-    for i in ideal_route[0]["geometry"][12:-1].split(","):
-        lat.append(float(i.split(" ")[1]))
-        lon.append(float(i.split(" ")[0]))
+    for i in ideal_route[0]["geometry"]["coordinates"]:
+        lat.append(float(i[1]))
+        lon.append(float(i[0]))
 
 
     stat = {"Distance(km)": ideal_route[0]["distance"]/1000, "Duration": ideal_route[0]["duration"], "Directions":[]}
@@ -282,7 +312,7 @@ def ideal_endpoint_v1():
     points = extract_ideal(data)            #extracting the coords and storing
 
 
-    ideal_route = osrm.simple_route(coord_origin=points[0], coord_dest=points[-1], coord_intermediate=points[1:-1], output='route', overview='full', geometry='wkt')     #generating the snapped points
+    ideal_route = get_client().route(points, overview='full', geometries='geojson')["routes"]     #generating the snapped points
 
     out_ideal = mkjson_ideal(ideal_route)
 
@@ -298,6 +328,46 @@ def ideal_endpoint_v1():
 # ------------------------------------------------------------------
 
 
+def publish_progress(task_id, excluded_orders, out_data):
+    """
+        persist improving plan found during search,
+        so that status endpoints return usable plan before optimization is completed
+    """
+    out_data["excluded_orders"] = excluded_orders + out_data.get(
+        "dropped_orders_by_solver", []
+    )
+    ct_query_engine.publish_progress(task_id, out_data)
+
+
+def reusable_matrix(solver, out_data):
+    """
+        distance matrix to store with multiple driver with time window plan,
+        None if plan can not be re-optimized or inserted into (no driver trips).
+        Decomposed solvers keep one matrix shared by all partitions.
+    """
+    if "driver_trips" not in out_data:
+        return None
+    if hasattr(solver, "shared_matrix"):
+        return solver.shared_matrix()
+    return solver.data.get("distance_matrix")
+
+
+def task_telemetry(data, out_data, t1, total_time):
+    """
+        adding task timings to search telemetry of solver ("telemetry": true in request),
+        stored with task output so that status endpoints return it
+            wait_time  : seconds from request being received till solver started
+                         (queue wait, warm start lookup)
+            solve_time : seconds spent by solver incl. matrix and model building
+    """
+    if "telemetry" not in out_data:
+        return
+    out_data["telemetry"]["wait_time"] = (
+        round(t1 - data["received_at"], 3) if "received_at" in data else None
+    )
+    out_data["telemetry"]["solve_time"] = round(total_time, 3)
+
+
 @celery.task(bind=True)
 def VRPSPD_request_v1(self, data):
     """
@@ -324,12 +394,21 @@ def VRPSPD_request_v1(self, data):
         # start solving optimization
         t1 = time.time()
         solver = VRPSPD_ortools(data)
-        out_data = solver.solve()
+        if data.get("fleet_sweep"):
+            # fewest vehicles serving all orders and distance / fleet size curve
+            out_data = sweep_fleet(solver, data["fleet_sweep"])
+        else:
+            out_data = solver.solve(
+                progress=partial(
+                    publish_progress, self.request.id, data.get("excluded_orders", [])
+                )
+            )
         total_time = time.time() - t1
 
         # check for excluded orders
         out_data["excluded_orders"] = data.get("excluded_orders", [])
         out_data["time_taken_to_solve"] = int(total_time)
+        task_telemetry(data, out_data, t1, total_time)
 
         celery_logger.info(f"multiple driver output: {out_data}")
 
@@ -371,6 +450,8 @@ def VRPSPD_request_endpoint_v1():
         resp = standard_response(status="FAILED", message=validation_msg, data={})
         return jsonify(resp), 400
     # sending task to celery queue
+    # respond_by deadline is counted from here (queue wait included)
+    data["received_at"] = time.time()
     task = VRPSPD_request_v1.apply_async(args=[data])
     resp = standard_response(
         status="SUCCESS", message="Submitted to job queue", data={"task_id": task.id}
@@ -413,9 +494,8 @@ def task_status_v1(task_id):
             })
         warehouse_location = task.input_data["warehouse_location"].split(",")[::-1]
         warehouse_location = list(map(float, warehouse_location))
-        total_distance = 0
-        for i in  range(len(task.out_data["driver_trips"])):
-            trip_dtl = task.out_data['driver_trips'][i]
+        trips_locations = []
+        for trip_dtl in task.out_data["driver_trips"]:
             trip_orders = trip_dtl["trip_detail"]
             intermediate_locations = []
             for order in trip_orders:
@@ -423,8 +503,16 @@ def task_status_v1(task_id):
                 if order["operation"] == order_dtl["operation"]:
                     location = list(map(float, order_dtl["location"].split(",")[::-1]))
                     intermediate_locations.append(location)
-            resp = osrm.simple_route(coord_origin=warehouse_location, coord_dest=warehouse_location,
-                                         coord_intermediate=intermediate_locations)
+            trips_locations.append(
+                [warehouse_location] + intermediate_locations + [warehouse_location]
+            )
+        # routing all trips concurrently
+        routes = get_client().map(
+            lambda locations: get_client().route(locations, overview="false"),
+            trips_locations,
+        )
+        total_distance = 0
+        for i, resp in enumerate(routes):
             trip_distance = resp["routes"][0]["distance"] // 1000
             out_data["driver_trips"][i]["vehicle"]["distance_covered"] = trip_distance
             total_distance += trip_distance
@@ -500,12 +588,17 @@ def single_trip_optimize(self, data):
         # start solving optimization
         t1 = time.time()
         solver = Single_Trip(data)
-        out_data = solver.solve()
+        out_data = solver.solve(
+            progress=partial(
+                publish_progress, self.request.id, data.get("excluded_orders", [])
+            )
+        )
         total_time = time.time() - t1
 
         # check for excluded orders
         out_data["excluded_orders"] = data.get("excluded_orders", [])
         out_data["time_taken_to_solve"] = int(total_time)
+        task_telemetry(data, out_data, t1, total_time)
 
         celery_logger.info(f"single trip output: {out_data}")
 
@@ -548,6 +641,8 @@ def single_trip_request_endpoint_v1():
         return jsonify(resp), 400
 
     # sending task to celery queue
+    # respond_by deadline is counted from here (queue wait included)
+    data["received_at"] = time.time()
     task = single_trip_optimize.apply_async(args=[data])
     resp = standard_response(
         status="SUCCESS", message="Submitted to job queue", data={"task_id": task.id}
@@ -604,61 +699,46 @@ def check_VRPSPDTW_data(req):
     data = req.json
 
     if inputs.validate():
-        last_n = len(data["orders"])
-        # check if orders don't have locations
-        data["new_orders"] = [
-            order
-            for order in data["orders"]
-            if not (
-                "none" in order["source"].lower()
-                or "none" in order["destination"].lower()
-            )
-        ]
-        # if some orders has no location, excluded those order
-        # and remove those orders list
-        if last_n != len(data["new_orders"]):
-            data["excluded_orders"] = [
-                order["order_id"]
-                for order in data["orders"]
-                if (
-                    "none" in order["source"].lower()
-                    or "none" in order["destination"].lower()
-                )
-            ]
-            data["orders"] = data["new_orders"]
+        exclude_orders_without_location(data)
+        return check_VRPSPDTW_windows(data)
+    else:
+        return False, inputs.errors
+
 
-        # checking time window constraints
-        time = data["warehouse_pickup_time"]
-        if time["start_time"] > time["end_time"]:
+def check_VRPSPDTW_windows(data):
+    """
+        time window checker for VRPSPDTW
+    """
+    # checking time window constraints
+    time = data["warehouse_pickup_time"]
+    if time["start_time"] > time["end_time"]:
+        return (
+            False,
+            "Warehouse Pickup time Start time is greater than End time",
+        )
+
+    time = data["warehouse_drop_time"]
+    if time["start_time"] > time["end_time"]:
+        return (
+            False,
+            "Warehouse Drop time Start time is greater than End time",
+        )
+
+    for driver in data["drivers"]:
+        if driver["duty_start_time"] > driver["duty_end_time"]:
             return (
                 False,
-                "Warehouse Pickup time Start time is greater than End time",
+                "Driver's Duty Start time is greater than duty end time",
             )
 
-        time = data["warehouse_drop_time"]
-        if time["start_time"] > time["end_time"]:
+    for order in data["orders"]:
+        if order["start_time"] > order["end_time"]:
             return (
                 False,
-                "Warehouse Drop time Start time is greater than End time",
+                "Order's delivery window start time is greater than end time.",
             )
 
-        for driver in data["drivers"]:
-            if driver["duty_start_time"] > driver["duty_end_time"]:
-                return (
-                    False,
-                    "Driver's Duty Start time is greater than duty end time",
-                )
-
-        for order in data["orders"]:
-            if order["start_time"] > order["end_time"]:
-                return (
-                    False,
-                    "Order's delivery window start time is greater than end time.",
-                )
-
-        return True, None
-    else:
-        return False, inputs.errors
+    return True, None
 
 
 def unroll_VRPSPDTW_data(data):
@@ -697,7 +777,10 @@ def unroll_VRPSPDTW_data(data):
     data["capacity_of_vehicles"] = []
     data["duty_time"] = []
     data["vehicle_storage"] = []
-
+    # state of drivers on the way (re-optimization)
+    data["vehicle_start_locations"] = []
+    data["onboard_orders"] = []
+    data["vehicle_available"] = []
 
     # unrolling driver / vehicle information
     for driver in data["drivers"]:
@@ -706,6 +789,9 @@ def unroll_VRPSPDTW_data(data):
             driver["capacity_of_vehicle"] * driver["max_utilized_capacity_of_vehicle"]
         )
         data["duty_time"].append([driver["duty_start_time"], driver["duty_end_time"]])
+        data["vehicle_start_locations"].append(driver.get("current_location"))
+        data["onboard_orders"].append(driver.get("onboard_orders", []))
+        data["vehicle_available"].append(driver.get("available", True))
        
         try:
             data["vehicle_storage"].append(driver["storage"])
@@ -742,11 +828,42 @@ def VRPSPDTW_request(self, data):
     unroll_VRPSPDTW_data(data)  # inplace dict updates
     celery_logger.info(f"multiple driver with time window input: {data}")
 
+    try:
+        # warm start from stored plan of same recurring instance
+        data_fingerprint = fingerprint(data)
+        ct_query_engine.update_task(self.request.id, fingerprint=data_fingerprint)
+        if data.get("warm_start", True):
+            plan = select_plan(
+                data,
+                ct_query_engine.recent_plans(
+                    data_fingerprint,
+                    "multiple driver with time window",
+                    WARM_START_CANDIDATES,
+                ),
+            )
+            if plan is not None:
+                data["warm_start_plan"] = plan
+    except Exception as e:
+        celery_logger.exception(e)
+        celery_logger.debug("warm start not available, solving from scratch")
+
     try:
         # start solving optimization
         t1 = time.time()
-        solver = VRPSPDTW_ortools(data)
-        out_data = solver.solve()
+        # independent storage classes and very large requests
+        # are partitioned and solved in parallel
+        if data.get("fleet_sweep"):
+            # fewest drivers serving all orders and distance / fleet size curve
+            # (always single routing model)
+            solver = VRPSPDTW_ortools(data)
+            out_data = sweep_fleet(solver, data["fleet_sweep"])
+        else:
+            solver = vrpspdtw_solver(data)
+            out_data = solver.solve(
+                progress=partial(
+                    publish_progress, self.request.id, data.get("excluded_orders", [])
+                )
+            )
         total_time = time.time() - t1
 
         # check for excluded orders
@@ -754,15 +871,18 @@ def VRPSPDTW_request(self, data):
             "dropped_orders_by_solver", []
         )
         out_data["time_taken_to_solve"] = int(total_time)
+        task_telemetry(data, out_data, t1, total_time)
 
         celery_logger.info(f"multiple driver with time window output: {out_data}")
 
         # update response in postgres
+        # (distance matrix is kept for re-optimization of this plan)
         ct_query_engine.update_task(
             self.request.id,
             status="SUCCESS",
             status_msg="Optimization Completed",
             out_data=out_data,
+            distance_matrix=reusable_matrix(solver, out_data),
         )
 
         self.update_state(state="SUCCESS", meta={"result": out_data})
@@ -797,6 +917,8 @@ def VRPSPDTW_request_endpoint():
         return jsonify(resp), 400
 
     # sending task to celery queue
+    # respond_by deadline is counted from here (queue wait included)
+    data["received_at"] = time.time()
     task = VRPSPDTW_request.apply_async(args=[data])
     resp = standard_response(
         status="SUCCESS", message="Submitted to job queue", data={"task_id": task.id}
@@ -814,6 +936,201 @@ def VRPSPDTW_request_endpoint():
     return jsonify(resp), 200
 
 
+@celery.task(bind=True)
+def VRPSPDTW_reoptimize(self, task_id, delta):
+    """
+        async function re-optimizing stored multiple driver with time window plan
+        with order and driver changes (delta)
+    """
+    engine.dispose()
+
+    try:
+        previous = ct_query_engine.get_task(task_id)
+        data, orders = updated_request(
+            task_id, previous.input_data, previous.out_data, delta
+        )
+        # stored request of new plan has all orders, incl. completed ones,
+        # so that the new plan can be re-optimized again
+        input_data = deepcopy(previous.input_data)
+        input_data["orders"] = orders
+        ct_query_engine.update_task(
+            self.request.id,
+            status_msg="Working on Optimization",
+            input_data=input_data,
+            fingerprint=previous.fingerprint,
+        )
+
+        unroll_VRPSPDTW_data(data)  # inplace dict updates
+        celery_logger.info(f"re-optimization of {task_id} input: {data}")
+        # road distances of previous plan, only new locations are requested
+        data["reuse_matrix"] = previous.distance_matrix
+
+        t1 = time.time()
+        solver = VRPSPDTW_ortools(data)
+        out_data = solver.solve()
+        total_time = time.time() - t1
+
+        merge_frozen_trips(out_data, data["frozen_trips"])
+        out_data["excluded_orders"] = out_data.get("dropped_orders_by_solver", [])
+        out_data["time_taken_to_solve"] = int(total_time)
+        task_telemetry(data, out_data, t1, total_time)
+        out_data["reoptimized_from"] = task_id
+
+        celery_logger.info(f"re-optimization of {task_id} output: {out_data}")
+
+        # update response in postgres
+        ct_query_engine.update_task(
+            self.request.id,
+            status="SUCCESS",
+            status_msg="Optimization Completed",
+            out_data=out_data,
+            distance_matrix=reusable_matrix(solver, out_data),
+        )
+
+        self.update_state(state="SUCCESS", meta={"result": out_data})
+
+    except Exception as e:
+        # update response in postgres
+        ct_query_engine.update_task(
+            self.request.id, status="FAILED", status_msg="Optimization Failed",
+        )
+        celery_logger.exception(e)
+        celery_logger.info(f"Exception Handled on {self.request.id}")
+        self.update_state(state="FAILED")
+
+    return {"status": "Task completed!"}
+
+
+@app.route("/routeoptimization/reoptimize/<task_id>", methods=["POST"])
+def VRPSPDTW_reoptimize_endpoint(task_id):
+    """
+        End point for re-optimizing completed VRPSPDTW plan with deltas
+        (added/removed orders, unavailable drivers, driver positions)
+        return celery task id of new plan as response
+    """
+    if not celery_task_id_verify(task_id):
+        resp = standard_response(status="FAILED", message="Invalid task id", data={})
+        return jsonify(resp), 400
+
+    inputs = VRPSPDTW_reoptimize_schema(request)
+    if not inputs.validate():
+        resp = standard_response(status="FAILED", message=inputs.errors, data={})
+        return jsonify(resp), 400
+
+    previous = ct_query_engine.get_task(task_id)
+    if (
+        not previous
+        or previous.task_type != "multiple driver with time window"
+        or not previous.out_data
+        or "driver_trips" not in previous.out_data
+    ):
+        resp = standard_response(
+            status="FAILED", message="No completed plan for task id", data={}
+        )
+        return jsonify(resp), 400
+
+    delta = request.json
+    n_drivers = len(previous.input_data["drivers"])
+    drivers = delta.get("unavailable_drivers", []) + [
+        position["driver"] for position in delta.get("driver_positions", [])
+    ]
+    if any(driver >= n_drivers for driver in drivers):
+        resp = standard_response(status="FAILED", message="Invalid driver index", data={})
+        return jsonify(resp), 400
+
+    # sending task to celery queue
+    # respond_by deadline is counted from here (queue wait included)
+    delta["received_at"] = time.time()
+    task = VRPSPDTW_reoptimize.apply_async(args=[task_id, delta])
+    resp = standard_response(
+        status="SUCCESS", message="Submitted to job queue", data={"task_id": task.id}
+    )
+
+    # adding task informatino into postgres
+    ct = CeleryTask_model(
+        id=task.id,
+        status="PENDING",
+        status_msg="Submitted to job queue",
+        task_type="multiple driver with time window",
+        input_data=previous.input_data,
+    )
+    ct_query_engine.insert(ct)
+
+    return jsonify(resp), 200
+
+
+@app.route("/routeoptimization/insert/<task_id>", methods=["POST"])
+def VRPSPDTW_insertion_endpoint(task_id):
+    """
+        End point for cheapest insertion of one new order into completed VRPSPDTW plan,
+        answered synchronously (no celery task and no ortools search)
+        return best insertion options (driver and position in trip)
+    """
+    if not celery_task_id_verify(task_id):
+        resp = standard_response(status="FAILED", message="Invalid task id", data={})
+        return jsonify(resp), 400
+
+    inputs = VRPSPDTW_insertion_schema(request)
+    if not inputs.validate():
+        resp = standard_response(status="FAILED", message=inputs.errors, data={})
+        return jsonify(resp), 400
+
+    task = ct_query_engine.get_task(task_id)
+    if (
+        not task
+        or task.task_type != "multiple driver with time window"
+        or not task.out_data
+        or "driver_trips" not in task.out_data
+    ):
+        resp = standard_response(
+            status="FAILED", message="No completed plan for task id", data={}
+        )
+        return jsonify(resp), 400
+
+    order = request.json["order"]
+    if order["start_time"] > order["end_time"]:
+        resp = standard_response(
+            status="FAILED",
+            message="Order's delivery window start time is greater than end time.",
+            data={},
+        )
+        return jsonify(resp), 400
+    if any(o["order_id"] == order["order_id"] for o in task.input_data["orders"]):
+        resp = standard_response(
+            status="FAILED", message="Order id already in plan", data={}
+        )
+        return jsonify(resp), 400
+
+    try:
+        t1 = time.time()
+        data = deepcopy(task.input_data)
+        data["orders"] = data["orders"] + [order]
+        # stored stops are mapped onto nodes of request with new order as last node
+        data["warm_start_plan"] = {
+            "task_id": task_id,
+            "overlap": 1.0,
+            "steps": plan_steps(data, task.out_data),
+        }
+        unroll_VRPSPDTW_data(data)  # inplace dict updates
+        data["merge_orders"] = False
+        data["reuse_matrix"] = task.distance_matrix
+        solver = VRPSPDTW_ortools(data)
+        options, reason = insertion_options(
+            solver, request.json.get("options", INSERTION_OPTIONS)
+        )
+    except Exception as e:
+        celery_logger.exception(e)
+        resp = standard_response(status="FAILED", message="Insertion failed", data={})
+        return jsonify(resp), 500
+
+    result = {"options": options, "time_taken": round(time.time() - t1, 3)}
+    if reason is not None:
+        result["reason"] = reason
+    message = "Insertion options found" if options else "No feasible insertion"
+    resp = standard_response(status="SUCCESS", message=message, data=result)
+    return jsonify(resp), 200
+
+
 @app.route(
     "/routeoptimization/status/multipledriverwithtimewindow/<task_id>", methods=["GET"]
 )
@@ -845,6 +1162,177 @@ def VRPSPDTW_task_status(task_id):
 # --------------------------------------------
 
 
+# scenario endpoint path -> (task type, scenario schema)
+SCENARIO_PROBLEMS = {
+    "multipledriver": ("multiple driver", VRPSPD_scenarios_schema),
+    "multipledriverwithtimewindow": (
+        "multiple driver with time window",
+        VRPSPDTW_scenarios_schema,
+    ),
+}
+
+
+def check_scenarios(task_type, data):
+    """
+        checking request of every scenario (base with overrides) like a single request
+        of its problem, so that wrong overrides are rejected before queueing
+        return (status, message)
+    """
+    for i, scenario in enumerate(data["scenarios"]):
+        name = scenario.get("name", f"scenario {i + 1}")
+        request_data = scenario_request(data["base"], scenario.get("overrides", {}), task_type)
+        if task_type == "multiple driver":
+            errors = format_errors(VRPSPD_data_format, request_data)
+            for key in VRPSPD_VEHICLE_KEYS:
+                if not errors and len(request_data[key]) != request_data["no_vehicles"]:
+                    errors.append(f"{key}: expected {request_data['no_vehicles']} values")
+        else:
+            errors = format_errors(VRPSPDTW_data_format, request_data)
+            if not errors:
+                status, message = check_VRPSPDTW_windows(request_data)
+                errors = [] if status else [message]
+        if errors:
+            return False, {name: errors}
+    return True, None
+
+
+@celery.task(bind=True)
+def scenario_batch(self, problem, data):
+    """
+        async function solving what-if scenarios of one request,
+        all scenarios share one distance matrix
+    """
+    engine.dispose()
+
+    # updating status in postgres
+    ct_query_engine.update_task(
+        self.request.id, status_msg="Working on Optimization", input_data=data
+    )
+
+    try:
+        t1 = time.time()
+        names, requests = [], []
+        for i, scenario in enumerate(data["scenarios"]):
+            request_data = scenario_request(
+                data["base"], scenario.get("overrides", {}), problem
+            )
+            if problem == "multiple driver":
+                # recalculating capacity based on max util factor
+                request_data["capacity_of_vehicles"] = [
+                    request_data["capacity_of_vehicles"][v]
+                    * request_data["max_utilized_capacity_of_vehicles"][v]
+                    for v in range(request_data["no_vehicles"])
+                ]
+                unroll_data_v1(request_data)
+            else:
+                unroll_VRPSPDTW_data(request_data)
+            names.append(scenario.get("name", f"scenario {i + 1}"))
+            requests.append(request_data)
+
+        table, plans, matrix_time = solve_scenarios(problem, names, requests)
+        for name, out_data, request_data in zip(names, plans, requests):
+            out_data["scenario"] = name
+            out_data["excluded_orders"] = request_data.get(
+                "excluded_orders", []
+            ) + out_data.get("dropped_orders_by_solver", [])
+
+        out_data = {
+            "comparison": table,
+            "scenario_plans": plans,
+            "matrix_time": matrix_time,
+            "time_taken_to_solve": int(time.time() - t1),
+        }
+        celery_logger.info(f"scenario batch output: {table}")
+
+        # update response in postgres
+        ct_query_engine.update_task(
+            self.request.id,
+            status="SUCCESS",
+            status_msg="Optimization Completed",
+            out_data=out_data,
+        )
+
+        self.update_state(state="SUCCESS", meta={"result": out_data})
+
+    except Exception as e:
+        # update response in postgres
+        ct_query_engine.update_task(
+            self.request.id, status="FAILED", status_msg="Optimization Failed",
+        )
+        celery_logger.exception(e)
+        celery_logger.info(f"Exception Handled on {self.request.id}")
+        self.update_state(state="FAILED")
+
+    return {"status": "Task completed!"}
+
+
+@app.route("/routeoptimization/scenarios/<problem>", methods=["POST"])
+def scenario_batch_endpoint(problem):
+    """
+        End point for submiting what-if scenarios (base payload and list of overrides)
+        of multipledriver or multipledriverwithtimewindow optimization
+        return celery task id as response
+    """
+    if problem not in SCENARIO_PROBLEMS:
+        resp = standard_response(status="FAILED", message="Invalid problem", data={})
+        return jsonify(resp), 400
+    task_type, schema = SCENARIO_PROBLEMS[problem]
+
+    inputs = schema(request)
+    if not inputs.validate():
+        resp = standard_response(status="FAILED", message=inputs.errors, data={})
+        return jsonify(resp), 400
+
+    data = request.json
+    exclude_orders_without_location(data["base"])
+    validation_status, validation_msg = check_scenarios(task_type, data)
+    if not validation_status:
+        resp = standard_response(status="FAILED", message=validation_msg, data={})
+        return jsonify(resp), 400
+
+    # sending task to celery queue
+    task = scenario_batch.apply_async(args=[task_type, data])
+    resp = standard_response(
+        status="SUCCESS", message="Submitted to job queue", data={"task_id": task.id}
+    )
+
+    # adding task informatino into postgres
+    ct = CeleryTask_model(
+        id=task.id,
+        status="PENDING",
+        status_msg="Submitted to job queue",
+        task_type="scenario batch",
+        input_data=data,
+    )
+    ct_query_engine.insert(ct)
+
+    return jsonify(resp), 200
+
+
+@app.route("/routeoptimization/status/scenarios/<task_id>", methods=["GET"])
+def scenario_batch_status(task_id):
+    """
+    returns status of scenario batch celery task
+    """
+
+    if not celery_task_id_verify(task_id):
+        resp = standard_response(status="FAILED", message="Invalid task id", data={})
+        return jsonify(resp), 400
+
+    task = ct_query_engine.get_task(task_id)
+
+    if task:
+        resp = standard_response(
+            status=task.status, message=task.status_msg, data=task.out_data,
+        )
+    else:
+        resp = standard_response(
+            status="PENDING", message="task id not in persistent db", data={},
+        )
+
+    return jsonify(resp), 200
+
+
 @app.route("/routeoptimization/health", methods=["GET"])
 def debug_health():
     """
@@ -861,6 +1349,7 @@ def debug_health():
     data["no_total_task"] = len(tasks)
     data["no_success_task"] = sum([1 for task in tasks if task.status == "SUCCESS"])
     data["no_pending_task"] = sum([1 for task in tasks if task.status == "PENDING"])
+    data["no_improving_task"] = sum([1 for task in tasks if task.status == "IMPROVING"])
     task_data = []
 
     # sending last n tasks from postgres
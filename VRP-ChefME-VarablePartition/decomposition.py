@@ -0,0 +1,576 @@
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import math
+import os
+import time
+
+import numpy as np
+
+from location_util_osm import distance_matrix, location_to_latlong, MATRIX_FALLBACK
+from route_polish import serial_polish
+from solve_profiles import solve_profile
+from utils import possible_orderings
+from VRPSPDTW_ortools import VRPSPDTW_ortools
+
+logger = logging.getLogger(__name__)
+
+# decomposition configration
+# requests with atleast DECOMPOSITION_MIN_ORDERS orders are decomposed automatically
+DECOMPOSITION_MIN_ORDERS = int(os.environ.get("DECOMPOSITION_MIN_ORDERS", 300))
+# target no of orders per partition
+DECOMPOSITION_CLUSTER_SIZE = int(os.environ.get("DECOMPOSITION_CLUSTER_SIZE", 150))
+# no of partitions solved in parallel
+DECOMPOSITION_WORKERS = int(os.environ.get("DECOMPOSITION_WORKERS", os.cpu_count() or 1))
+# time limit of boundary repair solve of two neighbouring partitions (in seconds)
+DECOMPOSITION_REPAIR_TIME = int(os.environ.get("DECOMPOSITION_REPAIR_TIME", 30))
+# weight of time window (as driving distance) against geographic distance in clustering
+TIME_WINDOW_WEIGHT = 0.5
+KM_PER_DEGREE = 111.32
+
+# per order and per vehicle lists of VRPSPDTW request (after unrolling)
+ORDER_KEYS = (
+    "locations_of_orders",
+    "delivery_sizes",
+    "do_numbers",
+    "type_of_orders",
+    "delivery_windows",
+    "customer_handover_time",
+    "order_storage",
+)
+VEHICLE_KEYS = (
+    "capacity_of_vehicles",
+    "duty_time",
+    "vehicle_storage",
+    "vehicle_start_locations",
+    "onboard_orders",
+    "vehicle_available",
+)
+
+
+def should_decompose(raw_data):
+    """
+        decomposition is used if requested explicitly or for large requests,
+        "decomposition": false always solves single routing model
+    """
+    options = raw_data.get("decomposition")
+    if options is False:
+        return False
+    if isinstance(options, dict):
+        return True
+    return len(raw_data["do_numbers"]) >= DECOMPOSITION_MIN_ORDERS
+
+
+def storage_classes(raw_data):
+    """
+        split of orders and vehicles into independent storage classes, when vehicle
+        storage types partition the fleet cleanly (eg. frozen-only vs dry-only trucks),
+        return list of (order indexes, vehicle indexes), empty list otherwise.
+
+        Vehicles are connected if they carry a storage type required by some order,
+        every connected group of vehicles with its orders is one class. Orders whose
+        storage type is not carried by any vehicle and vehicles not needed by any order
+        are kept in first class.
+    """
+    if raw_data.get("decomposition") is False:
+        return []
+    n_orders = len(raw_data["do_numbers"])
+    n_vehicles = raw_data["no_vehicles"]
+    order_storage = raw_data.get("order_storage") or []
+    vehicle_storage = raw_data.get("vehicle_storage") or []
+    if len(order_storage) != n_orders or len(vehicle_storage) != n_vehicles:
+        return []
+
+    # union-find over vehicles
+    parent = list(range(n_vehicles))
+
+    def find(v):
+        while parent[v] != v:
+            parent[v] = parent[parent[v]]
+            v = parent[v]
+        return v
+
+    storage_vehicles = dict()
+    for storage in set(order_storage):
+        vehicles = [v for v in range(n_vehicles) if storage in vehicle_storage[v]]
+        storage_vehicles[storage] = vehicles
+        for v in vehicles[1:]:
+            parent[find(v)] = find(vehicles[0])
+
+    class_orders = dict()
+    unassigned = []
+    for i, storage in enumerate(order_storage):
+        if storage_vehicles[storage]:
+            class_orders.setdefault(find(storage_vehicles[storage][0]), []).append(i)
+        else:
+            unassigned.append(i)
+    if len(class_orders) < 2:
+        return []
+
+    roots = sorted(class_orders, key=lambda root: class_orders[root][0])
+    classes = [(class_orders[root], []) for root in roots]
+    for v in range(n_vehicles):
+        root = find(v)
+        c = roots.index(root) if root in class_orders else 0
+        classes[c][1].append(v)
+    classes[0] = (sorted(classes[0][0] + unassigned), classes[0][1])
+    return classes
+
+
+def subset_request(raw_data, orders, vehicles):
+    """
+        VRPSPDTW request with only given orders and vehicles (indexes)
+        optional lists which are not given per order/vehicle are kept as it is
+    """
+    n_orders = len(raw_data["do_numbers"])
+    n_vehicles = raw_data["no_vehicles"]
+
+    sub_data = dict(raw_data)
+    for key in ORDER_KEYS:
+        if len(raw_data.get(key) or []) == n_orders:
+            sub_data[key] = [raw_data[key][i] for i in orders]
+    for key in VEHICLE_KEYS:
+        if len(raw_data.get(key) or []) == n_vehicles:
+            sub_data[key] = [raw_data[key][i] for i in vehicles]
+
+    sub_data["total_orders"] = len(orders)
+    sub_data["no_vehicles"] = len(vehicles)
+    # stored plan of recurring instance has steps of every vehicle
+    if raw_data.get("warm_start_plan"):
+        plan = raw_data["warm_start_plan"]
+        sub_data["warm_start_plan"] = dict(plan, steps=[plan["steps"][i] for i in vehicles])
+    return sub_data
+
+
+def order_features(raw_data):
+    """
+        clustering features of orders:
+            customer location (non-warehouse end of order) in local km coordinates
+            mid of delivery window as driving distance in km
+    """
+    depot_lat, depot_long = location_to_latlong(raw_data["depot_location"])
+    customers = np.array(
+        [
+            location_to_latlong(source if order_type else destination)
+            for (source, destination), order_type in zip(
+                raw_data["locations_of_orders"], raw_data["type_of_orders"]
+            )
+        ]
+    ).reshape(-1, 2)
+    x = (customers[:, 1] - depot_long) * KM_PER_DEGREE * math.cos(math.radians(depot_lat))
+    y = (customers[:, 0] - depot_lat) * KM_PER_DEGREE
+
+    windows = np.array(raw_data["delivery_windows"], dtype=float).reshape(-1, 2)
+    avg_speed = raw_data.get("avg_speed", 50)
+    t = windows.mean(axis=1) / 60 * avg_speed * TIME_WINDOW_WEIGHT
+
+    return np.column_stack([x, y, t])
+
+
+def kmeans(features, k, seed=0, iterations=50):
+    """
+        vectorized k-means (k-means++ initialization), return cluster label of each row
+    """
+    rng = np.random.default_rng(seed)
+    centers = [features[rng.integers(len(features))]]
+    for _ in range(1, k):
+        dist = ((features[:, None, :] - np.array(centers)[None]) ** 2).sum(-1).min(1)
+        total = dist.sum()
+        if total == 0:
+            centers.append(features[rng.integers(len(features))])
+        else:
+            centers.append(features[rng.choice(len(features), p=dist / total)])
+    centers = np.array(centers)
+
+    labels = np.zeros(len(features), dtype=int)
+    for i in range(iterations):
+        dist = ((features[:, None, :] - centers[None]) ** 2).sum(-1)
+        new_labels = dist.argmin(1)
+        if i and (new_labels == labels).all():
+            break
+        labels = new_labels
+        for c in range(k):
+            members = features[labels == c]
+            if len(members):
+                centers[c] = members.mean(0)
+    return labels
+
+
+def sweep(features, k):
+    """
+        sweep clustering, orders are sorted by polar angle around warehouse
+        and cut into k partitions of equal size
+    """
+    angle = np.arctan2(features[:, 1], features[:, 0])
+    order = np.argsort(angle, kind="stable")
+    labels = np.empty(len(features), dtype=int)
+    for c, chunk in enumerate(np.array_split(order, k)):
+        labels[chunk] = c
+    return labels
+
+
+def partition_orders(raw_data, k, method="kmeans"):
+    """
+        partition orders geographically and by time window,
+        return list of order index lists (empty partitions are removed)
+    """
+    features = order_features(raw_data)
+    if method == "sweep":
+        labels = sweep(features, k)
+    elif method == "kmeans":
+        labels = kmeans(features, k)
+    else:
+        raise ValueError(f"Invalid decomposition method {method}")
+    partitions = [np.flatnonzero(labels == c).tolist() for c in range(k)]
+    return [orders for orders in partitions if orders]
+
+
+def allocate_vehicles(raw_data, partitions):
+    """
+        allocate vehicles to partitions in proportion to load (sum of order sizes),
+        every partition gets atleast one vehicle. With order / vehicle storage types,
+        every storage type of partition's orders is first covered by a vehicle
+        carrying it (if any is left). Remaining vehicles, largest first, go to
+        partition with largest uncovered load, preferring partitions with orders
+        they can carry.
+    """
+    sizes = raw_data["delivery_sizes"]
+    capacities = raw_data["capacity_of_vehicles"]
+    loads = np.array([sum(sizes[i] for i in orders) for orders in partitions], dtype=float)
+
+    # largest remainder quotas
+    n_vehicles = raw_data["no_vehicles"]
+    extra = n_vehicles - len(partitions)
+    share = loads / loads.sum() * extra if loads.sum() else np.zeros(len(partitions))
+    quotas = np.floor(share).astype(int)
+    for c in np.argsort(-(share - quotas))[: extra - quotas.sum()]:
+        quotas[c] += 1
+    quotas += 1
+
+    order_storage = raw_data.get("order_storage") or []
+    vehicle_storage = raw_data.get("vehicle_storage") or []
+    with_storage = len(order_storage) == len(sizes) and len(vehicle_storage) == n_vehicles
+    needs = [
+        set(order_storage[i] for i in orders) if with_storage else set()
+        for orders in partitions
+    ]
+
+    def carries(v, c):
+        return any(storage in vehicle_storage[v] for storage in needs[c])
+
+    uncovered = loads.copy()
+    vehicles = [[] for _ in partitions]
+    free = sorted(range(n_vehicles), key=lambda v: -capacities[v])
+
+    def assign(v, c):
+        vehicles[c].append(v)
+        uncovered[c] -= capacities[v]
+        free.remove(v)
+
+    # storage types of every partition are covered first (heaviest partition first)
+    for c in np.argsort(-loads):
+        for storage in sorted(needs[c]):
+            if any(storage in vehicle_storage[v] for v in vehicles[c]):
+                continue
+            candidates = [v for v in free if storage in vehicle_storage[v]]
+            if candidates:
+                # vehicle covering most storage types of partition, largest first
+                covered = [sum(s in vehicle_storage[v] for s in needs[c]) for v in candidates]
+                assign(candidates[int(np.argmax(covered))], c)
+
+    for v in list(free):
+        open_partitions = [c for c in range(len(partitions)) if len(vehicles[c]) < quotas[c]]
+        open_partitions = open_partitions or list(range(len(partitions)))
+        c = max(
+            open_partitions,
+            key=lambda c: (not with_storage or carries(v, c), not vehicles[c], uncovered[c]),
+        )
+        assign(v, c)
+    return [sorted(v) for v in vehicles]
+
+
+def _solve_partition(sub_data):
+    """
+        solve one partition (runs in worker process),
+        large storage classes are decomposed further
+    """
+    try:
+        if should_decompose(sub_data):
+            return DecomposedVRPSPDTW(sub_data).solve()
+        return VRPSPDTW_ortools(sub_data).solve()
+    except Exception as e:
+        logger.exception(e)
+        return {"optimized_status": False}
+
+
+def _partition_cost(result, n_orders):
+    """
+        (no of unserved orders, distance) of partition solution, lower is better
+    """
+    if not result.get("optimized_status"):
+        return (n_orders, 0)
+    return (len(result["dropped_orders_by_solver"]), result["optimized_distance"])
+
+
+class DecomposedVRPSPDTW:
+    """
+        Cluster-first, route-second solver for very large VRPSPDTW requests.
+
+        1. orders are partitioned geographically and by delivery window (k-means or sweep)
+        2. vehicles are allocated to partitions in proportion to load, covering
+           storage types of every partition first
+        3. partitions are solved with VRPSPDTW_ortools in parallel processes,
+           sharing one distance matrix of whole request
+        4. boundary repair: neighbouring partitions are solved jointly for a short time
+           and joint plan is kept if it serves more orders or covers less distance
+        5. partition plans are merged back into VRPSPDTW output format
+
+        options (request's "decomposition" dict):
+            cluster_size : target no of orders per partition
+            method       : "kmeans" or "sweep"
+            repair_time  : time limit of repair solve in seconds (0 disables repair)
+    """
+
+    def __init__(self, data):
+        self.raw_data = data
+        options = data.get("decomposition") or {}
+        self.cluster_size = options.get("cluster_size", DECOMPOSITION_CLUSTER_SIZE)
+        self.method = options.get("method", "kmeans")
+        self.repair_time = options.get("repair_time", DECOMPOSITION_REPAIR_TIME)
+        self.workers = DECOMPOSITION_WORKERS
+
+        self.n_orders = len(data["do_numbers"])
+        self.n_vehicles = data["no_vehicles"]
+        self.matrix = None
+        self.partition()
+
+    def partition(self):
+        """
+            geographic partitions and their vehicles
+        """
+        k = min(math.ceil(self.n_orders / self.cluster_size), self.n_vehicles)
+        self.partitions = partition_orders(self.raw_data, max(k, 1), self.method)
+        self.vehicles = allocate_vehicles(self.raw_data, self.partitions)
+
+    def shared_matrix(self):
+        """
+            distance matrix between all locations of request, built once and reused
+            by every partition and repair solve (see location_util_osm.distance_matrix base)
+        """
+        if self.matrix is None:
+            locations = [self.raw_data["depot_location"]]
+            for source, destination in self.raw_data["locations_of_orders"]:
+                locations += [source, destination]
+            starts = self.raw_data.get("vehicle_start_locations") or []
+            locations += [location for location in starts if location]
+            self.matrix = distance_matrix(
+                locations,
+                mode=self.raw_data.get("distance_mode", "road"),
+                fallback=self.raw_data.get("matrix_fallback", MATRIX_FALLBACK),
+                base=self.raw_data.get("reuse_matrix"),
+            )
+        return self.matrix
+
+    def _sub_request(self, orders, vehicles, max_solver_time=None):
+        sub_data = subset_request(self.raw_data, orders, vehicles)
+        # partitions share road distances of whole request
+        sub_data["reuse_matrix"] = self.shared_matrix()
+        # partitions are already solved in parallel
+        sub_data["portfolio"] = {"workers": 1}
+        sub_data["polish"] = serial_polish(
+            self.raw_data.get("polish", solve_profile(self.raw_data).get("polish"))
+        )
+        # geographic partitions are not decomposed again
+        sub_data["decomposition"] = False
+        # merged plan does not report gap, partitions skip lower bound
+        sub_data["report_gap"] = False
+        if max_solver_time is not None:
+            sub_data["max_solver_time"] = max_solver_time
+        return sub_data
+
+    def _solve_all(self, sub_requests):
+        workers = max(1, min(self.workers, len(sub_requests)))
+        if workers == 1:
+            return [_solve_partition(sub_data) for sub_data in sub_requests]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(_solve_partition, sub_requests))
+
+    def neighbour_pairs(self):
+        """
+            disjoint pairs of neighbouring partitions (closest centroids first)
+        """
+        features = order_features(self.raw_data)
+        centroids = np.array([features[orders].mean(0) for orders in self.partitions])
+        dist = np.sqrt(((centroids[:, None] - centroids[None]) ** 2).sum(-1))
+        candidates = sorted(
+            (dist[a, b], a, b)
+            for a in range(len(centroids))
+            for b in range(a + 1, len(centroids))
+        )
+        paired, pairs = set(), []
+        for _, a, b in candidates:
+            if a not in paired and b not in paired:
+                paired.update((a, b))
+                pairs.append((a, b))
+        return pairs
+
+    def repair(self, results):
+        """
+            boundary repair pass, neighbouring partitions are solved jointly
+            and joint plan replaces both partition plans if it is better
+        """
+        pairs = self.neighbour_pairs()
+        sub_requests = [
+            self._sub_request(
+                self.partitions[a] + self.partitions[b],
+                self.vehicles[a] + self.vehicles[b],
+                self.repair_time,
+            )
+            for a, b in pairs
+        ]
+        repaired = []
+        for (a, b), result in zip(pairs, self._solve_all(sub_requests)):
+            n_orders = len(self.partitions[a]) + len(self.partitions[b])
+            cost_a = _partition_cost(results[a], len(self.partitions[a]))
+            cost_b = _partition_cost(results[b], len(self.partitions[b]))
+            current = (cost_a[0] + cost_b[0], cost_a[1] + cost_b[1])
+            if _partition_cost(result, n_orders) < current:
+                repaired.append((a, b, result))
+
+        # merging repaired pairs into single partition
+        for a, b, result in repaired:
+            self.partitions[a] = self.partitions[a] + self.partitions[b]
+            self.vehicles[a] = self.vehicles[a] + self.vehicles[b]
+            results[a] = result
+            self.partitions[b], self.vehicles[b], results[b] = [], [], None
+
+        keep = [c for c in range(len(self.partitions)) if self.partitions[c]]
+        self.partitions = [self.partitions[c] for c in keep]
+        self.vehicles = [self.vehicles[c] for c in keep]
+        return [results[c] for c in keep], len(repaired)
+
+    def merge(self, results):
+        """
+            merge partition plans into VRPSPDTW output response
+        """
+        duty_time = self.raw_data["duty_time"]
+        driver_trips = [
+            {
+                "trip_detail": [],
+                "vehicle": {"max_capacity_used": 0, "distance_covered": 0.0},
+                "driver": {
+                    "duty_completed_time": duty_time[v][0],
+                    "time_spend_on_driving": 0,
+                    "time_spend_on_drop": 0,
+                    "time_spend_on_pickup": 0,
+                },
+            }
+            for v in range(self.n_vehicles)
+        ]
+        dropped, infeasible, sources, objective = [], [], set(), 0
+        for orders, vehicles, result in zip(self.partitions, self.vehicles, results):
+            if not result.get("optimized_status"):
+                dropped += [self.raw_data["do_numbers"][i] for i in orders]
+                continue
+            for v, trip in zip(vehicles, result["driver_trips"]):
+                driver_trips[v] = trip
+            dropped += result["dropped_orders_by_solver"]
+            infeasible += result.get("infeasible_orders", [])
+            sources.add(result["distance_source"])
+            objective += result["objective"]
+
+        data = dict()
+        data["optimized_status"] = len(sources) > 0
+        data["optimized_distance"] = sum(
+            trip["vehicle"]["distance_covered"] for trip in driver_trips
+        )
+        data["objective"] = objective
+        data["distance_source"] = sources.pop() if len(sources) == 1 else "mixed"
+        data["no_driver_utilized"] = sum(
+            [1 for trip in driver_trips if len(trip["trip_detail"]) > 0]
+        )
+        data["driver_trips"] = driver_trips
+        (
+            data["all_possible_orderings"],
+            data["tried_orderings"],
+        ) = possible_orderings(self.n_orders)
+        data["infeasible_orders"] = infeasible
+        data["dropped_orders_by_solver"] = dropped
+        return data
+
+    def solve(self, progress=None):
+        """
+            solving all partitions in parallel, repairing boundaries and merging plans
+            (intermediate plans are not published, partitions are solved in other processes)
+        """
+        t1 = time.time()
+        n_partitions = len(self.partitions)
+        logger.info(
+            f"decomposing {self.n_orders} orders into {len(self.partitions)} partitions "
+            f"with {list(map(len, self.vehicles))} vehicles"
+        )
+        results = self._solve_all(
+            [
+                self._sub_request(orders, vehicles)
+                for orders, vehicles in zip(self.partitions, self.vehicles)
+            ]
+        )
+
+        n_repaired = 0
+        if self.repair_time and len(self.partitions) > 1:
+            results, n_repaired = self.repair(results)
+
+        data = self.merge(results)
+        data["search_time"] = round(time.time() - t1, 3)
+        data["route_cache"] = self.shared_matrix().route_stats
+        data["decomposition"] = {
+            "method": self.method,
+            "initial_partitions": n_partitions,
+            "partitions": len(self.partitions),
+            "orders_per_partition": list(map(len, self.partitions)),
+            "vehicles_per_partition": list(map(len, self.vehicles)),
+            "repaired_pairs": n_repaired,
+        }
+        if self.raw_data.get("telemetry"):
+            # search telemetry of every partition solve
+            data["decomposition"]["telemetry"] = [result.get("telemetry") for result in results]
+        return data
+
+
+class StorageSplitVRPSPDTW(DecomposedVRPSPDTW):
+    """
+        Solver for VRPSPDTW requests whose storage types partition the fleet cleanly
+        (see storage_classes). Storage classes share no vehicle, so they are solved
+        exactly as independent subproblems in parallel processes and merged,
+        without boundary repair. Large classes are decomposed further.
+    """
+
+    def partition(self):
+        classes = storage_classes(self.raw_data)
+        self.partitions = [orders for orders, _ in classes]
+        self.vehicles = [vehicles for _, vehicles in classes]
+        self.method = "storage"
+        self.repair_time = 0
+
+    def _sub_request(self, orders, vehicles, max_solver_time=None):
+        sub_data = super()._sub_request(orders, vehicles, max_solver_time)
+        # decomposition options of request are used for large storage classes
+        if "decomposition" in self.raw_data:
+            sub_data["decomposition"] = self.raw_data["decomposition"]
+        else:
+            sub_data.pop("decomposition")
+        return sub_data
+
+
+def vrpspdtw_solver(raw_data):
+    """
+        solver of VRPSPDTW request: independent storage classes and very large
+        requests are partitioned and solved in parallel, others as single model
+        (fast engine always builds single plan, see fast_engine)
+    """
+    if raw_data.get("engine") == "fast":
+        return VRPSPDTW_ortools(raw_data)
+    if storage_classes(raw_data):
+        return StorageSplitVRPSPDTW(raw_data)
+    if should_decompose(raw_data):
+        return DecomposedVRPSPDTW(raw_data)
+    return VRPSPDTW_ortools(raw_data)
@@ -0,0 +1,112 @@
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# single trips with atmost EXACT_MAX_ORDERS orders are solved exactly (0 disables)
+# measured cost per call with every order as pickup + delivery pair (2 nodes each):
+#   8 orders: 0.02 s, 5 MB    9 orders: 0.1 s, 17 MB    10 orders: 0.4 s, 60 MB
+EXACT_MAX_ORDERS = int(os.environ.get("EXACT_MAX_ORDERS", 8))
+# no of nodes (pickup and delivery) above which exact solver is never used
+EXACT_MAX_NODES = 20
+
+_INF = np.iinfo(np.int64).max // 4
+
+
+def feasible_masks(n_nodes, pairs, demands, capacity, start_load):
+    """
+        all sets of visited nodes (bitmask of nodes 1..n_nodes) which respect
+        pickup before delivery precedence and vehicle capacity
+
+        load after visiting a set of nodes only depends on the set
+        (start load + demands of visited nodes), so capacity is checked per set.
+    """
+    masks = np.arange(1 << n_nodes, dtype=np.int64)
+
+    ok = np.ones(len(masks), dtype=bool)
+    for pickup, delivery in pairs:
+        ok &= ((masks >> (delivery - 1)) & 1) <= ((masks >> (pickup - 1)) & 1)
+
+    load = np.full(len(masks), start_load, dtype=np.int64)
+    sizes = np.zeros(len(masks), dtype=np.int64)
+    for node in range(n_nodes):
+        bit = (masks >> node) & 1
+        load += bit * int(demands[node + 1])
+        sizes += bit
+    ok &= load <= capacity
+    return masks[ok], sizes[ok]
+
+
+def solve_exact(transit, pairs, demands, capacity, start_load=0):
+    """
+        Exact single vehicle pickup and delivery route by bitmask dynamic programming
+        (Held-Karp restricted to precedence and capacity feasible node sets).
+
+        transit    : (n+1) x (n+1) integer arc cost matrix, node 0 is warehouse
+        pairs      : [pickup node, delivery node] pairs
+        demands    : load change of every node (0 for warehouse)
+        capacity   : vehicle capacity
+        start_load : load when leaving warehouse (orders loaded at start of route)
+
+        cost[set, last] = min cost of route leaving warehouse, visiting set and ending
+        at last, computed layer by layer (no of visited nodes) with numpy.
+
+        return (cost, route) of optimal closed route starting and ending at warehouse,
+        route is node list without final warehouse, None if no feasible route exists
+    """
+    transit = np.asarray(transit, dtype=np.int64)
+    n_nodes = len(transit) - 1
+    if start_load > capacity:
+        return None
+    if n_nodes == 0:
+        return int(transit[0, 0]), [0]
+
+    masks, sizes = feasible_masks(n_nodes, pairs, demands, capacity, start_load)
+    full = (1 << n_nodes) - 1
+    if masks[-1] != full:
+        return None
+    # position of mask in feasible masks (-1 if infeasible)
+    position = np.full(1 << n_nodes, -1, dtype=np.int64)
+    position[masks] = np.arange(len(masks))
+    node_bits = np.int64(1) << np.arange(n_nodes, dtype=np.int64)
+
+    cost = np.full((len(masks), n_nodes), _INF, dtype=np.int64)
+    arcs = transit[1:, 1:]
+    for j in range(n_nodes):
+        idx = position[node_bits[j]]
+        if idx >= 0:
+            cost[idx, j] = transit[0, j + 1]
+
+    for size in range(1, n_nodes):
+        layer = np.flatnonzero(sizes == size)
+        # best cost of extending every set of layer with every node
+        extended = (cost[layer][:, :, None] + arcs[None]).min(axis=1)
+        for j in range(n_nodes):
+            free = (masks[layer] & node_bits[j]) == 0
+            target = position[masks[layer[free]] | node_bits[j]]
+            reachable = target >= 0
+            np.minimum.at(
+                cost[:, j], target[reachable], extended[free][reachable, j]
+            )
+
+    last = cost[position[full]] + transit[1:, 0]
+    if last.min() >= _INF:
+        return None
+
+    # backtracking optimal route
+    j = int(last.argmin())
+    total = int(last[j])
+    mask = full
+    route = []
+    while True:
+        route.append(j + 1)
+        previous = mask ^ int(node_bits[j])
+        if previous == 0:
+            break
+        candidates = cost[position[previous]] + arcs[:, j]
+        j = int(candidates.argmin())
+        mask = previous
+    route.append(0)
+    return total, route[::-1]
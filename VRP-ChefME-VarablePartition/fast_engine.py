@@ -0,0 +1,576 @@
+import logging
+import os
+import time
+
+import numpy as np
+
+from lower_bound import gap_summary
+from order_insertion import pair_insertions, route_profile, single_insertions
+
+logger = logging.getLogger(__name__)
+
+# fast engine configration
+# savings partners kept for every route end
+FAST_NEIGHBOURS = int(os.environ.get("FAST_NEIGHBOURS", 30))
+# time budget of 2-opt / or-opt improvement of all routes (in seconds)
+FAST_IMPROVE_TIME = float(os.environ.get("FAST_IMPROVE_TIME", 0.3))
+# routes tried for every inserted order (routes passing closest to the order first)
+FAST_INSERTION_ROUTES = int(os.environ.get("FAST_INSERTION_ROUTES", 10))
+# longest segment moved by or-opt
+FAST_OR_OPT_LENGTH = 3
+# cheapest improving moves checked for feasibility per improvement step
+FAST_MOVE_TRIES = 20
+
+
+def concat(first, second, transit):
+    """
+        time window segment of first followed by second, with waiting allowed
+        (segment concatenation of Vidal et al.). Segment is
+        (duration, earliest start, latest start, first node, last node),
+        return None if second can not be reached within its window
+    """
+    d1, e1, l1, a1, b1 = first
+    d2, e2, l2, a2, b2 = second
+    delta = d1 + int(transit[b1, a2])
+    if e1 + delta > l2:
+        return None
+    wait = max(e2 - delta - l1, 0)
+    return (delta + d2 + wait, max(e2 - delta, e1) - wait, min(l2 - delta, l1), a1, b2)
+
+
+def vehicle_classes(data):
+    """
+        vehicles grouped by (capacity, start node, duty time) as
+        {class key: bitmask of vehicles}
+    """
+    classes = dict()
+    for v in range(data["num_vehicles"]):
+        key = (
+            data["vehicle_capacities"][v],
+            data["vehicle_starts"][v],
+            tuple(data["duty_time"][v]),
+        )
+        classes[key] = classes.get(key, 0) | 1 << v
+    return classes
+
+
+def fits(data, route, key):
+    """
+        True if route (see new_route) can be driven by vehicle of class key
+    """
+    capacity, start, duty = key
+    if route["peak"] > capacity:
+        return False
+    window = duty
+    if route["loaded"]:
+        # vehicles on the way can not load at warehouse anymore
+        if start != data["depot"]:
+            return False
+        pickup = data["warehouse_pickup_time"]
+        window = (max(duty[0], pickup[0]), min(duty[1], pickup[1]))
+    transit = data["transit_matrix"]
+    segment = concat((0, window[0], window[1], start, start), route["segment"], transit)
+    if segment is None:
+        return False
+    end = (0, duty[0], duty[1], data["depot"], data["depot"])
+    return concat(segment, end, transit) is not None
+
+
+def part(data, nodes, carried=0):
+    """
+        part of route (see new_route) visiting nodes in order, carried is load
+        taken at start of part besides demands of its nodes
+            nodes   : nodes of part
+            segment : time window segment of nodes (None if part has no nodes)
+            net     : load change over part
+            top     : max load change from start of part
+        None if nodes can not be visited within their windows
+    """
+    transit = data["transit_matrix"]
+    segment = None
+    load = top = carried
+    for node in nodes:
+        window = data["time_windows"][node]
+        visit = (0, window[0], window[1], node, node)
+        segment = visit if segment is None else concat(segment, visit, transit)
+        if segment is None:
+            return None
+        load += data["demands"][node]
+        top = max(top, load)
+    return {"nodes": list(nodes), "segment": segment, "net": load, "top": top}
+
+
+def join(data, first, second):
+    """
+        part first followed by part second, None if windows do not hold
+    """
+    if first["segment"] is None or second["segment"] is None:
+        segment = first["segment"] or second["segment"]
+    else:
+        segment = concat(first["segment"], second["segment"], data["transit_matrix"])
+        if segment is None:
+            return None
+    return {
+        "nodes": first["nodes"] + second["nodes"],
+        "segment": segment,
+        "net": first["net"] + second["net"],
+        "top": max(first["top"], first["net"] + second["top"]),
+    }
+
+
+def whole_route(data, head, body, tail, mask, loaded):
+    """
+        route of parts head (warehouse pickups), body (customer nodes) and
+        tail (warehouse drops), None if windows do not hold
+    """
+    whole = join(data, head, body)
+    whole = whole and join(data, whole, tail)
+    if whole is None:
+        return None
+    return {
+        "head": head,
+        "body": body,
+        "tail": tail,
+        "nodes": whole["nodes"],
+        "segment": whole["segment"],
+        "peak": whole["top"],
+        "mask": mask,
+        "loaded": loaded,
+    }
+
+
+def new_route(data, unit, mask):
+    """
+        route serving one order: (pickup node or None, delivery node)
+            head    : part of nodes at warehouse visited at start of route
+                      (pickup node of deliveries, load of orders loaded at start)
+            body    : part of customer nodes
+            tail    : part of nodes at warehouse visited at end of route
+                      (drop node of pickups)
+            nodes   : route nodes, head then body then tail
+            segment : time window segment of route nodes
+            peak    : max load on route
+            mask    : bitmask of vehicles allowed to serve route
+            loaded  : route has orders loaded at warehouse
+        None if order can not be served on its own
+    """
+    pickup, delivery = unit
+    warehouse = data["warehouse_set"]
+    head, body, tail = [], [], []
+    carried = 0
+    if pickup is None:
+        # loaded at warehouse or already on vehicle
+        carried = -data["demands"][delivery]
+    elif pickup in warehouse:
+        head.append(pickup)
+    else:
+        body.append(pickup)
+    (tail if delivery in warehouse else body).append(delivery)
+    parts = [part(data, head, carried), part(data, body), part(data, tail)]
+    if None in parts:
+        return None
+    return whole_route(data, *parts, mask, delivery in data["loaded_set"])
+
+
+def merge(data, first, second, classes):
+    """
+        route serving orders of first and second, warehouse pickups of both
+        are loaded before customer nodes of first followed by customer nodes of
+        second, warehouse drops of both are at the end.
+        None if no vehicle class can drive it
+    """
+    mask = first["mask"] & second["mask"]
+    if not mask:
+        return None
+    parts = [join(data, first[name], second[name]) for name in ("head", "body", "tail")]
+    if None in parts:
+        return None
+    route = whole_route(data, *parts, mask, first["loaded"] or second["loaded"])
+    if route is None:
+        return None
+    for key, vehicles in classes.items():
+        if vehicles & mask and fits(data, route, key):
+            return route
+    return None
+
+
+def customer_ends(route):
+    """
+        (first, last) customer node of route, warehouse nodes if route has none
+    """
+    nodes = route["body"]["nodes"] or route["nodes"]
+    return nodes[0], nodes[-1]
+
+
+def savings_routes(data, units, masks, classes):
+    """
+        Clarke-Wright savings for pickup and delivery orders
+
+        Every order starts on its own route, routes are merged (see merge) in
+        decreasing order of saving between last customer of one route and first
+        customer of other
+            transit[end, depot] + transit[depot, start] - transit[end, start]
+        (nodes at warehouse are loading / unloading at start / end of route and
+        do not take part in savings). Savings of all route ends x route starts are
+        computed at once, only FAST_NEIGHBOURS best partners of every end are kept.
+        Merge is accepted if capacity, time windows, duty time and vehicle
+        restrictions of atleast one vehicle class still hold.
+
+        return (routes, orders which no vehicle can serve on their own)
+    """
+    routes = dict()
+    leftover = []
+    for u, (unit, mask) in enumerate(zip(units, masks)):
+        route = new_route(data, unit, mask) if mask else None
+        if route is not None and not any(
+            vehicles & mask and fits(data, route, key) for key, vehicles in classes.items()
+        ):
+            route = None
+        if route is None:
+            leftover.append(u)
+        else:
+            routes[u] = route
+    if len(routes) < 2:
+        return list(routes.values()), leftover
+
+    ids = np.array(list(routes))
+    starts, ends = map(np.array, zip(*(customer_ends(routes[u]) for u in ids)))
+    transit = data["transit_matrix"]
+    depot = data["depot"]
+    saving = (
+        transit[ends, depot][:, None] + transit[depot, starts][None, :]
+        - transit[np.ix_(ends, starts)]
+    )
+    # route is never merged with itself (only positive savings are kept)
+    np.fill_diagonal(saving, 0)
+    k = min(FAST_NEIGHBOURS, len(ids) - 1)
+    partners = np.argpartition(-saving, k - 1, axis=1)[:, :k]
+    rows = np.repeat(np.arange(len(ids)), k)
+    cols = partners.ravel()
+    values = saving[rows, cols]
+    keep = values > 0
+    rows, cols, values = rows[keep], cols[keep], values[keep]
+    order = np.argsort(-values, kind="stable")
+
+    # route id of every current route end / start node
+    end_of = {int(node): int(u) for node, u in zip(ends, ids)}
+    start_of = {int(node): int(u) for node, u in zip(starts, ids)}
+    for r, c in zip(rows[order], cols[order]):
+        a, b = end_of.get(int(ends[r])), start_of.get(int(starts[c]))
+        if a is None or b is None or a == b:
+            continue
+        route = merge(data, routes[a], routes[b], classes)
+        if route is None:
+            continue
+        del routes[b], end_of[int(ends[r])], start_of[int(starts[c])]
+        routes[a] = route
+        end_of[customer_ends(route)[1]] = a
+    return list(routes.values()), leftover
+
+
+def assign_vehicles(data, routes, classes):
+    """
+        routes onto vehicles, heaviest and longest routes first, every route takes
+        smallest free vehicle which can drive it
+
+        return (route of every vehicle, routes no free vehicle can drive)
+    """
+    vehicle_class = {
+        v: key
+        for key, vehicles in classes.items()
+        for v in range(data["num_vehicles"])
+        if vehicles >> v & 1
+    }
+    assigned = [None] * data["num_vehicles"]
+    unassigned = []
+    for route in sorted(routes, key=lambda route: (-route["peak"], -route["segment"][0])):
+        candidates = [
+            v
+            for v in range(data["num_vehicles"])
+            if assigned[v] is None
+            and route["mask"] >> v & 1
+            and fits(data, route, vehicle_class[v])
+        ]
+        if not candidates:
+            unassigned.append(route)
+            continue
+        v = min(candidates, key=lambda v: data["vehicle_capacities"][v])
+        assigned[v] = route["nodes"]
+    return [nodes or [] for nodes in assigned], unassigned
+
+
+def route_ok(data, vehicle_id, route, pairs):
+    """
+        True if route satisfies precedence, capacity, time windows and duty time
+    """
+    position = {node: i for i, node in enumerate(route)}
+    for node in route:
+        if node in pairs and not position[node] < position[pairs[node]]:
+            return False
+    profile = route_profile(data, vehicle_id, route)
+    return profile is not None and profile["load"].max() <= data["vehicle_capacities"][vehicle_id]
+
+
+def cheapest_insertion(data, routes, unit, mask, profiles):
+    """
+        insert order (pickup node or None, delivery node) into its cheapest feasible
+        position over routes of allowed vehicles, return False if there is none
+
+        Only FAST_INSERTION_ROUTES routes passing closest to the order are tried.
+        profiles caches route profiles by (vehicle, loaded start), profiles of
+        changed route are dropped
+    """
+    pickup, delivery = unit
+    loaded = delivery in data["loaded_set"]
+    carried = loaded or delivery in data["onboard_nodes"]
+    vehicles = [v for v in range(len(routes)) if mask >> v & 1]
+    if not vehicles:
+        return False
+    # distance from nearest node of every route (start node included) to customer
+    # end of order (its node farthest from warehouse)
+    transit = data["transit_matrix"]
+    customer = max(
+        (node for node in unit if node is not None),
+        key=lambda node: transit[data["depot"], node],
+    )
+    nodes = np.array(
+        [node for v in vehicles for node in [data["vehicle_starts"][v]] + routes[v]]
+    )
+    owner = np.repeat(np.arange(len(vehicles)), [len(routes[v]) + 1 for v in vehicles])
+    closest = np.full(len(vehicles), np.iinfo(np.int64).max)
+    np.minimum.at(closest, owner, transit[nodes, customer])
+    best = None
+    for v in np.array(vehicles)[np.argsort(closest, kind="stable")[:FAST_INSERTION_ROUTES]]:
+        v, route = int(v), routes[v]
+        capacity = data["vehicle_capacities"][v]
+        if (v, loaded) not in profiles:
+            profiles[v, loaded] = route_profile(data, v, route, loaded_start=loaded)
+        profile = profiles[v, loaded]
+        if profile is None:
+            continue
+        if pickup is None:
+            found = single_insertions(data, profile, delivery, capacity, carried)
+        else:
+            found = pair_insertions(data, profile, pickup, delivery, capacity)
+        for cost, i, j, _, _ in found:
+            if best is None or cost < best[0]:
+                best = (cost, v, i, j)
+    if best is None:
+        return False
+    _, v, i, j = best
+    route = routes[v]
+    profiles.pop((v, False), None)
+    profiles.pop((v, True), None)
+    if pickup is None:
+        routes[v] = route[:i] + [delivery] + route[i:]
+    elif i == j:
+        routes[v] = route[:i] + [pickup, delivery] + route[i:]
+    else:
+        routes[v] = route[:i] + [pickup] + route[i:j] + [delivery] + route[j:]
+    return True
+
+
+def improving_moves(transit, path, pairs):
+    """
+        cost delta of every 2-opt and or-opt move of path (vehicle start, route nodes,
+        warehouse), evaluated over integer arrays at once. Only improving moves are
+        returned as (delta, move) sorted by delta, move is
+            ("2opt", p, q)      : reverse path[p..q]
+            ("oropt", p, l, k)  : move path[p..p+l-1] between path[k] and path[k+1]
+    """
+    n = len(path) - 2
+    arcs = transit[path[:-1], path[1:]]
+    forward = np.concatenate([[0], np.cumsum(arcs)])
+    backward = np.concatenate([[0], np.cumsum(transit[path[1:], path[:-1]])])
+    moves = []
+
+    # 2-opt, reversed segment must not hold both nodes of an order
+    p = np.arange(1, n + 1)[:, None]
+    q = np.arange(1, n + 1)[None, :]
+    delta = (
+        transit[path[p - 1], path[q]] + transit[path[p], path[q + 1]]
+        - arcs[p - 1] - arcs[q]
+        + (backward[q] - backward[p]) - (forward[q] - forward[p])
+    )
+    valid = q > p
+    position = {node: i for i, node in enumerate(path)}
+    for pickup, delivery in pairs.items():
+        if pickup in position and delivery in position:
+            valid[: position[pickup], position[delivery] - 1 :] = False
+    for i, j in zip(*np.nonzero(valid & (delta < 0))):
+        moves.append((int(delta[i, j]), ("2opt", int(i + 1), int(j + 1))))
+
+    # or-opt
+    k = np.arange(0, n + 1)[None, :]
+    for length in range(1, min(FAST_OR_OPT_LENGTH, n - 1) + 1):
+        p = np.arange(1, n - length + 2)[:, None]
+        last = p + length - 1
+        removal = transit[path[p - 1], path[last + 1]] - arcs[p - 1] - arcs[last]
+        insertion = transit[path[k], path[p]] + transit[path[last], path[k + 1]] - arcs[k]
+        delta = removal + insertion
+        valid = (k < p - 1) | (k > last)
+        for i, j in zip(*np.nonzero(valid & (delta < 0))):
+            moves.append((int(delta[i, j]), ("oropt", int(i + 1), length, int(j))))
+    moves.sort(key=lambda move: move[0])
+    return moves
+
+
+def apply_move(path, move):
+    """
+        route nodes after applying move (see improving_moves) on path
+    """
+    path = list(path)
+    if move[0] == "2opt":
+        _, p, q = move
+        path = path[:p] + path[p : q + 1][::-1] + path[q + 1 :]
+    else:
+        _, p, length, k = move
+        segment = path[p : p + length]
+        if k < p:
+            path = path[: k + 1] + segment + path[k + 1 : p] + path[p + length :]
+        else:
+            path = path[:p] + path[p + length : k + 1] + segment + path[k + 1 :]
+    return path[1:-1]
+
+
+def improve_route(data, vehicle_id, route, pairs, deadline):
+    """
+        2-opt / or-opt descent of one route until no feasible improving move is
+        left or deadline, cheapest FAST_MOVE_TRIES moves are checked per step
+    """
+    transit = data["transit_matrix"]
+    steps = 0
+    while len(route) > 1 and time.time() < deadline:
+        path = np.array([data["vehicle_starts"][vehicle_id]] + route + [data["depot"]])
+        for _, move in improving_moves(transit, path, pairs)[:FAST_MOVE_TRIES]:
+            candidate = [int(node) for node in apply_move(path, move)]
+            if route_ok(data, vehicle_id, candidate, pairs):
+                route = candidate
+                steps += 1
+                break
+        else:
+            break
+    return route, steps
+
+
+def fast_routes(data):
+    """
+        Fast construction of routes of preprocessed VRPSPD / VRPSPDTW data (see
+        fast_data of solvers), without ortools search:
+            1. savings routes (see savings_routes)
+            2. routes are assigned to vehicles (see assign_vehicles)
+            3. orders of unassigned routes are inserted at cheapest feasible position
+            4. every route is improved by 2-opt / or-opt within FAST_IMPROVE_TIME
+
+        return (route of every vehicle, summary), orders which could not be inserted
+        are left out of routes
+    """
+    t1 = time.time()
+    groups = [
+        g for g in range(len(data["order_nodes"])) if g not in data.get("infeasible_groups", {})
+    ]
+    units = [data["order_nodes"][g] for g in groups]
+    all_vehicles = (1 << data["num_vehicles"]) - 1
+    masks = []
+    for g in groups:
+        vehicles = data["group_vehicles"][g]
+        masks.append(all_vehicles if vehicles is None else sum(1 << v for v in vehicles))
+    depot_location = data["locations"][data["depot"]]
+    data = dict(
+        data,
+        loaded_set=set(data["loaded_nodes"]),
+        warehouse_set={
+            node
+            for unit in units
+            for node in unit
+            if node is not None and data["locations"][node] == depot_location
+        },
+    )
+    pairs = {pickup: delivery for pickup, delivery in units if pickup is not None}
+
+    classes = vehicle_classes(data)
+    routes, leftover = savings_routes(data, units, masks, classes)
+    n_savings_routes = len(routes)
+    routes, unassigned = assign_vehicles(data, routes, classes)
+    unit_of = {unit[1]: u for u, unit in enumerate(units)}
+    leftover += [
+        unit_of[node] for route in unassigned for node in route["nodes"] if node in unit_of
+    ]
+
+    dropped = []
+    profiles = dict()
+    # heaviest orders first
+    for u in sorted(leftover, key=lambda u: data["demands"][units[u][1]]):
+        if not cheapest_insertion(data, routes, units[u], masks[u], profiles):
+            dropped.append(units[u])
+    construct_time = time.time() - t1
+
+    deadline = time.time() + FAST_IMPROVE_TIME
+    steps = 0
+    for v, route in enumerate(routes):
+        routes[v], n = improve_route(data, v, route, pairs, deadline)
+        steps += n
+
+    summary = {
+        "savings_routes": n_savings_routes,
+        "inserted_orders": len(leftover) - len(dropped),
+        "unrouted_orders": len(dropped),
+        "improvement_moves": steps,
+        "construction_time": round(construct_time, 3),
+        "improvement_time": round(time.time() - t1 - construct_time, 3),
+    }
+    logger.info(f"fast engine: {summary}")
+    return routes, summary
+
+
+def solve_fast(solver):
+    """
+        solve VRPSPD_ortools / VRPSPDTW_ortools with fast engine (see fast_routes)
+
+        Routes are read into solver's routing model (see build_model), so every
+        constraint of the full model is checked again and response is generated
+        by same output_response as ortools search. If the model rejects the plan
+        (eg. some order of VRPSPD, which can not drop orders, could not be routed),
+        optimized_status is False and orders left out of routes are reported in
+        dropped_orders_by_solver (ortools search is not run).
+    """
+    t1 = time.time()
+    routes, summary = fast_routes(solver.fast_data())
+    manager, routing = solver.build_model()
+    assignment = routing.ReadAssignmentFromRoutes(
+        [[manager.NodeToIndex(node) for node in route] for route in routes],
+        True,  # orders not on routes are unperformed
+    )
+    solution = routing.RestoreAssignment(assignment) if assignment is not None else None
+    if solution is None:
+        routed = {node for route in routes for node in route}
+        node_orders = solver.data.get("node_orders") or [
+            [order_id] for order_id, _ in solver.data["do_info"]
+        ]
+        unrouted = [
+            order_id
+            for _, delivery in solver.data["order_nodes"]
+            if delivery not in routed
+            for order_id in node_orders[delivery]
+        ]
+        logger.warning(f"fast plan rejected by routing model, unrouted orders {unrouted}")
+        return {
+            "optimized_status": False,
+            "engine": "fast",
+            "stop_reason": "fast_engine",
+            "search_time": round(time.time() - t1, 3),
+            "fast_engine": summary,
+            "dropped_orders_by_solver": unrouted,
+        }
+
+    data = solver.output_response(manager, routing, solution)
+    data["optimized_status"] = True
+    data["engine"] = "fast"
+    data["stop_reason"] = "fast_engine"
+    data["search_time"] = round(time.time() - t1, 3)
+    data["fast_engine"] = summary
+    data["objective"] = solution.ObjectiveValue()
+    bound = solver.lower_bound()
+    if bound is not None:
+        data.update(gap_summary(bound, data["objective"]))
+    return data
@@ -0,0 +1,246 @@
+from concurrent.futures import ProcessPoolExecutor
+import copy
+import logging
+import os
+
+import numpy as np
+
+from route_polish import serial_polish
+from search_monitor import FeasibilityStop
+
+logger = logging.getLogger(__name__)
+
+# fleet sweep configration
+# search time limit of every candidate fleet size (in seconds)
+FLEET_SWEEP_TIME = float(os.environ.get("FLEET_SWEEP_TIME", 30))
+# no of candidate fleet sizes solved in parallel
+FLEET_SWEEP_WORKERS = int(os.environ.get("FLEET_SWEEP_WORKERS", os.cpu_count() or 1))
+# max no of fleet sizes on distance / driver count trade-off curve
+FLEET_SWEEP_POINTS = int(os.environ.get("FLEET_SWEEP_POINTS", 5))
+
+# candidate status
+FEASIBLE = "feasible"
+INFEASIBLE = "infeasible"
+NOT_FOUND = "not_found"
+
+
+def required_nodes(data):
+    """
+        order nodes every plan has to serve (without vehicle start nodes and
+        orders which presolve found no vehicle for)
+    """
+    skip = set(data.get("vehicle_starts", []))
+    for g in data.get("infeasible_groups", {}):
+        skip.update(node for node in data["order_nodes"][g] if node is not None)
+    return [node for node in range(1, len(data["demands"])) if node not in skip]
+
+
+def fleet_lower_bound(solver):
+    """
+        smallest fleet size (first n vehicles of fleet) which can serve all orders by
+            load    : orders loaded at warehouse have to fit into fleet at once
+            transit : every node is entered atleast by its cheapest incoming arc,
+                      which has to fit into route limits (duty time / max trip) of fleet
+        return no of vehicles + 1 if even whole fleet is not enough
+    """
+    data = solver.data
+    nodes = required_nodes(data)
+    if not nodes:
+        return 0
+    transit = data["transit_matrix"].astype(float)
+    np.fill_diagonal(transit, np.inf)
+    needed_transit = transit[:, nodes].min(axis=0).sum()
+    required = set(nodes)
+    needed_load = -sum(data["demands"][node] for node in data["loaded_nodes"] if node in required)
+
+    enough = (np.cumsum(data["vehicle_capacities"]) >= needed_load) & (
+        np.cumsum(solver.route_limits()) >= needed_transit
+    )
+    if not enough.any():
+        return data["num_vehicles"] + 1
+    return max(1, int(np.argmax(enough)) + 1)
+
+
+def clearly_infeasible(data, n_vehicles):
+    """
+        True if some order can only be served by vehicles outside first n_vehicles
+        (presolve vehicle restrictions of storage type, capacity, duty time)
+    """
+    for g, vehicles in enumerate(data.get("group_vehicles", [])):
+        if g in data["infeasible_groups"] or vehicles is None:
+            continue
+        if min(vehicles) >= n_vehicles:
+            return True
+    return False
+
+
+def restrict_fleet(manager, routing, n_vehicles, stop_when_feasible, nodes):
+    """
+        restrict routing model to first n_vehicles of fleet, optionally stopping
+        search at first solution serving all required nodes
+    """
+    n_total = routing.vehicles()
+    if n_vehicles < n_total:
+        for node in nodes:
+            routing.VehicleVar(manager.NodeToIndex(node)).RemoveInterval(
+                n_vehicles, n_total - 1
+            )
+    if stop_when_feasible:
+        FeasibilityStop(routing, [manager.NodeToIndex(node) for node in nodes])
+
+
+def candidate_solver(solver, n_vehicles, time_limit, stop_when_feasible):
+    """
+        copy of solver sharing preprocessed data, restricted to first n_vehicles
+    """
+    candidate = copy.copy(solver)
+    candidate.fleet_limit = n_vehicles
+    candidate.stop_when_feasible = stop_when_feasible
+    candidate.search_configs = solver.search_configs[:1]
+    candidate.progress = None
+    candidate.warm_routes = None
+    # candidates are solved in parallel
+    candidate.polish = False if stop_when_feasible else serial_polish(solver.polish)
+    # time limit attribute of VRPSPD_ortools / VRPSPDTW_ortools
+    for attribute in ("V1_MAX_SOLVE_TIME", "MAX_SOLVE_TIME"):
+        if hasattr(candidate, attribute):
+            setattr(candidate, attribute, time_limit)
+    return candidate
+
+
+def _solve_candidate(candidate):
+    """
+        solve one candidate fleet size (runs in worker process)
+    """
+    try:
+        out_data = candidate.solve_with_config(candidate.search_configs[0])
+    except Exception as e:
+        logger.exception(e)
+        return {"optimized_status": False}, INFEASIBLE
+
+    if out_data.get("optimized_status"):
+        infeasible = {order["order_id"] for order in out_data.get("infeasible_orders", [])}
+        if set(out_data.get("dropped_orders_by_solver", [])) <= infeasible:
+            return out_data, FEASIBLE
+        return out_data, NOT_FOUND
+    if out_data.get("stop_reason") == "search_completed":
+        return out_data, INFEASIBLE
+    return out_data, NOT_FOUND
+
+
+def _solve_candidates(solver, sizes, time_limit, stop_when_feasible, workers):
+    """
+        {fleet size: (output, status)} of candidate fleet sizes solved in parallel
+    """
+    results = dict()
+    sizes = list(sizes)
+    for n_vehicles in list(sizes):
+        if clearly_infeasible(solver.data, n_vehicles):
+            results[n_vehicles] = ({"optimized_status": False}, INFEASIBLE)
+            sizes.remove(n_vehicles)
+    candidates = [
+        candidate_solver(solver, n_vehicles, time_limit, stop_when_feasible)
+        for n_vehicles in sizes
+    ]
+    workers = max(1, min(workers, len(candidates)))
+    if workers == 1:
+        solved = [_solve_candidate(candidate) for candidate in candidates]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            solved = list(executor.map(_solve_candidate, candidates))
+    results.update(zip(sizes, solved))
+    return results
+
+
+def curve_point(n_vehicles, out_data, status, search):
+    """
+        one point of distance / driver count trade-off curve
+    """
+    return {
+        "no_vehicles": n_vehicles,
+        "status": status,
+        "search": search,
+        "optimized_distance": out_data.get("optimized_distance"),
+        "no_driver_utilized": out_data.get("no_driver_utilized"),
+        "dropped_orders": len(out_data.get("dropped_orders_by_solver", [])),
+    }
+
+
+def sweep_fleet(solver, options=None):
+    """
+        Fleet size sweep: fewest vehicles (first n vehicles of fleet) serving every order
+
+        1. lower bound (see fleet_lower_bound) starts the search range
+        2. k-section: "workers" candidate fleet sizes of range are solved in parallel,
+           each candidate is stopped at first solution serving all orders (or when
+           restrictions already show it is infeasible), range shrinks to
+           (largest infeasible size, smallest feasible size]
+        3. trade-off curve: upto "points" fleet sizes from min fleet to whole fleet
+           are solved with full search in parallel
+
+        All candidates share solver's preprocessed data (matrix included).
+
+        options (request's "fleet_sweep" dict, env defaults if not given):
+            time    : search time limit of every candidate in seconds
+            workers : no of candidates solved in parallel
+            points  : max no of fleet sizes on trade-off curve
+
+        return output of min fleet plan (whole fleet if no size is feasible) with
+        "fleet_sweep" summary: min_vehicles, lower_bound, rounds and curve
+    """
+    options = options if isinstance(options, dict) else {}
+    time_limit = options.get("time", FLEET_SWEEP_TIME)
+    workers = options.get("workers", FLEET_SWEEP_WORKERS)
+    points = options.get("points", FLEET_SWEEP_POINTS)
+    n_total = solver.data["num_vehicles"]
+    # objective bound of whole fleet is valid for every candidate, computed once
+    solver.lower_bound()
+
+    lower_bound = fleet_lower_bound(solver)
+    # min feasible fleet size is in [low, high], high is known feasible once found
+    low, high, high_known = max(lower_bound, 1), n_total, False
+    sweep = dict()
+    rounds = 0
+    while low <= n_total and (low < high or not high_known):
+        top = high - 1 if high_known else high
+        sizes = sorted(set(np.linspace(low, top, min(workers, top - low + 1)).round().astype(int)))
+        sweep.update(_solve_candidates(solver, map(int, sizes), time_limit, True, workers))
+        rounds += 1
+
+        feasible = [n for n, (_, status) in sweep.items() if status == FEASIBLE]
+        if feasible:
+            high, high_known = min(feasible), True
+        low = max(
+            [low] + [n + 1 for n, (_, status) in sweep.items() if status != FEASIBLE and n < high]
+        )
+        if not high_known and low > top:
+            # whole fleet tested without feasible plan
+            break
+    min_vehicles = high if high_known else None
+    logger.info(
+        f"fleet sweep: lower bound {lower_bound}, min fleet {min_vehicles}, {rounds} rounds"
+    )
+
+    start = min_vehicles or n_total
+    sizes = sorted(set(np.linspace(start, n_total, min(points, n_total - start + 1)).round().astype(int)))
+    curve = _solve_candidates(solver, map(int, sizes), time_limit, False, workers)
+
+    points = [
+        curve_point(n, out_data, status, "full")
+        for n, (out_data, status) in curve.items()
+    ] + [
+        curve_point(n, out_data, status, "first_feasible")
+        for n, (out_data, status) in sweep.items()
+        if n not in curve
+    ]
+    out_data, status = curve[start]
+    if status != FEASIBLE and start in sweep and sweep[start][1] == FEASIBLE:
+        # full search did not serve all orders within time limit
+        out_data, _ = sweep[start]
+    out_data["fleet_sweep"] = {
+        "min_vehicles": min_vehicles,
+        "lower_bound": lower_bound,
+        "rounds": rounds,
+        "curve": sorted(points, key=lambda point: point["no_vehicles"]),
+    }
+    return out_data
@@ -2,15 +2,27 @@ from geopy.geocoders import Nominatim
 from collections import defaultdict
 from geopy.distance import geodesic
 from math import radians, cos, sin, asin, sqrt
-import osrm
+import numpy as np
 import os
-# import urllib
-
-osrm.RequestConfig.host=f"https://uat.chefme.fero.ai/routing/route/v1/driving/:{os.environ.get('OSRM_PORT', 5000)}"
 import logging
+from routing_client import get_client
+from route_cache import get_cache
+
+# must not exceed osrm-routed --max-table-size (default 100)
+OSRM_MAX_TABLE_SIZE = int(os.environ.get("OSRM_MAX_TABLE_SIZE", 100))
+
+# what to do when osrm fails or times out:
+#   pair   : only failed blocks/pairs are estimated with great circle distance
+#   matrix : whole matrix is estimated with great circle distance
+#   none   : raise error
+MATRIX_FALLBACK = os.environ.get("MATRIX_FALLBACK", "pair")
+# road distance is longer than great circle distance, used to scale estimates
+DETOUR_FACTOR = float(os.environ.get("DETOUR_FACTOR", 1.3))
+EARTH_RADIUS = 6371  # in km
+# heuristic factor applied on all distances (see distance_matrix)
+ROAD_FACTOR = 1.1
 
 logger = logging.getLogger(__name__)
-logger.info(os.environ.get('OSRM_PORT'))
 geolocator = Nominatim(user_agent="VRP Opt 1")
 
 
@@ -37,74 +49,331 @@ def location_to_latlong_dict(locations):
     return unique_nodes
 
 
+def great_circle_matrix(sources, destinations=None):
+    """
+        Vectorized haversine distance (in km) between all sources and destinations.
+        sources and destinations are list (or array) of (lat, long),
+        if destinations are not given, matrix is between sources itself.
+    """
+    sources = np.radians(np.asarray(sources, dtype=float).reshape(-1, 2))
+    destinations = (
+        sources
+        if destinations is None
+        else np.radians(np.asarray(destinations, dtype=float).reshape(-1, 2))
+    )
+    lat1, lon1 = sources[:, 0:1], sources[:, 1:2]
+    lat2, lon2 = destinations[:, 0], destinations[:, 1]
+
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def estimated_distance_matrix(sources, destinations=None):
+    """
+        estimated road distance (in km) from great circle distance
+    """
+    return DETOUR_FACTOR * great_circle_matrix(sources, destinations)
+
+
 def haversine(latlon1, latlon2):
     """
-    Calculate the great circle distance between two points 
-    on the earth (specified in decimal degrees)
-    """
-    # convert decimal degrees to radians
-    
-    latlon1 = latlon1[1], latlon1[0]
-    latlon2 = latlon2[1], latlon2[0]
-    # lon1, lat1 = lonlat1
-    # lon2, lat2 = lonlat2
-    # lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
-    # haversine formula
-    # dlon = lon2 - lon1
-    # dlat = lat2 - lat1
-    # a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
-    # c = 2 * asin(sqrt(a))
-    # Radius of earth in kilometers is 6371
-    # km = 6371 * c
+    Road distance (in km) between two (lat, long) points using osrm.
+    If osrm is not reachable, estimated distance from great circle distance is returned.
+    """
     try:
-        dist = osrm.simple_route(latlon1,latlon2,output='route',overview='full',geometry='wkt')
+        dist = get_client().route(
+            [(latlon1[1], latlon1[0]), (latlon2[1], latlon2[0])], overview="false"
+        )
     except Exception as e :
         logger.exception(e)
-        logger.debug("exception while connecting to OSRM.")
+        logger.debug("exception while connecting to OSRM, using estimated distance.")
+        return float(estimated_distance_matrix([latlon1], [latlon2])[0, 0])
     else:
-        km = dist[0]['distance']/1000
-        # print(km)
-        # km = 6371 * c
+        km = dist["routes"][0]['distance']/1000
         return km
 
 
-def distance_matrix(locations):
+def table_block(sources, destinations=None):
+    """
+        Query osrm table service for one block of sources x destinations
+        return distance (in km) and duration (in seconds) arrays of shape (len(sources), len(destinations))
+
+        sources and destinations are list of (lat, long),
+        if destinations are not given, block is between sources itself
+    """
+    result = get_client().table(
+        [(long, lat) for lat, long in sources],
+        None if destinations is None else [(long, lat) for lat, long in destinations],
+        annotations="distance,duration",
+    )
+
+    # osrm returns null for pairs which can not be routed
+    # (those are left as nan and handled by fallback policy)
+    distances = np.array(result["distances"], dtype=float)
+    durations = np.array(result["durations"], dtype=float)
+
+    return distances / 1000, durations
+
+
+def _fetch_pairs(latlongs, missing, fallback):
+    """
+        fetch distance, duration of missing pairs (boolean matrix) from osrm.
+        Only rows and columns with any missing pair are queried, tiled into blocks
+        so that each request stays under OSRM_MAX_TABLE_SIZE coordinates.
+        Failed blocks are returned as None with "pair" fallback, otherwise error is raised.
+    """
+    block_size = max(1, OSRM_MAX_TABLE_SIZE // 2)
+    rows = np.flatnonzero(missing.any(axis=1))
+    cols = np.flatnonzero(missing.any(axis=0))
+    row_blocks = [rows[i : i + block_size] for i in range(0, len(rows), block_size)]
+    col_blocks = [cols[i : i + block_size] for i in range(0, len(cols), block_size)]
+
+    # skipping blocks which are already available
+    tiles = [
+        (r, c)
+        for r in row_blocks
+        for c in col_blocks
+        if missing[np.ix_(r, c)].any()
+    ]
+
+    def fetch(tile):
+        r, c = tile
+        sources = [latlongs[i] for i in r]
+        try:
+            if np.array_equal(r, c):
+                return table_block(sources)
+            return table_block(sources, [latlongs[j] for j in c])
+        except Exception as e:
+            if fallback != "pair":
+                raise
+            logger.exception(e)
+            logger.debug("exception while connecting to OSRM, estimating block distances.")
+            return None
+
+    # sending all blocks concurrently on shared osrm connections
+    return tiles, get_client().map(fetch, tiles)
+
+
+def table_distance_matrix(latlongs, fallback=MATRIX_FALLBACK, known=None, stats=None):
+    """
+        Given list of (lat, long), return distance matrix (in km) using osrm table service
+        and boolean matrix of pairs which are estimated instead of road distance.
+
+        known is optional matrix of already known road distances (in km, nan if unknown),
+        eg. of previous plan. Remaining pairs are first looked up in persistent route cache,
+        only missing pairs are requested from osrm and stored back in cache.
+        Failed or unroutable pairs are handled by fallback policy (see MATRIX_FALLBACK).
+
+        stats is optional dict which is filled with pair counts of this matrix:
+        "known", "cache_hits", "cache_misses" and "fetched" (pairs requested from osrm).
     """
-        Given list of locations, return distance matrix between them.
+    N = len(latlongs)
+    distances = np.full((N, N), np.nan) if known is None else np.array(known, dtype=float)
+    durations = np.full((N, N), np.nan)
+    np.fill_diagonal(distances, 0)
+    np.fill_diagonal(durations, 0)
+
+    stats = {} if stats is None else stats
+    unknown = np.isnan(distances)
+    stats["known"] = int(N * N - N - unknown.sum()) if known is not None else 0
+
+    cache = get_cache()
+    keys = dict()
+    if cache is not None:
+        profile = get_client().profile
+        # keys are only built for unknown pairs (few when most of matrix is known)
+        keys = {
+            (i, j): cache.key(profile, latlongs[i], latlongs[j])
+            for i, j in zip(*np.nonzero(unknown))
+        }
+        cached = cache.get_many(keys.values())
+        for (i, j), key in keys.items():
+            if key in cached:
+                distances[i, j], durations[i, j] = cached[key]
+        stats["cache_hits"] = len(cached)
+        stats["cache_misses"] = len(keys) - len(cached)
+
+    missing = np.isnan(distances)
+    stats["fetched"] = int(missing.sum())
+    if missing.any():
+        try:
+            tiles, results = _fetch_pairs(latlongs, missing, fallback)
+        except Exception as e:
+            if fallback != "matrix":
+                raise
+            logger.exception(e)
+            logger.debug("exception while connecting to OSRM, estimating full matrix.")
+            return estimated_distance_matrix(latlongs), np.ones((N, N), dtype=bool)
+
+        fetched = dict()
+        for (r, c), result in zip(tiles, results):
+            if result is None:
+                continue
+            block_distances, block_durations = result
+            block_missing = missing[np.ix_(r, c)]
+            distances[np.ix_(r, c)] = np.where(
+                block_missing, block_distances, distances[np.ix_(r, c)]
+            )
+            durations[np.ix_(r, c)] = np.where(
+                block_missing, block_durations, durations[np.ix_(r, c)]
+            )
+            if cache is not None:
+                for bi, bj in zip(*np.nonzero(block_missing & ~np.isnan(block_distances))):
+                    i, j = r[bi], c[bj]
+                    fetched[keys[i, j]] = (distances[i, j], durations[i, j])
+
+        if cache is not None:
+            cache.set_many(fetched)
+
+    if cache is not None:
+        logger.info(f"route cache: {stats}, process stats {cache.stats()}")
+
+    # failed blocks and unroutable pairs
+    estimated = np.isnan(distances)
+    if estimated.any():
+        if fallback == "none":
+            raise ValueError("osrm could not route all location pairs")
+        if fallback == "matrix":
+            return estimated_distance_matrix(latlongs), np.ones((N, N), dtype=bool)
+        logger.info(f"{int(estimated.sum())} location pairs estimated with great circle distance")
+        distances[estimated] = estimated_distance_matrix(latlongs)[estimated]
+
+    return distances, estimated
+
+
+class LocationMatrix:
+    """
+        Compact distance matrix of routing nodes.
+
+        Distances are only stored between unique locations (many nodes share same location,
+        eg. warehouse), nodes are mapped to unique locations by index array.
+
+            locations   : unique location strings
+            matrix      : int32 distance (in meters) between unique locations
+            node_index  : int32 array, node -> unique location index
+            source      : "road", "estimated" or "mixed"
+            route_stats : pair counts of road distance lookup (see table_distance_matrix),
+                          None if matrix was not built from road distances
+    """
+
+    def __init__(self, locations, matrix, node_index, source, route_stats=None):
+        self.locations = locations
+        self.matrix = matrix
+        self.node_index = node_index
+        self.source = source
+        self.route_stats = route_stats
+
+    def __len__(self):
+        """
+            number of nodes
+        """
+        return len(self.node_index)
+
+    def distance(self, from_node, to_node):
+        """
+            distance (in km) between two nodes
+        """
+        return int(self.matrix[self.node_index[from_node], self.node_index[to_node]]) / 1000
+
+    def node_matrix(self):
+        """
+            full int32 distance (in meters) matrix between all nodes
+        """
+        return self.matrix[np.ix_(self.node_index, self.node_index)]
+
+    def max(self):
+        """
+            maximum distance (in km) between any two nodes
+        """
+        return int(self.matrix.max()) / 1000
+
+    def known_distances(self, locations):
+        """
+            distance (in km, before ROAD_FACTOR) between given unique locations,
+            nan for pairs with any location which is not in this matrix
+        """
+        location_index = {location: i for i, location in enumerate(self.locations)}
+        index = np.array([location_index.get(location, -1) for location in locations])
+        found = index >= 0
+        known = np.full((len(locations), len(locations)), np.nan)
+        known[np.ix_(found, found)] = (
+            self.matrix[np.ix_(index[found], index[found])] / 1000 / ROAD_FACTOR
+        )
+        return known
+
+    def for_nodes(self, node_locations):
+        """
+            return matrix for another list of node locations sharing same unique locations
+            raise KeyError if any location is not in this matrix
+        """
+        location_index = {location: i for i, location in enumerate(self.locations)}
+        node_index = np.array(
+            [location_index[location] for location in node_locations], dtype=np.int32
+        )
+        return LocationMatrix(self.locations, self.matrix, node_index, self.source)
+
+
+def distance_matrix(locations, mode="road", fallback=MATRIX_FALLBACK, base=None):
+    """
+        Given list of node locations, return LocationMatrix between them.
         Below code is optimized to only calculated distance between unique location, 
-        and return full matrix from that.
+        and nodes are mapped to unique locations.
+
+        mode "estimate" skip osrm and use great circle estimates (fast preview).
+        base is optional LocationMatrix of previous plan (eg. re-optimization), its road
+        distances are reused and only rows and columns of new locations are computed.
+        If base has all locations (eg. scenarios of same request), it is shared as it is.
     """
+    if (
+        base is not None
+        and (mode == "estimate") == (base.source == "estimated")
+        and set(locations) <= set(base.locations)
+    ):
+        return base.for_nodes(locations)
+
     unique_nodes = dict()
     for i in locations:
         if not i in unique_nodes:
-            unique_nodes[i] = location_to_latlong(i)
+            unique_nodes[i] = len(unique_nodes)
 
-    unique_nodes_graph = dict()
-    for i in unique_nodes.keys():
-        for j in unique_nodes.keys():
+    latlongs = [location_to_latlong(i) for i in unique_nodes]
 
-            # following is heurisitc is applied to increase haversine distance
-            # general idea is that distance between place is city is much higher than haversine
-            # but distance between city is not that high compared to haversine distance.
-            temp_dist = 1.1*haversine(unique_nodes[i], unique_nodes[j]) #initially multiplied by 1.5
-#             if temp_dist < 10:
-#                 temp_dist *= 1.6
-#             elif temp_dist < 20:
-#                 temp_dist *= 1.5
-#             elif temp_dist < 40:
-#                 temp_dist *= 1.25
-#             else:
-#                 temp_dist *= 1.1
-
-            unique_nodes_graph[i + j] = temp_dist
-
-    full_graph = [[0 for _ in locations] for _ in locations]
+    route_stats = None
+    if mode == "estimate":
+        unique_nodes_graph = estimated_distance_matrix(latlongs)
+        distance_source = "estimated"
+    else:
+        known = None
+        if base is not None and base.source == "road":
+            known = base.known_distances(list(unique_nodes))
+        route_stats = dict()
+        unique_nodes_graph, estimated = table_distance_matrix(
+            latlongs, fallback, known, route_stats
+        )
+        estimated = estimated[~np.eye(len(latlongs), dtype=bool)]
+        distance_source = (
+            "estimated"
+            if estimated.size and estimated.all()
+            else "mixed"
+            if estimated.any()
+            else "road"
+        )
 
-    for i, il in enumerate(locations):
-        for j, jl in enumerate(locations):
-            full_graph[i][j] = unique_nodes_graph[il + jl]
+    # following is heurisitc is applied to increase road distance
+    # general idea is that distance between place is city is much higher than haversine
+    # but distance between city is not that high compared to haversine distance.
+    unique_nodes_graph = ROAD_FACTOR * unique_nodes_graph  # initially multiplied by 1.5
 
-    return full_graph
+    return LocationMatrix(
+        list(unique_nodes),
+        np.rint(unique_nodes_graph * 1000).astype(np.int32),  # in meters
+        np.array([unique_nodes[i] for i in locations], dtype=np.int32),
+        distance_source,
+        route_stats,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,117 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+import logging
+import os
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+logger = logging.getLogger(__name__)
+
+# seconds waited after search for lower bound which is still being computed
+LOWER_BOUND_WAIT = float(os.environ.get("LOWER_BOUND_WAIT", 5))
+
+
+def assignment_bound(transit, nodes, starts, depot, penalties=None, fixed=0):
+    """
+        Assignment relaxation of routing objective (arc costs + drop penalties)
+
+        Every order node, vehicle start and vehicle end picks one successor, each
+        one is successor of exactly one other:
+            order node    -> other order node, warehouse (end of any vehicle) or
+                             itself (dropped, at its penalty)
+            vehicle start -> order node (from vehicle's start node) or own end
+                             (unused vehicle, no cost)
+            vehicle end   -> any vehicle start (no cost)
+        Every plan is such an assignment with same cost (subtours, capacity, time
+        windows and vehicle restrictions are relaxed), so min cost assignment is a
+        lower bound of best objective.
+
+        nodes     : order nodes which can be visited
+        starts    : start node of every vehicle
+        penalties : drop penalty of every node of nodes (None if nodes can not be dropped)
+        fixed     : objective of nodes which are never visited (their penalties)
+        return lower bound in objective units
+    """
+    nodes = np.asarray(nodes, dtype=np.int64)
+    starts = np.asarray(starts, dtype=np.int64)
+    n, m = len(nodes), len(starts)
+    if n == 0:
+        return int(fixed)
+    transit = np.asarray(transit, dtype=np.int64)
+    big = int(transit.max()) * (n + m + 1) + int(sum(penalties or [])) + 1
+
+    cost = np.full((n + 2 * m, n + 2 * m), big, dtype=np.int64)
+    # order node -> order node / itself / vehicle end
+    cost[:n, :n] = transit[np.ix_(nodes, nodes)]
+    cost[np.arange(n), np.arange(n)] = big if penalties is None else penalties
+    cost[:n, n + m :] = transit[nodes, depot][:, None]
+    # vehicle start -> order node / own end
+    cost[n : n + m, :n] = transit[np.ix_(starts, nodes)]
+    cost[np.arange(n, n + m), np.arange(n + m, n + 2 * m)] = 0
+    # vehicle end -> vehicle start
+    cost[n + m :, n : n + m] = 0
+
+    rows, cols = linear_sum_assignment(cost)
+    return int(cost[rows, cols].sum()) + int(fixed)
+
+
+class LowerBound:
+    """
+        lower bound (see assignment_bound) computed in another process while
+        ortools search is running, started once per solver and shared by its
+        portfolio members and fleet sweep candidates
+    """
+
+    def __init__(self, problem):
+        """
+            problem : keyword arguments of assignment_bound
+        """
+        executor = ProcessPoolExecutor(max_workers=1)
+        self.future = executor.submit(assignment_bound, **problem)
+        executor.shutdown(wait=False)
+        self._value = None
+
+    def __getstate__(self):
+        """
+            members solved in worker processes get the computed value
+            (waiting atmost LOWER_BOUND_WAIT seconds), future stays in this process
+        """
+        return {"future": None, "_value": self.value(wait=LOWER_BOUND_WAIT)}
+
+    def value(self, wait=0):
+        """
+            lower bound, None if it is not computed within wait seconds
+        """
+        if self.future is None:
+            return self._value
+        if not wait and not self.future.done():
+            return None
+        try:
+            return self.future.result(timeout=wait)
+        except TimeoutError:
+            return None
+        except Exception as e:
+            logger.exception(e)
+            return None
+
+
+def gap(objective, bound):
+    """
+        relative distance of objective from lower bound in percent
+    """
+    if bound is None or not objective:
+        return None
+    return max(objective - bound, 0) / objective * 100
+
+
+def gap_summary(bound, objective):
+    """
+        lower bound and gap (in percent) of final objective for output response,
+        waiting atmost LOWER_BOUND_WAIT seconds for bound still being computed
+    """
+    value = bound.value(wait=LOWER_BOUND_WAIT)
+    objective_gap = gap(objective, value)
+    return {
+        "lower_bound": value,
+        "gap": None if objective_gap is None else round(objective_gap, 3),
+    }
@@ -0,0 +1,231 @@
+import logging
+
+import numpy as np
+
+from utils import DISTANCE_SCALE
+
+logger = logging.getLogger(__name__)
+
+# no of insertion options returned by default
+INSERTION_OPTIONS = 3
+
+
+def route_profile(data, vehicle_id, route, loaded_start=False):
+    """
+        vectorized cumul representation of one route of preprocessed VRPSPDTW data
+
+        path goes from vehicle's start node through route back to warehouse,
+        with waiting allowed at every node (all in DISTANCE_SCALE units):
+            earliest[k] = earliest arrival at path[k]
+                        = D[k] + max over m <= k of (window start[m] - D[m])
+            latest[k]   = latest arrival at path[k] keeping rest of path feasible
+                        = D[k] + min over m >= k of (window end[m] - D[m])
+        where D is prefix sum of arc transits. load[k] is load after leaving path[k].
+
+        loaded_start : vehicle leaves warehouse within warehouse pickup window
+        return dict of numpy arrays, None if route is not feasible
+    """
+    path = np.array([data["vehicle_starts"][vehicle_id]] + list(route) + [data["depot"]])
+    transit = data["transit_matrix"]
+    windows = np.array([data["time_windows"][node] for node in path], dtype=np.int64)
+    duty = data["duty_time"][vehicle_id]
+    windows[0] = windows[-1] = duty
+    loaded = set(data["loaded_nodes"])
+    if loaded_start or loaded & set(route):
+        windows[0] = (
+            max(duty[0], data["warehouse_pickup_time"][0]),
+            min(duty[1], data["warehouse_pickup_time"][1]),
+        )
+
+    offset = np.concatenate([[0], np.cumsum(transit[path[:-1], path[1:]])])
+    earliest = offset + np.maximum.accumulate(windows[:, 0] - offset)
+    latest = offset + np.minimum.accumulate((windows[:, 1] - offset)[::-1])[::-1]
+    if (earliest > latest).any():
+        return None
+
+    demands = np.array([data["demands"][node] for node in path], dtype=np.int64)
+    demands[0] = -sum(
+        data["demands"][node]
+        for node in route
+        if node in loaded or node in data["onboard_nodes"]
+    )
+    return {
+        "path": path,
+        "offset": offset,
+        "windows": windows,
+        "earliest": earliest,
+        "latest": latest,
+        "load": np.cumsum(demands),
+    }
+
+
+def single_insertions(data, profile, node, capacity, loaded):
+    """
+        (cost, position, position, arrival, arrival) of every feasible insertion
+        of single node (order loaded at start of route) after path[position]
+    """
+    transit = data["transit_matrix"]
+    path = profile["path"]
+    prev, succ = path[:-1], path[1:]
+    window = data["time_windows"][node]
+
+    arrival = np.maximum(window[0], profile["earliest"][:-1] + transit[prev, node])
+    next_arrival = np.maximum(profile["windows"][1:, 0], arrival + transit[node, succ])
+    ok = (arrival <= window[1]) & (next_arrival <= profile["latest"][1:])
+    if loaded:
+        # load is carried from start of route until node
+        demand = -data["demands"][node]
+        ok &= np.maximum.accumulate(profile["load"][:-1]) + demand <= capacity
+    cost = transit[prev, node] + transit[node, succ] - transit[prev, succ]
+    positions = np.flatnonzero(ok)
+    return [(int(cost[i]), i, i, int(arrival[i]), int(arrival[i])) for i in positions]
+
+
+def pair_insertions(data, profile, pickup, delivery, capacity):
+    """
+        (cost, pickup position, delivery position, pickup arrival, delivery arrival)
+        of every feasible insertion of pickup after path[i] and delivery after path[j]
+        (j == i: delivery right after pickup), evaluated for all (i, j) at once
+
+        after inserting pickup, arrival at path[k] (k > i) becomes
+        max(earliest[k], new arrival at path[i + 1] + D[k] - D[i + 1])
+    """
+    transit = data["transit_matrix"]
+    path, offset = profile["path"], profile["offset"]
+    prev, succ = path[:-1], path[1:]
+    n = len(prev)
+    pickup_window = data["time_windows"][pickup]
+    delivery_window = data["time_windows"][delivery]
+    demand = data["demands"][pickup]
+
+    # pickup after path[i]
+    pickup_arrival = np.maximum(pickup_window[0], profile["earliest"][:-1] + transit[prev, pickup])
+    pickup_ok = (pickup_arrival <= pickup_window[1]) & (
+        profile["load"][:-1] + demand <= capacity
+    )
+
+    # delivery right after pickup
+    direct_arrival = np.maximum(delivery_window[0], pickup_arrival + transit[pickup, delivery])
+    direct_next = np.maximum(
+        profile["windows"][1:, 0], direct_arrival + transit[delivery, succ]
+    )
+    direct_ok = (
+        pickup_ok
+        & (direct_arrival <= delivery_window[1])
+        & (direct_next <= profile["latest"][1:])
+    )
+    direct_cost = (
+        transit[prev, pickup] + transit[pickup, delivery] + transit[delivery, succ]
+        - transit[prev, succ]
+    )
+    options = [
+        (int(direct_cost[i]), i, i, int(pickup_arrival[i]), int(direct_arrival[i]))
+        for i in np.flatnonzero(direct_ok)
+    ]
+
+    # delivery after path[j], j > i (matrices are i x j)
+    shifted = np.maximum(profile["windows"][1:, 0], pickup_arrival + transit[pickup, succ])
+    shift_ok = pickup_ok & (shifted <= profile["latest"][1:])
+    arrival_j = np.maximum(
+        profile["earliest"][None, :-1],
+        shifted[:, None] + offset[None, :-1] - offset[1:, None],
+    )
+    delivery_arrival = np.maximum(delivery_window[0], arrival_j + transit[prev, delivery][None, :])
+    delivery_next = np.maximum(
+        profile["windows"][None, 1:, 0], delivery_arrival + transit[delivery, succ][None, :]
+    )
+    # max load between pickup and delivery
+    later = np.triu(np.ones((n, n), dtype=bool), 1)
+    carried = np.where(later, profile["load"][None, :-1], np.iinfo(np.int64).min)
+    carried = np.maximum.accumulate(carried, axis=1)
+    ok = (
+        later
+        & shift_ok[:, None]
+        & (delivery_arrival <= delivery_window[1])
+        & (delivery_next <= profile["latest"][None, 1:])
+        & (carried + demand <= capacity)
+    )
+    cost = (
+        (transit[prev, pickup] + transit[pickup, succ] - transit[prev, succ])[:, None]
+        + (transit[prev, delivery] + transit[delivery, succ] - transit[prev, succ])[None, :]
+    )
+    for i, j in zip(*np.nonzero(ok)):
+        options.append(
+            (int(cost[i, j]), i, j, int(pickup_arrival[i]), int(delivery_arrival[i, j]))
+        )
+    return options
+
+
+def insertion_options(solver, limit=INSERTION_OPTIONS):
+    """
+        cheapest feasible insertions of last order of preprocessed VRPSPDTW request
+        into routes of stored plan (solver.warm_routes, see warm_start.map_routes),
+        checked against capacity, time windows, duty time and vehicle restrictions
+
+        return (options, reason), reason is presolve reason if order can not be
+        served by any driver
+    """
+    data = solver.data
+    g = len(data["order_nodes"]) - 1
+    if g in data["infeasible_groups"]:
+        return [], data["infeasible_groups"][g]
+    pickup, delivery = data["order_nodes"][g]
+    vehicles = data["group_vehicles"][g]
+    if vehicles is None:
+        vehicles = range(data["num_vehicles"])
+
+    def minutes(cumul):
+        return round(float(cumul) / DISTANCE_SCALE / solver.AVG_SPEED * 60, 2)
+
+    def stop(node):
+        order_id, operation = data["do_info"][node]
+        return {"order_id": order_id, "operation": operation}
+
+    options = []
+    for vehicle_id in vehicles:
+        route = solver.warm_routes[vehicle_id]
+        capacity = data["vehicle_capacities"][vehicle_id]
+        loaded = delivery in data["loaded_nodes"]
+        profile = route_profile(data, vehicle_id, route, loaded_start=loaded)
+        if profile is None:
+            logger.debug(f"stored route of vehicle {vehicle_id} is not feasible")
+            continue
+        if pickup is None:
+            found = single_insertions(data, profile, delivery, capacity, loaded)
+        else:
+            found = pair_insertions(data, profile, pickup, delivery, capacity)
+
+        path = profile["path"]
+        travel = data["travel_matrix"]
+        for cost, i, j, pickup_time, delivery_time in found:
+            if pickup is None:
+                # loaded order is picked up when leaving warehouse
+                new_path = list(path[: i + 1]) + [delivery] + list(path[i + 1 :])
+                pickup_after, delivery_after = stop(path[0]), stop(path[i])
+                pickup_time = profile["earliest"][0]
+            elif i == j:
+                new_path = list(path[: i + 1]) + [pickup, delivery] + list(path[i + 1 :])
+                pickup_after, delivery_after = stop(path[i]), stop(pickup)
+            else:
+                new_path = (
+                    list(path[: i + 1]) + [pickup] + list(path[i + 1 : j + 1])
+                    + [delivery] + list(path[j + 1 :])
+                )
+                pickup_after, delivery_after = stop(path[i]), stop(path[j])
+            added = travel[new_path[:-1], new_path[1:]].sum() - travel[path[:-1], path[1:]].sum()
+            options.append(
+                {
+                    "driver": int(vehicle_id),
+                    "cost": cost,
+                    "pickup_after": pickup_after,
+                    "delivery_after": delivery_after,
+                    "added_distance": int(added) / DISTANCE_SCALE,
+                    "estimated_pickup_time": minutes(pickup_time),
+                    "estimated_delivery_time": minutes(delivery_time),
+                }
+            )
+
+    options.sort(key=lambda option: option["cost"])
+    for option in options:
+        option.pop("cost")
+    return options[:limit], None
@@ -0,0 +1,140 @@
+import logging
+import os
+from copy import deepcopy
+
+from warm_start import plan_steps
+
+logger = logging.getLogger(__name__)
+
+# default time limit of re-optimization (in seconds), plan is warm started
+# from previous solution so a short search is enough
+REOPTIMIZE_SOLVER_TIME = float(os.environ.get("REOPTIMIZE_SOLVER_TIME", 60))
+# request keys added during validation / solving, never carried into new request
+INTERNAL_KEYS = (
+    "new_orders",
+    "excluded_orders",
+    "warm_start",
+    "warm_start_plan",
+    "received_at",
+)
+
+
+def updated_orders(prev_input, delta):
+    """
+        orders of previous request after removing and adding orders of delta
+    """
+    removed = set(delta.get("removed_orders", []))
+    added = {order["order_id"]: order for order in delta.get("added_orders", [])}
+    orders = [
+        order
+        for order in prev_input["orders"]
+        if order["order_id"] not in removed and order["order_id"] not in added
+    ]
+    return orders + list(added.values())
+
+
+def completed_orders(steps):
+    """
+        (finished order ids, order ids on vehicle) after completed steps of one trip
+    """
+    picked, delivered = set(), set()
+    for step in steps:
+        if step["operation"] == "pickup":
+            picked.add(step["order_id"])
+        else:
+            delivered.add(step["order_id"])
+    return delivered, picked - delivered
+
+
+def updated_request(task_id, prev_input, prev_out, delta):
+    """
+        VRPSPDTW request (before unrolling) re-planning remaining work of stored plan
+
+        delta (see reoptimize schema):
+            current_time        : minutes, no driver starts remaining work before it
+            added_orders        : new orders (same format as request orders)
+            removed_orders      : cancelled order ids
+            unavailable_drivers : indexes of drivers which can not be used anymore
+            driver_positions    : current "location" of driver and no of
+                                  "completed_stops" of its previous trip
+            max_solver_time     : search time limit (REOPTIMIZE_SOLVER_TIME by default)
+            solve_profile       : solve profile of new search (see solve_profiles)
+            respond_by          : response deadline in seconds from "received_at"
+            telemetry           : search telemetry in response (see search_monitor)
+
+        Completed stops are frozen (request["frozen_trips"]), finished orders are
+        removed and orders picked up but not delivered stay on their vehicle. Remaining
+        stops of previous plan become warm start plan of new search.
+
+        return (request, full order list of new plan)
+    """
+    orders = updated_orders(prev_input, delta)
+    order_ids = {order["order_id"] for order in orders}
+    n_drivers = len(prev_input["drivers"])
+    trips = prev_out["driver_trips"]
+    completed_stops = [0] * n_drivers
+    locations = [None] * n_drivers
+    for position in delta.get("driver_positions", []):
+        completed_stops[position["driver"]] = position.get("completed_stops", 0)
+        locations[position["driver"]] = position.get("location")
+
+    unavailable = set(delta.get("unavailable_drivers", []))
+    current_time = delta.get("current_time")
+    request = {
+        key: value for key, value in deepcopy(prev_input).items() if key not in INTERNAL_KEYS
+    }
+    finished = set()
+    frozen_trips = []
+    remaining_trips = []
+    for v, driver in enumerate(request["drivers"]):
+        steps = trips[v]["trip_detail"] if v < len(trips) else []
+        done, onboard = completed_orders(steps[: completed_stops[v]])
+        finished |= done
+        frozen_trips.append(steps[: completed_stops[v]])
+        remaining_trips.append(
+            {"trip_detail": [] if v in unavailable else steps[completed_stops[v] :]}
+        )
+
+        driver["current_location"] = locations[v]
+        driver["onboard_orders"] = sorted(onboard & order_ids)
+        driver["available"] = v not in unavailable
+        if current_time is not None:
+            driver["duty_start_time"] = max(driver["duty_start_time"], current_time)
+            if driver["duty_start_time"] > driver["duty_end_time"]:
+                # duty is over
+                driver["duty_start_time"] = driver["duty_end_time"]
+                driver["available"] = False
+
+    request["orders"] = [order for order in orders if order["order_id"] not in finished]
+    request["frozen_trips"] = frozen_trips
+    request["max_solver_time"] = delta.get("max_solver_time", REOPTIMIZE_SOLVER_TIME)
+    for key in ("solve_profile", "respond_by", "received_at", "telemetry"):
+        if key in delta:
+            request[key] = delta[key]
+
+    previous = {
+        step["order_id"] for trip in remaining_trips for step in trip["trip_detail"]
+    }
+    request["warm_start_plan"] = {
+        "task_id": task_id,
+        "overlap": round(
+            len(previous & {order["order_id"] for order in request["orders"]})
+            / max(len(request["orders"]), 1),
+            3,
+        ),
+        "steps": plan_steps(request, {"driver_trips": remaining_trips}),
+    }
+    logger.info(
+        f"re-optimizing {task_id}: {len(request['orders'])} remaining orders, "
+        f"{len(finished)} finished orders"
+    )
+    return request, orders
+
+
+def merge_frozen_trips(out_data, frozen_trips):
+    """
+        prepend completed stops to re-optimized driver trips
+    """
+    for trip, frozen in zip(out_data.get("driver_trips", []), frozen_trips):
+        trip["trip_detail"] = frozen + trip["trip_detail"]
+    return out_data
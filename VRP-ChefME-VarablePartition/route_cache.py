@@ -0,0 +1,189 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# route cache configration
+ROUTE_CACHE_ENABLED = int(os.environ.get("ROUTE_CACHE_ENABLED", 1))
+ROUTE_CACHE_PATH = os.environ.get("ROUTE_CACHE_PATH", "route_cache.db")
+# optional shared tier between all celery workers, eg. redis://localhost:6379/5
+ROUTE_CACHE_REDIS_URL = os.environ.get("ROUTE_CACHE_REDIS_URL")
+ROUTE_CACHE_TTL = int(os.environ.get("ROUTE_CACHE_TTL", 30 * 24 * 60 * 60))  # in seconds
+ROUTE_CACHE_MAX_ENTRIES = int(os.environ.get("ROUTE_CACHE_MAX_ENTRIES", 5_000_000))
+# lat/long are rounded to 5 decimals (~1 meter) before building keys
+ROUTE_CACHE_PRECISION = 5
+
+# sqlite can bind at most 999 variables per statement
+_SQLITE_CHUNK = 900
+
+
+class RouteCache:
+    """
+        Persistent cache of road distance (km) and duration (seconds) between location pairs.
+
+        Keys are normalized lat/long pair plus routing profile.
+        Local tier is sqlite db on disk, optional redis tier is shared between workers;
+        redis hits are copied to local tier.
+
+        Eviction:
+            1. entries older than ttl are ignored and deleted
+            2. when local tier grows beyond max_entries, oldest entries are deleted
+               (redis tier relies on key expiry and redis maxmemory policy)
+    """
+
+    def __init__(
+        self,
+        path=ROUTE_CACHE_PATH,
+        redis_url=ROUTE_CACHE_REDIS_URL,
+        ttl=ROUTE_CACHE_TTL,
+        max_entries=ROUTE_CACHE_MAX_ENTRIES,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS route_cache "
+            "(key TEXT PRIMARY KEY, distance REAL, duration REAL, created_at REAL)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS route_cache_created_at ON route_cache (created_at)"
+        )
+        self.db.commit()
+
+        self.redis = None
+        if redis_url:
+            try:
+                import redis
+
+                self.redis = redis.Redis.from_url(redis_url)
+                self.redis.ping()
+            except Exception as e:
+                logger.exception(e)
+                logger.debug("redis route cache tier not available, using only local tier")
+                self.redis = None
+
+    @staticmethod
+    def key(profile, latlong1, latlong2):
+        """
+            normalized cache key of (lat, long) pair for given routing profile
+        """
+        return "{}:{:.{p}f},{:.{p}f}:{:.{p}f},{:.{p}f}".format(
+            profile, *latlong1, *latlong2, p=ROUTE_CACHE_PRECISION
+        )
+
+    def get_many(self, keys):
+        """
+            return dict of key -> (distance, duration) for cached keys
+        """
+        found = dict()
+        expiry = time.time() - self.ttl
+        keys = list(keys)
+        for i in range(0, len(keys), _SQLITE_CHUNK):
+            chunk = keys[i : i + _SQLITE_CHUNK]
+            rows = self.db.execute(
+                "SELECT key, distance, duration FROM route_cache "
+                f"WHERE created_at >= ? AND key IN ({','.join('?' * len(chunk))})",
+                [expiry] + chunk,
+            )
+            for key, distance, duration in rows:
+                found[key] = (distance, duration)
+
+        missing = [key for key in keys if key not in found]
+        if self.redis is not None and missing:
+            from_redis = dict()
+            try:
+                for i in range(0, len(missing), _SQLITE_CHUNK):
+                    chunk = missing[i : i + _SQLITE_CHUNK]
+                    for key, value in zip(chunk, self.redis.mget(chunk)):
+                        if value is not None:
+                            distance, duration = map(float, value.split(b","))
+                            from_redis[key] = (distance, duration)
+            except Exception as e:
+                logger.exception(e)
+                logger.debug("exception while reading redis route cache tier")
+            # keeping local copy of shared entries
+            self._set_local(from_redis)
+            found.update(from_redis)
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, values):
+        """
+            store dict of key -> (distance, duration) in all tiers
+        """
+        if not values:
+            return
+        self._set_local(values)
+        if self.redis is not None:
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                for key, (distance, duration) in values.items():
+                    pipe.set(key, f"{distance},{duration}", ex=self.ttl)
+                pipe.execute()
+            except Exception as e:
+                logger.exception(e)
+                logger.debug("exception while writing redis route cache tier")
+        self.evict()
+
+    def _set_local(self, values):
+        now = time.time()
+        self.db.executemany(
+            "INSERT OR REPLACE INTO route_cache VALUES (?, ?, ?, ?)",
+            [(key, dist, dur, now) for key, (dist, dur) in values.items()],
+        )
+        self.db.commit()
+
+    def evict(self):
+        """
+            delete expired entries and oldest entries beyond max_entries
+        """
+        self.db.execute(
+            "DELETE FROM route_cache WHERE created_at < ?", (time.time() - self.ttl,)
+        )
+        (total,) = self.db.execute("SELECT COUNT(*) FROM route_cache").fetchone()
+        if total > self.max_entries:
+            self.db.execute(
+                "DELETE FROM route_cache WHERE key IN "
+                "(SELECT key FROM route_cache ORDER BY created_at LIMIT ?)",
+                (total - self.max_entries,),
+            )
+        self.db.commit()
+
+    def stats(self):
+        """
+            hit/miss counters of this process
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0,
+        }
+
+
+# route cache of current thread
+_local = threading.local()
+
+
+def get_cache():
+    """
+        return route cache of current process and thread, None if cache is disabled
+        (sqlite connections can not be shared between forked celery workers, nor
+        between threads, eg. flask request threads)
+    """
+    if not ROUTE_CACHE_ENABLED:
+        return None
+    pid = os.getpid()
+    if getattr(_local, "pid", None) != pid:
+        _local.pid = pid
+        _local.cache = RouteCache()
+    return _local.cache
@@ -0,0 +1,287 @@
+from ortools.constraint_solver import routing_enums_pb2
+from ortools.constraint_solver import pywrapcp
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import os
+import time
+
+import numpy as np
+
+from exact_solver import solve_exact
+from search_monitor import EarlyStopping
+from utils import DISTANCE_SCALE
+
+logger = logging.getLogger(__name__)
+
+# total time budget of route polishing after search (in seconds, 0 disables)
+POLISH_TIME = float(os.environ.get("POLISH_TIME", 5))
+# no of routes polished in parallel
+POLISH_WORKERS = int(os.environ.get("POLISH_WORKERS", os.cpu_count() or 1))
+# routes without time windows and atmost POLISH_EXACT_MAX_NODES nodes are re-sequenced
+# exactly (memory and time of exact solver grow with 2^nodes, it ignores time budget)
+POLISH_EXACT_MAX_NODES = 14
+# routes with less nodes are not polished (search already found their best order)
+POLISH_MIN_NODES = 4
+
+
+def local_problem(
+    transit,
+    route,
+    pairs,
+    demands,
+    capacity,
+    loaded_nodes=(),
+    windows=None,
+    start_window=None,
+    end_window=None,
+    max_transit=None,
+):
+    """
+        single vehicle re-sequencing problem of one route, restricted to its nodes
+        (local node 0 is warehouse, local node i is route[i - 1])
+
+        transit      : arc cost (and time) matrix of full problem
+        route        : nodes of route in current order (without warehouse)
+        pairs        : [pickup node, delivery node] pairs of full problem
+        demands      : load change of every node of full problem
+        loaded_nodes : nodes of orders loaded at start of route
+        windows      : time window of every node of full problem (None without windows)
+        start_window : vehicle start time window, end_window : vehicle end time window
+        max_transit  : max route cost (without windows)
+    """
+    nodes = [0] + list(route)
+    local = {node: i for i, node in enumerate(nodes)}
+    problem = {
+        "route": list(route),
+        "transit": np.asarray(transit)[np.ix_(nodes, nodes)].astype(np.int64),
+        "pairs": [
+            [local[pickup], local[delivery]]
+            for pickup, delivery in pairs
+            if pickup in local and delivery in local
+        ],
+        "demands": [int(demands[node]) if node else 0 for node in nodes],
+        "capacity": int(capacity),
+        "start_load": -sum(int(demands[node]) for node in route if node in set(loaded_nodes)),
+        "windows": None,
+        "max_transit": max_transit,
+    }
+    if windows is not None:
+        problem["windows"] = [tuple(map(int, windows[node])) for node in route]
+        problem["start_window"] = tuple(map(int, start_window))
+        problem["end_window"] = tuple(map(int, end_window))
+    return problem
+
+
+def route_cost(transit, route):
+    """
+        cost of closed route 0 -> route -> 0 in local nodes
+    """
+    route = [0] + list(route) + [0]
+    return int(sum(transit[a, b] for a, b in zip(route, route[1:])))
+
+
+def _ortools_resequence(problem, time_limit):
+    """
+        single vehicle ortools model of route, search starts from current sequence
+        return (cost, local route) of best sequence found, None if not solved
+    """
+    transit = problem["transit"]
+    n = len(transit)
+    manager = pywrapcp.RoutingIndexManager(n, 1, 0)
+    routing = pywrapcp.RoutingModel(manager)
+    transit_callback_index = routing.RegisterTransitMatrix(transit.tolist())
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+
+    if problem["windows"] is None:
+        routing.AddDimension(
+            transit_callback_index,
+            0,
+            int(problem["max_transit"] or transit.sum()),
+            True,
+            "Distance",
+        )
+    else:
+        horizon = int(max(problem["end_window"][1], max(w[1] for w in problem["windows"])))
+        routing.AddDimension(transit_callback_index, horizon, horizon, False, "Distance")
+    dimension = routing.GetDimensionOrDie("Distance")
+    if problem["windows"] is not None:
+        for node, window in enumerate(problem["windows"], 1):
+            dimension.CumulVar(manager.NodeToIndex(node)).SetRange(*window)
+        dimension.CumulVar(routing.Start(0)).SetRange(*problem["start_window"])
+        dimension.CumulVar(routing.End(0)).SetRange(*problem["end_window"])
+
+    for pickup, delivery in problem["pairs"]:
+        pickup_index = manager.NodeToIndex(pickup)
+        delivery_index = manager.NodeToIndex(delivery)
+        routing.AddPickupAndDelivery(pickup_index, delivery_index)
+        routing.solver().Add(
+            dimension.CumulVar(pickup_index) <= dimension.CumulVar(delivery_index)
+        )
+
+    demand_callback_index = routing.RegisterUnaryTransitVector(problem["demands"])
+    routing.AddDimensionWithVehicleCapacity(
+        demand_callback_index, 0, [problem["capacity"]], False, "Capacity"
+    )
+    routing.GetDimensionOrDie("Capacity").CumulVar(routing.Start(0)).SetValue(
+        problem["start_load"]
+    )
+
+    params = pywrapcp.DefaultRoutingSearchParameters()
+    params.local_search_metaheuristic = (
+        routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+    )
+    params.time_limit.FromMilliseconds(max(int(time_limit * 1000), 10))
+    # small routes converge quickly, not burning whole budget on them
+    EarlyStopping(routing, time_limit, {"improvement": 0, "window": time_limit / 4})
+
+    initial = routing.ReadAssignmentFromRoutes([list(range(1, n))], True)
+    if initial is not None:
+        solution = routing.SolveFromAssignmentWithParameters(initial, params)
+    else:
+        solution = routing.SolveWithParameters(params)
+    if not solution:
+        return None
+
+    index = solution.Value(routing.NextVar(routing.Start(0)))
+    route = [0]
+    while not routing.IsEnd(index):
+        route.append(manager.IndexToNode(index))
+        index = solution.Value(routing.NextVar(index))
+    return solution.ObjectiveValue(), route
+
+
+def polish_route(problem, time_limit=1):
+    """
+        re-sequence one route (runs in worker process), routes without time windows
+        and atmost POLISH_EXACT_MAX_NODES nodes are re-sequenced exactly
+
+        return new route (full problem nodes) and cost improvement,
+        current route is returned unchanged if no better sequence is found
+    """
+    try:
+        transit = problem["transit"]
+        current = route_cost(transit, range(1, len(transit)))
+        result = None
+        if problem["windows"] is None and len(transit) - 1 <= POLISH_EXACT_MAX_NODES:
+            result = solve_exact(
+                transit,
+                problem["pairs"],
+                problem["demands"],
+                problem["capacity"],
+                problem["start_load"],
+            )
+        if result is None:
+            result = _ortools_resequence(problem, time_limit)
+
+        if result is not None and result[0] < current:
+            cost, route = result
+            if problem["max_transit"] is None or cost <= problem["max_transit"]:
+                return [problem["route"][node - 1] for node in route[1:]], current - cost
+    except Exception as e:
+        logger.exception(e)
+        logger.debug("exception while polishing route")
+    return problem["route"], 0
+
+
+def solution_routes(manager, routing, solution):
+    """
+        nodes of every vehicle route in solution (without warehouse)
+    """
+    routes = []
+    for vehicle_id in range(routing.vehicles()):
+        index = solution.Value(routing.NextVar(routing.Start(vehicle_id)))
+        route = []
+        while not routing.IsEnd(index):
+            route.append(manager.IndexToNode(index))
+            index = solution.Value(routing.NextVar(index))
+        routes.append(route)
+    return routes
+
+
+def serial_polish(polish):
+    """
+        polish options (see polish_solution) of solve running in worker process
+        (partition, scenario, fleet size candidate or portfolio member), its routes
+        are polished one by one instead of in POLISH_WORKERS more processes
+    """
+    if polish is False:
+        return False
+    return dict(polish or {}, workers=1)
+
+
+def polish_solution(manager, routing, solution, make_problem, options=None):
+    """
+        Post-solve intra-route polishing.
+
+        Every route of solution is re-sequenced independently in parallel processes
+        within time budget, on a single vehicle problem built by
+        make_problem(vehicle_id, route) (see local_problem, None skips route). Improved routes are
+        restored into the full routing model, so precedence, capacity, windows and
+        duty time of the full model are checked again (original solution is kept
+        if restoring fails).
+
+        options (request's "polish" dict, env defaults if not given):
+            time    : total time budget in seconds (0 disables)
+            workers : no of routes polished in parallel
+        polish = false in request disables polishing.
+
+        return (solution, summary)
+    """
+    if options is False:
+        return solution, {}
+    options = options or {}
+    budget = options.get("time", POLISH_TIME)
+    workers = options.get("workers", POLISH_WORKERS)
+    if not budget:
+        return solution, {}
+
+    t1 = time.time()
+    routes = solution_routes(manager, routing, solution)
+    vehicles = [v for v, route in enumerate(routes) if len(route) >= POLISH_MIN_NODES]
+    if not vehicles:
+        return solution, {}
+    problems = [make_problem(v, routes[v]) for v in vehicles]
+    # routes which can not be polished (eg. not starting at warehouse)
+    vehicles = [v for v, problem in zip(vehicles, problems) if problem is not None]
+    problems = [problem for problem in problems if problem is not None]
+    if not problems:
+        return solution, {}
+
+    workers = max(1, min(workers, len(problems)))
+    # routes are polished in rounds of "workers" routes
+    rounds = -(-len(problems) // workers)
+    time_limit = budget / rounds
+    if workers == 1:
+        results = [polish_route(problem, time_limit) for problem in problems]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(
+                executor.map(polish_route, problems, [time_limit] * len(problems))
+            )
+
+    improved = 0
+    new_routes = list(routes)
+    for v, (route, improvement) in zip(vehicles, results):
+        if improvement > 0:
+            new_routes[v] = route
+            improved += 1
+
+    objective = solution.ObjectiveValue()
+    polished = solution
+    if improved:
+        assignment = routing.ReadAssignmentFromRoutes(new_routes, True)
+        restored = routing.RestoreAssignment(assignment) if assignment else None
+        if restored is not None and restored.ObjectiveValue() < objective:
+            polished = restored
+        else:
+            logger.debug("polished routes could not be restored, keeping solution")
+            improved = 0
+
+    summary = {
+        "polished_routes": improved,
+        # objective improvement in km (arc costs include handover distance)
+        "polish_improvement": (objective - polished.ObjectiveValue()) / DISTANCE_SCALE,
+        "polish_time": round(time.time() - t1, 3),
+    }
+    logger.info(f"route polishing: {summary}")
+    return polished, summary
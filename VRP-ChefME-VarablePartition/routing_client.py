@@ -0,0 +1,117 @@
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import requests
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# osrm http api configration
+OSRM_HOST = os.environ.get("OSRM_HOST", "https://uat.chefme.fero.ai/routing")
+OSRM_PROFILE = os.environ.get("OSRM_PROFILE", "driving")
+OSRM_TIMEOUT = float(os.environ.get("OSRM_TIMEOUT", 30))  # in seconds, per call
+OSRM_RETRIES = int(os.environ.get("OSRM_RETRIES", 3))
+# no of parallel connections (and threads) used against osrm
+OSRM_CONCURRENCY = int(os.environ.get("OSRM_CONCURRENCY", 8))
+
+
+class RoutingClient:
+    """
+        Shared http client for all osrm traffic.
+
+        Keeps a pool of keep-alive connections to osrm and a thread pool of same size,
+        so that independent requests (matrix blocks, trips) can be sent concurrently.
+
+        Important Note : all coordinates are (long, lat) as expected by osrm.
+    """
+
+    def __init__(
+        self,
+        host=OSRM_HOST,
+        profile=OSRM_PROFILE,
+        concurrency=OSRM_CONCURRENCY,
+        timeout=OSRM_TIMEOUT,
+        retries=OSRM_RETRIES,
+    ):
+        self.host = host.rstrip("/")
+        self.profile = profile
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+
+        # retrying on connection errors and busy/failed osrm responses
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.2,
+            status_forcelist=(429, 500, 502, 503, 504),
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.concurrency, max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+    def request(self, service, coordinates, timeout=None, **params):
+        """
+            send request to given osrm service and return json response
+            raise ValueError if osrm could not serve the request
+        """
+        coordinates = ";".join(f"{long},{lat}" for long, lat in coordinates)
+        url = f"{self.host}/{service}/v1/{self.profile}/{coordinates}"
+        resp = self.session.get(url, params=params, timeout=timeout or self.timeout)
+        result = resp.json()
+        if result.get("code") != "Ok":
+            raise ValueError(
+                f"osrm {service} request failed: {result.get('code')} {result.get('message', '')}"
+            )
+        return result
+
+    def route(self, coordinates, **params):
+        """
+            route passing through given coordinates in order
+        """
+        return self.request("route", coordinates, **params)
+
+    def table(self, sources, destinations=None, annotations="distance", **params):
+        """
+            distance/duration table between sources and destinations
+            if destinations are not given, table is calculated between sources itself
+        """
+        coordinates = list(sources)
+        if destinations is not None:
+            coordinates += list(destinations)
+            params["sources"] = ";".join(map(str, range(len(sources))))
+            params["destinations"] = ";".join(
+                map(str, range(len(sources), len(coordinates)))
+            )
+        return self.request("table", coordinates, annotations=annotations, **params)
+
+    def match(self, coordinates, radiuses=None, **params):
+        """
+            snap given gps trace on road network
+        """
+        if radiuses is not None:
+            params["radiuses"] = ";".join(map(str, radiuses))
+        return self.request("match", coordinates, **params)
+
+    def map(self, fn, *iterables):
+        """
+            run fn concurrently on client's thread pool, results are in input order
+        """
+        return list(self.executor.map(fn, *iterables))
+
+
+_clients = dict()
+
+
+def get_client():
+    """
+        return routing client of current process
+        (celery workers are forked, so connections are not shared between processes)
+    """
+    pid = os.getpid()
+    if pid not in _clients:
+        _clients[pid] = RoutingClient()
+    return _clients[pid]
@@ -0,0 +1,152 @@
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+import logging
+import os
+import time
+
+from decomposition import vrpspdtw_solver
+from location_util_osm import distance_matrix, MATRIX_FALLBACK
+from route_polish import serial_polish
+from solve_profiles import solve_profile
+from VRPSPD_ortools_v1 import VRPSPD_ortools
+
+logger = logging.getLogger(__name__)
+
+# no of scenarios solved in parallel
+SCENARIO_WORKERS = int(os.environ.get("SCENARIO_WORKERS", os.cpu_count() or 1))
+
+# per vehicle lists of VRPSPD request and per driver fields of VRPSPDTW request,
+# scalar override is applied to every vehicle
+VRPSPD_VEHICLE_KEYS = ("capacity_of_vehicles", "max_utilized_capacity_of_vehicles")
+VRPSPDTW_DRIVER_KEYS = (
+    "duty_start_time",
+    "duty_end_time",
+    "capacity_of_vehicle",
+    "max_utilized_capacity_of_vehicle",
+)
+
+
+def _resize(values, n):
+    """
+        first n values, repeating values cyclically if more are needed
+    """
+    return [deepcopy(values[i % len(values)]) for i in range(n)]
+
+
+def scenario_request(base, overrides, problem):
+    """
+        request of one scenario: base request (before unrolling) with overrides
+
+        problem is "multiple driver" (VRPSPD) or "multiple driver with time window"
+        (VRPSPDTW). Overrides replace request keys, with following additions:
+            no_vehicles : fleet size, vehicles / drivers of base request are
+                          repeated cyclically if fleet is larger
+            scalar value of per vehicle (VRPSPD) or per driver (VRPSPDTW) field
+            is applied to every vehicle
+    """
+    request = deepcopy(base)
+    overrides = dict(overrides)
+    n_vehicles = overrides.pop("no_vehicles", None)
+
+    if problem == "multiple driver":
+        if n_vehicles is not None:
+            request["no_vehicles"] = n_vehicles
+            for key in VRPSPD_VEHICLE_KEYS:
+                request[key] = _resize(request[key], n_vehicles)
+        for key, value in overrides.items():
+            if key in VRPSPD_VEHICLE_KEYS and not isinstance(value, list):
+                value = [value] * request["no_vehicles"]
+            request[key] = value
+    else:
+        if n_vehicles is not None:
+            request["drivers"] = _resize(request["drivers"], n_vehicles)
+        for key, value in overrides.items():
+            if key in VRPSPDTW_DRIVER_KEYS:
+                for driver in request["drivers"]:
+                    driver[key] = value
+            else:
+                request[key] = value
+    return request
+
+
+def shared_matrix(raw_data):
+    """
+        distance matrix between warehouse and all order locations of unrolled request,
+        built once and reused by every scenario (see distance_matrix base)
+    """
+    locations = [raw_data["depot_location"]] + [
+        location for locations in raw_data["locations_of_orders"] for location in locations
+    ]
+    return distance_matrix(
+        locations,
+        mode=raw_data.get("distance_mode", "road"),
+        fallback=raw_data.get("matrix_fallback", MATRIX_FALLBACK),
+    )
+
+
+def _solve_scenario(problem, raw_data):
+    """
+        solve one scenario (runs in worker process)
+    """
+    t1 = time.time()
+    try:
+        if problem == "multiple driver":
+            out_data = VRPSPD_ortools(raw_data).solve()
+        else:
+            out_data = vrpspdtw_solver(raw_data).solve()
+    except Exception as e:
+        logger.exception(e)
+        out_data = {"optimized_status": False}
+    out_data["time_taken_to_solve"] = round(time.time() - t1, 3)
+    return out_data
+
+
+def comparison_row(name, out_data, excluded_orders):
+    """
+        one row of scenario comparison table
+    """
+    dropped = excluded_orders + out_data.get("dropped_orders_by_solver", [])
+    return {
+        "scenario": name,
+        "optimized_status": out_data.get("optimized_status", False),
+        "optimized_distance": out_data.get("optimized_distance"),
+        "no_driver_utilized": out_data.get("no_driver_utilized"),
+        "dropped_orders": len(dropped),
+        "time_taken_to_solve": out_data["time_taken_to_solve"],
+    }
+
+
+def solve_scenarios(problem, names, requests, workers=None):
+    """
+        Solve unrolled scenario requests in parallel processes
+
+        Every request shares one distance matrix (built here from first request,
+        scenarios only differ in fleet and parameters, not in locations).
+        return (comparison table, plans of all scenarios, matrix build time)
+    """
+    t1 = time.time()
+    matrix = shared_matrix(requests[0])
+    matrix_time = round(time.time() - t1, 3)
+    for raw_data in requests:
+        raw_data["reuse_matrix"] = matrix
+
+    workers = max(1, min(workers or SCENARIO_WORKERS, len(requests)))
+    if workers == 1:
+        plans = [_solve_scenario(problem, raw_data) for raw_data in requests]
+    else:
+        # scenarios are already solved in parallel
+        for raw_data in requests:
+            raw_data["polish"] = serial_polish(
+                raw_data.get("polish", solve_profile(raw_data).get("polish"))
+            )
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            plans = list(
+                executor.map(_solve_scenario, [problem] * len(requests), requests)
+            )
+
+    table = [
+        comparison_row(name, out_data, raw_data.get("excluded_orders", []))
+        for name, out_data, raw_data in zip(names, plans, requests)
+    ]
+    logger.info(f"scenario comparison: {table}")
+    return table, plans, matrix_time
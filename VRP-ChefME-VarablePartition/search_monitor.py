@@ -0,0 +1,329 @@
+import logging
+import os
+import time
+
+from lower_bound import gap
+
+logger = logging.getLogger(__name__)
+
+# early stopping configration
+# search is stopped when objective did not improve by EARLY_STOP_IMPROVEMENT (in percent)
+# within EARLY_STOP_WINDOW seconds or within EARLY_STOP_SOLUTIONS solutions (0 disables a rule)
+EARLY_STOP_IMPROVEMENT = float(os.environ.get("EARLY_STOP_IMPROVEMENT", 0.5))
+EARLY_STOP_WINDOW = float(os.environ.get("EARLY_STOP_WINDOW", 60))  # in seconds
+EARLY_STOP_SOLUTIONS = int(os.environ.get("EARLY_STOP_SOLUTIONS", 0))
+# min seconds between two published intermediate plans
+PROGRESS_INTERVAL = float(os.environ.get("PROGRESS_INTERVAL", 5))
+# max no of points in objective trace of search telemetry
+TELEMETRY_TRACE_POINTS = int(os.environ.get("TELEMETRY_TRACE_POINTS", 200))
+
+# stop reasons
+STOP_NO_IMPROVEMENT_WINDOW = "no_improvement_window"
+STOP_NO_IMPROVEMENT_SOLUTIONS = "no_improvement_solutions"
+STOP_TIME_LIMIT = "time_limit"
+STOP_SEARCH_COMPLETED = "search_completed"
+STOP_TARGET_GAP = "target_gap"
+
+
+class EarlyStopping:
+    """
+        Search monitor which stops ortools search once the objective stops improving,
+        instead of always burning the full time limit (time limit is still the ceiling).
+
+        Every solution is tracked with an at-solution callback. A solution counts as
+        improvement only if it is better than the last improving solution by at least
+        "improvement" percent. The rules are checked by a custom search limit, so the
+        search is also stopped when no new solution is found at all within the window.
+
+        options (request's "early_stopping" dict, env defaults if not given):
+            improvement : min relative improvement in percent
+            window      : seconds without improvement before stopping (0 disables)
+            solutions   : solutions without improvement before stopping (0 disables)
+        early_stopping = false in request disables early stopping.
+    """
+
+    def __init__(self, routing, time_limit, options=None):
+        self.routing = routing
+        self.time_limit = time_limit
+        self.enabled = options is not False
+        options = options or {}
+        self.improvement = options.get("improvement", EARLY_STOP_IMPROVEMENT) / 100
+        self.window = options.get("window", EARLY_STOP_WINDOW)
+        self.solutions = options.get("solutions", EARLY_STOP_SOLUTIONS)
+
+        self.start_time = time.time()
+        self.n_solutions = 0
+        self.best_objective = None
+        # last solution which improved by atleast "improvement"
+        self.reference_objective = None
+        self.reference_time = self.start_time
+        self.reference_solution = 0
+        self.reason = None
+
+        routing.AddAtSolutionCallback(self.on_solution)
+        if self.enabled:
+            limit = routing.solver().CustomLimit(self.should_stop)
+            routing.AddSearchMonitor(limit)
+
+    def on_solution(self):
+        """
+            at-solution callback, called by ortools for every new solution
+        """
+        objective = self.routing.CostVar().Max()
+        self.n_solutions += 1
+        if self.best_objective is None or objective < self.best_objective:
+            self.best_objective = objective
+
+        if self.reference_objective is None or objective < self.reference_objective * (
+            1 - self.improvement
+        ):
+            self.reference_objective = objective
+            self.reference_time = time.time()
+            self.reference_solution = self.n_solutions
+
+    def should_stop(self):
+        """
+            custom search limit, called by ortools frequently during search
+        """
+        # never stopping before first solution
+        if self.reference_objective is None:
+            return False
+        if self.window and time.time() - self.reference_time >= self.window:
+            self.reason = STOP_NO_IMPROVEMENT_WINDOW
+            return True
+        if self.solutions and self.n_solutions - self.reference_solution >= self.solutions:
+            self.reason = STOP_NO_IMPROVEMENT_SOLUTIONS
+            return True
+        return False
+
+    def elapsed(self):
+        """
+            seconds since search started
+        """
+        return time.time() - self.start_time
+
+    def stop_reason(self):
+        """
+            why search was stopped, to be called after search is finished
+        """
+        if self.reason is not None:
+            return self.reason
+        if self.elapsed() >= self.time_limit:
+            return STOP_TIME_LIMIT
+        return STOP_SEARCH_COMPLETED
+
+    def summary(self):
+        """
+            search statistics for output response
+        """
+        summary = {
+            "stop_reason": self.stop_reason(),
+            "search_time": round(self.elapsed(), 3),
+            "solutions_found": self.n_solutions,
+        }
+        logger.info(f"search stopped: {summary}")
+        return summary
+
+
+class CurrentSolution:
+    """
+        Assignment like access to values of the solution being found,
+        so that output can be generated inside at-solution callbacks.
+    """
+
+    def Value(self, var):
+        return var.Value()
+
+    def Min(self, var):
+        return var.Min()
+
+    def Max(self, var):
+        return var.Max()
+
+
+class ProgressReporter:
+    """
+        Publishes improving solutions while search is still running (anytime solving).
+
+        output(solution) generates output response dict and publish(data) persists it.
+        First solution is published immediately, afterwards only improving solutions
+        and atmost once per "interval" seconds.
+    """
+
+    def __init__(self, routing, output, publish, interval=PROGRESS_INTERVAL):
+        self.routing = routing
+        self.output = output
+        self.publish = publish
+        self.interval = interval
+
+        self.start_time = time.time()
+        self.published_objective = None
+        self.published_time = None
+
+        routing.AddAtSolutionCallback(self.on_solution)
+
+    def on_solution(self):
+        """
+            at-solution callback, called by ortools for every new solution
+        """
+        objective = self.routing.CostVar().Max()
+        now = time.time()
+        if self.published_objective is not None and (
+            objective >= self.published_objective
+            or now - self.published_time < self.interval
+        ):
+            return
+
+        # publishing must never break the search itself
+        try:
+            data = self.output(CurrentSolution())
+            data["optimized_status"] = True
+            data["objective"] = objective
+            data["search_time"] = round(now - self.start_time, 3)
+            self.publish(data)
+        except Exception as e:
+            logger.exception(e)
+            logger.debug("exception while publishing intermediate solution")
+
+        self.published_objective = objective
+        self.published_time = now
+
+
+class FeasibilityStop:
+    """
+        Search monitor which stops ortools search at first solution serving all given
+        node indexes (eg. to check whether a fleet size is enough, see fleet_sweep).
+    """
+
+    def __init__(self, routing, indices):
+        self.routing = routing
+        self.indices = list(indices)
+        self.feasible = False
+
+        routing.AddAtSolutionCallback(self.on_solution)
+        routing.AddSearchMonitor(routing.solver().CustomLimit(self.should_stop))
+
+    def on_solution(self):
+        """
+            at-solution callback, called by ortools for every new solution
+        """
+        self.feasible = all(
+            self.routing.ActiveVar(index).Value() for index in self.indices
+        )
+
+    def should_stop(self):
+        """
+            custom search limit, called by ortools frequently during search
+        """
+        return self.feasible
+
+
+class GapStopping:
+    """
+        Search monitor which stops ortools search once best objective is within
+        target_gap (in percent) of lower bound. Lower bound is computed in another
+        process while searching (see lower_bound.LowerBound), rule is only checked
+        once it is available.
+    """
+
+    def __init__(self, routing, bound, target_gap):
+        self.routing = routing
+        self.bound = bound
+        self.target_gap = target_gap
+        self.best_objective = None
+        self.reached = False
+
+        routing.AddAtSolutionCallback(self.on_solution)
+        routing.AddSearchMonitor(routing.solver().CustomLimit(self.should_stop))
+
+    def on_solution(self):
+        """
+            at-solution callback, called by ortools for every new solution
+        """
+        objective = self.routing.CostVar().Max()
+        if self.best_objective is None or objective < self.best_objective:
+            self.best_objective = objective
+
+    def should_stop(self):
+        """
+            custom search limit, called by ortools frequently during search
+        """
+        if self.best_objective is None:
+            return False
+        bound = self.bound.value()
+        if bound is None:
+            return False
+        self.reached = gap(self.best_objective, bound) <= self.target_gap
+        return self.reached
+
+
+class SearchTelemetry:
+    """
+        Search monitor recording how ortools search went ("telemetry": true in request),
+        so that time limits can be tuned from data.
+
+        Every improving solution is added to objective trace as [seconds since search
+        started, objective], trace is thinned to atmost TELEMETRY_TRACE_POINTS points
+        (first and last improvement always kept).
+    """
+
+    def __init__(self, routing, build_time):
+        """
+            build_time : seconds spent building routing model before search
+        """
+        self.routing = routing
+        self.build_time = build_time
+
+        self.start_time = time.time()
+        self.end_time = None
+        self.first_solution_time = None
+        self.n_solutions = 0
+        self.trace = []
+
+        routing.AddAtSolutionCallback(self.on_solution)
+
+    def on_solution(self):
+        """
+            at-solution callback, called by ortools for every new solution
+        """
+        objective = self.routing.CostVar().Max()
+        elapsed = time.time() - self.start_time
+        self.n_solutions += 1
+        if self.first_solution_time is None:
+            self.first_solution_time = elapsed
+        if not self.trace or objective < self.trace[-1][1]:
+            self.trace.append([round(elapsed, 3), objective])
+
+    def stop(self):
+        """
+            marking end of search, to be called right after search (before polishing)
+        """
+        self.end_time = time.time()
+
+    def thinned_trace(self):
+        """
+            objective trace with atmost TELEMETRY_TRACE_POINTS points
+        """
+        points = max(TELEMETRY_TRACE_POINTS, 2)
+        if len(self.trace) <= points:
+            return self.trace
+        step = (len(self.trace) - 1) / (points - 1)
+        return [self.trace[round(i * step)] for i in range(points)]
+
+    def summary(self):
+        """
+            telemetry for output response, to be called after search is finished
+        """
+        solver = self.routing.solver()
+        return {
+            "model_build_time": round(self.build_time, 3),
+            "search_time": round((self.end_time or time.time()) - self.start_time, 3),
+            "time_to_first_solution": None
+            if self.first_solution_time is None
+            else round(self.first_solution_time, 3),
+            "solutions_found": self.n_solutions,
+            "improving_solutions": len(self.trace),
+            "branches": solver.Branches(),
+            "failures": solver.Failures(),
+            "objective_trace": self.thinned_trace(),
+        }
@@ -0,0 +1,141 @@
+import logging
+import os
+import time
+
+from route_polish import POLISH_TIME
+from search_monitor import EARLY_STOP_WINDOW
+
+logger = logging.getLogger(__name__)
+
+# deadline configration
+# seconds of respond_by kept for generating and storing response
+RESPOND_BY_MARGIN = float(os.environ.get("RESPOND_BY_MARGIN", 2))
+# multiple driver requests switch to fast engine when less search time is left
+DEADLINE_FAST_ENGINE_TIME = float(os.environ.get("DEADLINE_FAST_ENGINE_TIME", 5))
+# max share of remaining time used for route polishing when deadline is close
+DEADLINE_POLISH_SHARE = 0.1
+# ortools search never gets less time (in seconds), even if deadline has passed
+MIN_SOLVE_TIME = 1
+
+# named solve profiles ("solve_profile" in request)
+#   first_solution_strategy / local_search_metaheuristic : ortools names
+#   operators      : ortools local search operators switched on / off
+#   workers        : portfolio width (no of parallel searches)
+#   time           : search time budget in seconds
+#   early_stopping : stopping rule (see search_monitor.EarlyStopping)
+#   polish         : route polishing budget (see route_polish.polish_solution)
+SOLVE_PROFILES = {
+    "fast": {
+        "first_solution_strategy": "PARALLEL_CHEAPEST_INSERTION",
+        "local_search_metaheuristic": "GREEDY_DESCENT",
+        "operators": {
+            "use_cross_exchange": False,
+            "use_relocate_expensive_chain": False,
+            "use_lin_kernighan": False,
+            "use_tsp_opt": False,
+        },
+        "workers": 1,
+        "time": 10,
+        "early_stopping": {"improvement": 1, "window": 3},
+        "polish": {"time": 1},
+    },
+    "balanced": {
+        "first_solution_strategy": "PARALLEL_CHEAPEST_INSERTION",
+        "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH",
+        "time": 5 * 60,
+    },
+    "thorough": {
+        "first_solution_strategy": "PARALLEL_CHEAPEST_INSERTION",
+        "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH",
+        "operators": {
+            "use_relocate_expensive_chain": True,
+            "use_cross_exchange": True,
+            "use_relocate_subtrip": True,
+            "use_exchange_subtrip": True,
+            "use_global_cheapest_insertion_close_nodes_lns": True,
+        },
+        "workers": max(2, os.cpu_count() or 1),
+        "time": 30 * 60,
+        "early_stopping": {"improvement": 0.1, "window": 5 * 60},
+        "polish": {"time": 30},
+    },
+}
+
+
+def solve_profile(data):
+    """
+        solve profile of request, empty dict if request has no profile
+    """
+    name = data.get("solve_profile")
+    if name is None:
+        return {}
+    if name not in SOLVE_PROFILES:
+        raise ValueError(f"Invalid solve profile {name}")
+    return SOLVE_PROFILES[name]
+
+
+def solve_time_limit(data, default):
+    """
+        search time limit of request (in seconds): max_solver_time or time budget
+        of solve profile, default (solver's own capped limit) if no profile is given
+    """
+    profile = solve_profile(data)
+    if not profile:
+        return default
+    return data.get("max_solver_time", profile["time"])
+
+
+def response_deadline(data):
+    """
+        time (epoch seconds) by which search has to be finished, None without respond_by
+
+        respond_by is counted in seconds from "received_at" (set by the endpoint when
+        request is queued, now if not set), so queue wait and matrix build are
+        already spent from it. RESPOND_BY_MARGIN is kept for the response.
+    """
+    if data.get("respond_by") is None:
+        return None
+    return data.get("received_at", time.time()) + data["respond_by"] - RESPOND_BY_MARGIN
+
+
+def fit_deadline(solver, attribute):
+    """
+        Scale search of solver (VRPSPD / VRPSPDTW / single trip) to its response
+        deadline, called right before search. If less time is left than time limit
+        (solver attribute) and polishing budget
+            polishing gets atmost DEADLINE_POLISH_SHARE of remaining time
+            search gets the rest as time limit
+            early stopping window is atmost half of search time limit
+        Multiple driver solvers switch to fast engine if less than
+        DEADLINE_FAST_ENGINE_TIME seconds are left.
+
+        return summary for output response
+    """
+    limit = getattr(solver, attribute)
+    summary = {"solve_profile": solver.solve_profile, "time_limit": limit}
+    if solver.deadline is None:
+        return summary
+
+    polish = getattr(solver, "polish", False)
+    polish_time = 0 if polish is False else (polish or {}).get("time", POLISH_TIME)
+    remaining = solver.deadline - time.time()
+    summary["remaining_time"] = round(remaining, 3)
+    if remaining >= limit + polish_time:
+        return summary
+
+    if remaining < DEADLINE_FAST_ENGINE_TIME and hasattr(solver, "engine"):
+        solver.engine = "fast"
+    if polish is not False:
+        polish_time = min(polish_time, max(remaining, 0) * DEADLINE_POLISH_SHARE)
+        solver.polish = dict(polish or {}, time=polish_time)
+    limit = max(remaining - polish_time, MIN_SOLVE_TIME)
+    setattr(solver, attribute, limit)
+    if solver.early_stopping is not False:
+        options = solver.early_stopping or {}
+        solver.early_stopping = dict(
+            options, window=min(options.get("window", EARLY_STOP_WINDOW), limit / 2)
+        )
+    summary["time_limit"] = round(limit, 3)
+    summary["scaled_to_deadline"] = True
+    logger.info(f"search scaled to deadline: {summary}")
+    return summary
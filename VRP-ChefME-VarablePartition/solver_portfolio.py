@@ -0,0 +1,173 @@
+from ortools.constraint_solver import routing_enums_pb2
+from ortools.constraint_solver import pywrapcp
+from ortools.util.optional_boolean_pb2 import BOOL_FALSE, BOOL_TRUE
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import logging
+import os
+
+from route_polish import serial_polish
+
+logger = logging.getLogger(__name__)
+
+# default no of parallel searches (1 means no portfolio)
+PORTFOLIO_WORKERS = int(os.environ.get("PORTFOLIO_WORKERS", 1))
+
+DEFAULT_SEARCH_CONFIG = {
+    "first_solution_strategy": "PARALLEL_CHEAPEST_INSERTION",
+    "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH",
+}
+
+# diverse mix of first solution strategies and metaheuristics,
+# first one is always the default configration
+DEFAULT_PORTFOLIO = [
+    DEFAULT_SEARCH_CONFIG,
+    {
+        "first_solution_strategy": "LOCAL_CHEAPEST_INSERTION",
+        "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH",
+    },
+    {
+        "first_solution_strategy": "PATH_CHEAPEST_ARC",
+        "local_search_metaheuristic": "SIMULATED_ANNEALING",
+    },
+    {
+        "first_solution_strategy": "SAVINGS",
+        "local_search_metaheuristic": "TABU_SEARCH",
+    },
+    {
+        "first_solution_strategy": "PARALLEL_CHEAPEST_INSERTION",
+        "local_search_metaheuristic": "TABU_SEARCH",
+    },
+    {
+        "first_solution_strategy": "CHRISTOFIDES",
+        "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH",
+    },
+]
+
+
+def portfolio_configs(portfolio=None, profile=None):
+    """
+        list of search configrations from request's portfolio dict:
+            workers                   : no of parallel searches
+            first_solution_strategies : ortools FirstSolutionStrategy names
+            metaheuristics            : ortools LocalSearchMetaheuristic names
+            seeds                     : random seeds
+
+        Given strategies x metaheuristics x seeds are combined (DEFAULT_PORTFOLIO if not given)
+        and first "workers" configrations are used.
+        Without portfolio, only default configration is returned.
+
+        profile (see solve_profiles) replaces default configration and default no of
+        workers, its local search operators are used by every configration.
+    """
+    portfolio = portfolio or {}
+    profile = profile or {}
+    default = {
+        key: profile.get(key, value) for key, value in DEFAULT_SEARCH_CONFIG.items()
+    }
+    operators = profile.get("operators")
+    workers = int(portfolio.get("workers", profile.get("workers", PORTFOLIO_WORKERS)))
+    if workers <= 1:
+        config = dict(default)
+        if portfolio.get("seeds"):
+            config["seed"] = portfolio["seeds"][0]
+        if operators:
+            config["operators"] = operators
+        return [config]
+
+    strategies = portfolio.get("first_solution_strategies")
+    metaheuristics = portfolio.get("metaheuristics")
+    if strategies or metaheuristics:
+        base = [
+            {"first_solution_strategy": fss, "local_search_metaheuristic": meta}
+            for meta in metaheuristics
+            or [DEFAULT_SEARCH_CONFIG["local_search_metaheuristic"]]
+            for fss in strategies or [DEFAULT_SEARCH_CONFIG["first_solution_strategy"]]
+        ]
+    else:
+        base = [default] + DEFAULT_PORTFOLIO[1:]
+
+    seeds = portfolio.get("seeds", range(workers))
+    configs = [dict(config, seed=seed) for seed in seeds for config in base]
+    if operators:
+        configs = [dict(config, operators=operators) for config in configs]
+
+    # checking names before starting any search
+    for config in configs:
+        search_parameters(config, 0)
+
+    return configs[:workers]
+
+
+def search_parameters(config, time_limit):
+    """
+        ortools search parameters from search configration
+    """
+    params = pywrapcp.DefaultRoutingSearchParameters()
+    try:
+        params.first_solution_strategy = getattr(
+            routing_enums_pb2.FirstSolutionStrategy, config["first_solution_strategy"]
+        )
+        params.local_search_metaheuristic = getattr(
+            routing_enums_pb2.LocalSearchMetaheuristic,
+            config["local_search_metaheuristic"],
+        )
+    except AttributeError as e:
+        raise ValueError(f"Invalid search configration {config}") from e
+
+    # local search operators switched on / off (see solve_profiles)
+    operators = params.local_search_operators
+    for name, enabled in config.get("operators", {}).items():
+        if not hasattr(operators, name):
+            raise ValueError(f"Invalid local search operator {name}")
+        setattr(operators, name, BOOL_TRUE if enabled else BOOL_FALSE)
+
+    # fractional seconds are kept for short deadlines
+    params.time_limit.FromMilliseconds(int(time_limit * 1000))
+    return params
+
+
+def _solve_member(solver, config):
+    """
+        solve one portfolio member (runs in worker process)
+    """
+    try:
+        if hasattr(solver, "polish"):
+            solver.polish = serial_polish(solver.polish)
+        return solver.solve_with_config(config)
+    except Exception as e:
+        logger.exception(e)
+        return {"optimized_status": False}
+
+
+def solve_portfolio(solver, configs, workers=None):
+    """
+        Solve same preprocessed problem with all search configrations in parallel
+        processes, and return best solution (lowest objective) found by the deadline.
+
+        solver must provide solve_with_config(config) returning output dict
+        with "objective" key for solved problems.
+
+        Important Note : worker processes are created with multiprocessing (not billiard),
+        so it works from inside celery prefork workers as well.
+    """
+    workers = min(workers or len(configs), len(configs))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(
+            executor.map(_solve_member, itertools.repeat(solver), configs)
+        )
+
+    solved = [
+        (result["objective"], i)
+        for i, result in enumerate(results)
+        if result.get("optimized_status")
+    ]
+    if not solved:
+        return {"optimized_status": False}
+
+    _, best = min(solved)
+    data = results[best]
+    data["search_config"] = configs[best]
+    data["portfolio_objectives"] = [result.get("objective") for result in results]
+    logger.info(f"portfolio objectives {data['portfolio_objectives']}, best {configs[best]}")
+    return data
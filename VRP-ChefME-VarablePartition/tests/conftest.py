@@ -0,0 +1,5 @@
+import os
+import sys
+
+# modules of service are imported as top level modules (same as gunicorn / celery)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
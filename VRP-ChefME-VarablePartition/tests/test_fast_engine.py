@@ -0,0 +1,79 @@
+import random
+
+from fast_engine import fast_routes
+from VRPSPDTW_ortools import VRPSPDTW_ortools
+from VRPSPD_ortools_v1 import VRPSPD_ortools
+
+WAREHOUSE = "23.025716,72.554297"
+
+
+def typical_request(n_orders, n_vehicles, seed=0):
+    """
+        unrolled VRPSPDTW request (see unroll_VRPSPDTW_data) of one warehouse,
+        mostly deliveries and some pickups around city, estimated distances
+    """
+    rng = random.Random(seed)
+    request = {
+        "avg_speed": 50,
+        "pickup_time": 10,
+        "depot_location": WAREHOUSE,
+        "warehouse_pickup_time": (300, 600),
+        "warehouse_drop_time": (300, 1020),
+        "no_vehicles": n_vehicles,
+        "duty_time": [(360, 1080)] * n_vehicles,
+        "capacity_of_vehicles": [40] * n_vehicles,
+        "order_storage": ["F"] * n_orders,
+        "vehicle_storage": ["F"] * n_vehicles,
+        "total_orders": n_orders,
+        "do_numbers": [],
+        "locations_of_orders": [],
+        "delivery_sizes": [],
+        "type_of_orders": [],
+        "delivery_windows": [],
+        "customer_handover_time": [],
+        "distance_mode": "estimate",
+        "max_solver_time": 5,
+        "engine": "fast",
+        "polish": False,
+    }
+    for n in range(n_orders):
+        customer = f"{23 + rng.random() * 0.1:.6f},{72.5 + rng.random() * 0.1:.6f}"
+        pickup = int(rng.random() < 0.3)
+        start = rng.choice([7, 8, 9, 10, 11]) * 60
+        request["do_numbers"].append(f"DO{n}")
+        request["locations_of_orders"].append(
+            [customer, WAREHOUSE] if pickup else [WAREHOUSE, customer]
+        )
+        request["delivery_sizes"].append(rng.randint(1, 10))
+        request["type_of_orders"].append(pickup)
+        request["delivery_windows"].append((start, start + 240))
+        request["customer_handover_time"].append(rng.choice([5, 10]))
+    return request
+
+
+def test_savings_merge_most_orders():
+    solver = VRPSPDTW_ortools(typical_request(100, 12))
+    routes, summary = fast_routes(solver.fast_data())
+
+    assert summary["unrouted_orders"] == 0
+    # orders share routes by savings, few are left for cheapest insertion
+    assert summary["savings_routes"] <= 20
+    assert summary["inserted_orders"] <= 10
+
+
+def test_fast_plan_serves_every_order():
+    out = VRPSPDTW_ortools(typical_request(100, 12)).solve()
+
+    assert out["optimized_status"]
+    assert out["engine"] == "fast"
+    assert out["dropped_orders_by_solver"] == []
+
+
+def test_rejected_fast_plan_is_not_searched():
+    # single short trip can not serve every order, VRPSPD can not drop orders
+    request = dict(typical_request(60, 1), max_single_trip_duration=3, handover_time=10)
+    out = VRPSPD_ortools(request).solve()
+
+    assert not out["optimized_status"]
+    assert out["engine"] == "fast"
+    assert len(out["dropped_orders_by_solver"]) == out["fast_engine"]["unrouted_orders"]
@@ -0,0 +1,88 @@
+import json
+import os
+import threading
+import uuid
+from copy import deepcopy
+from functools import partial
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("celery")
+try:
+    import VRP_server_celery as server
+except Exception as e:  # postgres of task table not reachable
+    pytest.skip(f"server not importable: {e}", allow_module_level=True)
+
+import location_util_osm
+import route_cache
+
+PAYLOAD = os.path.join(os.path.dirname(os.path.dirname(__file__)), "payload_example.json")
+
+
+def fake_fetch_pairs(latlongs, missing, fallback):
+    """
+        osrm table replaced by great circle estimates (one block of all pairs)
+    """
+    index = np.arange(len(latlongs))
+    distances = location_util_osm.estimated_distance_matrix(latlongs)
+    return [(index, index)], [(distances, distances * 60)]
+
+
+@pytest.fixture
+def stored_plan(monkeypatch, tmp_path):
+    """
+        completed multiple driver with time window task, road distances come
+        from fake osrm and are kept in route cache (sqlite in tmp_path)
+    """
+    monkeypatch.setattr(location_util_osm, "_fetch_pairs", fake_fetch_pairs)
+    monkeypatch.setattr(
+        location_util_osm, "get_client", lambda: SimpleNamespace(profile="car")
+    )
+    monkeypatch.setattr(
+        route_cache, "RouteCache", partial(route_cache.RouteCache, str(tmp_path / "cache.db"))
+    )
+
+    with open(PAYLOAD) as f:
+        input_data = json.load(f)
+    data = deepcopy(input_data)
+    server.unroll_VRPSPDTW_data(data)
+    data["max_solver_time"] = 2
+    solver = server.VRPSPDTW_ortools(data)
+    task = SimpleNamespace(
+        id=str(uuid.uuid4()),
+        status="SUCCESS",
+        task_type="multiple driver with time window",
+        input_data=input_data,
+        out_data=solver.solve(),
+        distance_matrix=solver.data["distance_matrix"],
+    )
+    monkeypatch.setattr(server.ct_query_engine, "get_task", lambda task_id: task)
+    return task
+
+
+def test_insertion_from_two_threads(stored_plan):
+    """
+        synchronous endpoint is called from flask request threads, every thread
+        looks up new order's pairs in route cache
+    """
+    client = server.app.test_client()
+    responses = []
+
+    def insert(order_id, destination):
+        order = dict(stored_plan.input_data["orders"][0])
+        order.update(order_id=order_id, destination=destination)
+        responses.append(
+            client.post(f"/routeoptimization/insert/{stored_plan.id}", json={"order": order})
+        )
+
+    for i, destination in enumerate(["23.041001,72.531002", "23.012003,72.570004"]):
+        thread = threading.Thread(target=insert, args=(f"NEW-{i}", destination))
+        thread.start()
+        thread.join()
+
+    assert [response.status_code for response in responses] == [200, 200]
+    for response in responses:
+        assert response.get_json()["status"] == "SUCCESS"
@@ -1,6 +1,9 @@
 import bisect
 import math
 
+# solvers work on integer distances, DISTANCE_SCALE units per km (meters)
+DISTANCE_SCALE = 1000
+
 
 def possible_orderings(N):
     """
@@ -23,6 +26,28 @@ def possible_orderings(N):
     return qty, min((idx + 1) * 500, math.factorial(N))
 
 
+def warehouse_loaded_orders(raw_data):
+    """
+    indexes of delivery orders which are picked up at warehouse. Those orders are loaded
+    at start of route (depot loading step) instead of having their own warehouse pickup node.
+
+    Only used with "aggregate_warehouse": true in request. Loading at route start rules out
+    reloading at warehouse in the middle of a route (each vehicle has to carry all its
+    warehouse orders at once) and pickup time is not repeated per order, so plans can differ
+    from (or drop orders served by) the per-order pickup node model.
+    """
+    if not raw_data.get("aggregate_warehouse"):
+        return set()
+
+    return set(
+        i
+        for i, ((source, _), order_type) in enumerate(
+            zip(raw_data["locations_of_orders"], raw_data["type_of_orders"])
+        )
+        if not order_type and source == raw_data["depot_location"]
+    )
+
+
 if __name__ == "__main__":
     print(possible_orderings(5))
     print(possible_orderings(25))
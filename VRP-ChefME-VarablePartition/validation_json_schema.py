@@ -1,5 +1,6 @@
 from flask_inputs.validators import JsonSchema
 from flask_inputs import Inputs
+from jsonschema import Draft7Validator
 
 # json scheme for VRPSPD
 VRPSPD_data_format = {
@@ -16,6 +17,62 @@ VRPSPD_data_format = {
     "properties": {
         "avg_speed": {"type": "number"},
         "max_solver_time": {"type": "number"},
+        "solve_profile": {"type": "string", "enum": ["fast", "balanced", "thorough"]},
+        "respond_by": {"type": "number", "minimum": 0},
+        "distance_mode": {"type": "string", "enum": ["road", "estimate"]},
+        "matrix_fallback": {"type": "string", "enum": ["pair", "matrix", "none"]},
+        "aggregate_warehouse": {"type": "boolean"},
+        "engine": {"type": "string", "enum": ["ortools", "fast"]},
+        "target_gap": {"type": "number", "minimum": 0},
+        "telemetry": {"type": "boolean"},
+        "exact": {"type": "boolean"},
+        "early_stopping": {
+            "oneOf": [
+                {"type": "boolean", "enum": [False]},
+                {
+                    "type": "object",
+                    "properties": {
+                        "improvement": {"type": "number", "minimum": 0},
+                        "window": {"type": "number", "minimum": 0},
+                        "solutions": {"type": "integer", "minimum": 0},
+                    },
+                },
+            ]
+        },
+        "polish": {
+            "oneOf": [
+                {"type": "boolean", "enum": [False]},
+                {
+                    "type": "object",
+                    "properties": {
+                        "time": {"type": "number", "minimum": 0},
+                        "workers": {"type": "integer", "minimum": 1},
+                    },
+                },
+            ]
+        },
+        "fleet_sweep": {
+            "oneOf": [
+                {"type": "boolean"},
+                {
+                    "type": "object",
+                    "properties": {
+                        "time": {"type": "number", "minimum": 0},
+                        "workers": {"type": "integer", "minimum": 1},
+                        "points": {"type": "integer", "minimum": 1},
+                    },
+                },
+            ]
+        },
+        "portfolio": {
+            "type": "object",
+            "properties": {
+                "workers": {"type": "integer", "minimum": 1},
+                "first_solution_strategies": {"type": "array", "items": {"type": "string"}},
+                "metaheuristics": {"type": "array", "items": {"type": "string"}},
+                "seeds": {"type": "array", "items": {"type": "integer"}},
+            },
+        },
         "max_single_trip_duration": {"type": "number"},
         "handover_time": {"type": "number"},
         "warehouse_location": {"type": "string"},
@@ -72,6 +129,76 @@ VRPSPDTW_data_format = {
     "properties": {
         "avg_speed": {"type": "number"},
         "max_solver_time": {"type": "number"},
+        "solve_profile": {"type": "string", "enum": ["fast", "balanced", "thorough"]},
+        "respond_by": {"type": "number", "minimum": 0},
+        "distance_mode": {"type": "string", "enum": ["road", "estimate"]},
+        "matrix_fallback": {"type": "string", "enum": ["pair", "matrix", "none"]},
+        "aggregate_warehouse": {"type": "boolean"},
+        "engine": {"type": "string", "enum": ["ortools", "fast"]},
+        "target_gap": {"type": "number", "minimum": 0},
+        "telemetry": {"type": "boolean"},
+        "early_stopping": {
+            "oneOf": [
+                {"type": "boolean", "enum": [False]},
+                {
+                    "type": "object",
+                    "properties": {
+                        "improvement": {"type": "number", "minimum": 0},
+                        "window": {"type": "number", "minimum": 0},
+                        "solutions": {"type": "integer", "minimum": 0},
+                    },
+                },
+            ]
+        },
+        "polish": {
+            "oneOf": [
+                {"type": "boolean", "enum": [False]},
+                {
+                    "type": "object",
+                    "properties": {
+                        "time": {"type": "number", "minimum": 0},
+                        "workers": {"type": "integer", "minimum": 1},
+                    },
+                },
+            ]
+        },
+        "fleet_sweep": {
+            "oneOf": [
+                {"type": "boolean"},
+                {
+                    "type": "object",
+                    "properties": {
+                        "time": {"type": "number", "minimum": 0},
+                        "workers": {"type": "integer", "minimum": 1},
+                        "points": {"type": "integer", "minimum": 1},
+                    },
+                },
+            ]
+        },
+        "portfolio": {
+            "type": "object",
+            "properties": {
+                "workers": {"type": "integer", "minimum": 1},
+                "first_solution_strategies": {"type": "array", "items": {"type": "string"}},
+                "metaheuristics": {"type": "array", "items": {"type": "string"}},
+                "seeds": {"type": "array", "items": {"type": "integer"}},
+            },
+        },
+        "merge_orders": {"type": "boolean"},
+        "warm_start": {"type": "boolean"},
+        "decomposition": {
+            "oneOf": [
+                {"type": "boolean", "enum": [False]},
+                {
+                    "type": "object",
+                    "properties": {
+                        "cluster_size": {"type": "integer", "minimum": 1},
+                        "method": {"type": "string", "enum": ["kmeans", "sweep"]},
+                        "repair_time": {"type": "number", "minimum": 0},
+                    },
+                },
+            ]
+        },
         # "handover_time": {"type": "number"},
         "pickup_time": {"type": "number"},
         "warehouse_location": {"type": "string"},
@@ -145,3 +272,120 @@ class VRPSPDTW_data_schema(Inputs):
     """
 
     json = [JsonSchema(schema=VRPSPDTW_data_format)]
+
+
+# json scheme for re-optimization deltas of VRPSPDTW plan
+VRPSPDTW_reoptimize_format = {
+    "type": "object",
+    "properties": {
+        "current_time": {"type": "number"},
+        "max_solver_time": {"type": "number"},
+        "solve_profile": {"type": "string", "enum": ["fast", "balanced", "thorough"]},
+        "respond_by": {"type": "number", "minimum": 0},
+        "telemetry": {"type": "boolean"},
+        "added_orders": {
+            "type": "array",
+            "items": VRPSPDTW_data_format["properties"]["orders"]["items"],
+        },
+        "removed_orders": {"type": "array", "items": {"type": "string"}},
+        "unavailable_drivers": {
+            "type": "array",
+            "items": {"type": "integer", "minimum": 0},
+        },
+        "driver_positions": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["driver"],
+                "properties": {
+                    "driver": {"type": "integer", "minimum": 0},
+                    "location": {"type": "string"},
+                    "completed_stops": {"type": "integer", "minimum": 0},
+                },
+            },
+        },
+    },
+}
+
+
+class VRPSPDTW_reoptimize_schema(Inputs):
+    """
+        creat JsonSchema verifier
+    """
+
+    json = [JsonSchema(schema=VRPSPDTW_reoptimize_format)]
+
+
+# json scheme for single order insertion into VRPSPDTW plan
+VRPSPDTW_insertion_format = {
+    "type": "object",
+    "required": ["order"],
+    "properties": {
+        "order": VRPSPDTW_data_format["properties"]["orders"]["items"],
+        "options": {"type": "integer", "minimum": 1},
+    },
+}
+
+
+class VRPSPDTW_insertion_schema(Inputs):
+    """
+        creat JsonSchema verifier
+    """
+
+    json = [JsonSchema(schema=VRPSPDTW_insertion_format)]
+
+
+def scenarios_format(base_format):
+    """
+        json scheme for what-if scenarios of base request format
+    """
+    return {
+        "type": "object",
+        "required": ["base", "scenarios"],
+        "properties": {
+            "base": base_format,
+            "scenarios": {
+                "type": "array",
+                "minItems": 1,
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "name": {"type": "string"},
+                        "overrides": {
+                            "type": "object",
+                            "properties": {
+                                "no_vehicles": {"type": "integer", "minimum": 1},
+                            },
+                        },
+                    },
+                },
+            },
+        },
+    }
+
+
+def format_errors(data_format, data):
+    """
+        error messages of data (eg. scenario request merged from base and overrides)
+        against json scheme, empty list if data is valid
+    """
+    return [
+        f"{'/'.join(map(str, error.path)) or 'request'}: {error.message}"
+        for error in Draft7Validator(data_format).iter_errors(data)
+    ]
+
+
+class VRPSPD_scenarios_schema(Inputs):
+    """
+        creat JsonSchema verifier
+    """
+
+    json = [JsonSchema(schema=scenarios_format(VRPSPD_data_format))]
+
+
+class VRPSPDTW_scenarios_schema(Inputs):
+    """
+        creat JsonSchema verifier
+    """
+
+    json = [JsonSchema(schema=scenarios_format(VRPSPDTW_data_format))]
@@ -0,0 +1,242 @@
+import hashlib
+import json
+import logging
+import os
+
+from location_util_osm import location_to_latlong
+
+logger = logging.getLogger(__name__)
+
+# warm start configration
+# min share of today's customer locations which must be in historical plan
+WARM_START_MIN_OVERLAP = float(os.environ.get("WARM_START_MIN_OVERLAP", 0.6))
+# no of most recent plans with same fingerprint compared with request
+WARM_START_CANDIDATES = int(os.environ.get("WARM_START_CANDIDATES", 10))
+# no of cheapest insertion positions tried for every new order
+WARM_START_INSERTION_TRIES = 3
+# lat/long are rounded to 5 decimals (~1 meter) before comparing locations
+LOCATION_PRECISION = 5
+
+
+def normalize_location(location):
+    """
+        rounded (lat, long) of location string
+    """
+    return tuple(round(x, LOCATION_PRECISION) for x in location_to_latlong(location))
+
+
+def customer_key(source, destination, order_type):
+    """
+        customer location of order (non-warehouse end) and order type
+    """
+    return (normalize_location(source if order_type else destination), int(order_type))
+
+
+def fingerprint(raw_data):
+    """
+        fingerprint of recurring instance: warehouse and fleet (in driver order)
+        of unrolled VRPSPDTW request. Customer locations are compared separately
+        (see select_plan), as recurring instances never have exactly same orders.
+    """
+    key = {
+        "warehouse": normalize_location(raw_data["depot_location"]),
+        "capacities": list(map(float, raw_data["capacity_of_vehicles"])),
+        "storage": list(raw_data.get("vehicle_storage") or []),
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def customer_keys(raw_data):
+    """
+        set of customer keys of unrolled VRPSPDTW request
+    """
+    return {
+        customer_key(source, destination, order_type)
+        for (source, destination), order_type in zip(
+            raw_data["locations_of_orders"], raw_data["type_of_orders"]
+        )
+    }
+
+
+def plan_steps(input_data, out_data):
+    """
+        stops of stored plan as (customer key, role) for every driver,
+        input_data is stored VRPSPDTW request (before unrolling)
+    """
+    orders = {
+        order["order_id"]: customer_key(
+            order["source"], order["destination"], order["order_type"] == "pickup"
+        )
+        for order in input_data["orders"]
+    }
+    steps = []
+    for trip in out_data["driver_trips"]:
+        vehicle_steps = []
+        for step in trip["trip_detail"]:
+            if step["order_id"] not in orders:
+                continue
+            role = "pickup" if step["operation"] == "pickup" else "deliver"
+            vehicle_steps.append((orders[step["order_id"]], role))
+        steps.append(vehicle_steps)
+    return steps
+
+
+def select_plan(raw_data, candidates, min_overlap=WARM_START_MIN_OVERLAP):
+    """
+        most similar stored plan of recurring instance
+
+        candidates : (task id, input_data, out_data) of stored plans with same fingerprint
+        return dict with task id, customer overlap and driver steps (see plan_steps),
+        None if no plan covers atleast min_overlap of today's customers
+    """
+    today = customer_keys(raw_data)
+    best = None
+    for task_id, input_data, out_data in candidates:
+        try:
+            if len(out_data["driver_trips"]) != raw_data["no_vehicles"]:
+                continue
+            steps = plan_steps(input_data, out_data)
+        except (KeyError, TypeError):
+            continue
+        planned = {key for vehicle_steps in steps for key, _ in vehicle_steps}
+        overlap = len(today & planned) / max(len(today), 1)
+        if overlap >= min_overlap and (best is None or overlap > best["overlap"]):
+            best = {"task_id": task_id, "overlap": round(overlap, 3), "steps": steps}
+    return best
+
+
+def map_routes(steps, raw_data, data):
+    """
+        map stored driver steps onto nodes of preprocessed request,
+        steps of missing orders are dropped. Orders are kept only if all of their
+        nodes are mapped on same route with pickup before delivery.
+    """
+    do_index = {do: n for n, do in enumerate(raw_data["do_numbers"])}
+    key_nodes = dict()
+    order_nodes = [node for nodes in data["order_nodes"] for node in nodes if node is not None]
+    for node in order_nodes:
+        n = do_index[data["node_orders"][node][0]]
+        source, destination = raw_data["locations_of_orders"][n]
+        customer = customer_key(source, destination, raw_data["type_of_orders"][n])
+        key_nodes.setdefault((customer, data["node_roles"][node]), []).append(node)
+
+    used = set()
+    routes = []
+    for vehicle_steps in steps:
+        route = []
+        for customer, role in vehicle_steps:
+            for node in key_nodes.get((customer, role), []):
+                if node not in used:
+                    used.add(node)
+                    route.append(node)
+                    break
+        routes.append(route)
+
+    # keeping only complete orders
+    position = {node: (v, i) for v, route in enumerate(routes) for i, node in enumerate(route)}
+    drop = set()
+    for pickup, delivery in data["order_nodes"]:
+        if delivery not in position or (pickup is not None and pickup not in position):
+            drop.update(node for node in (pickup, delivery) if node is not None)
+        elif pickup is not None and not position[pickup] < position[delivery]:
+            drop.update((pickup, delivery))
+    return [[node for node in route if node not in drop] for route in routes]
+
+
+def insert_orders(routes, orders, transit, vehicles, is_valid, starts=None):
+    """
+        cheapest insertion of orders into routes
+
+        orders   : (pickup node or None, delivery node) of orders to insert
+        vehicles : allowed vehicles of every order (None if all)
+        is_valid : is_valid(routes) checks routes against full routing model,
+                   only WARM_START_INSERTION_TRIES cheapest positions are tried
+        starts   : start node of every vehicle (warehouse if not given)
+        return routes and no of inserted orders
+    """
+    def detour(a, node, b):
+        return transit[a, node] + transit[node, b] - transit[a, b]
+
+    inserted = 0
+    for (pickup, delivery), allowed in zip(orders, vehicles):
+        # (cost, vehicle, pickup position, delivery position) in route
+        candidates = []
+        for v, route in enumerate(routes):
+            if allowed is not None and v not in allowed:
+                continue
+            path = [starts[v] if starts else 0] + route + [0]
+            for i in range(len(path) - 1):
+                if pickup is None:
+                    candidates.append((detour(path[i], delivery, path[i + 1]), v, None, i))
+                    continue
+                # delivery right after pickup
+                cost = (
+                    transit[path[i], pickup]
+                    + transit[pickup, delivery]
+                    + transit[delivery, path[i + 1]]
+                    - transit[path[i], path[i + 1]]
+                )
+                candidates.append((cost, v, i, i))
+                pickup_cost = detour(path[i], pickup, path[i + 1])
+                for j in range(i + 1, len(path) - 1):
+                    cost = pickup_cost + detour(path[j], delivery, path[j + 1])
+                    candidates.append((cost, v, i, j))
+
+        candidates.sort(key=lambda candidate: candidate[0])
+        for _, v, i, j in candidates[:WARM_START_INSERTION_TRIES]:
+            route = routes[v]
+            if i is None:
+                new_route = route[:j] + [delivery] + route[j:]
+            else:
+                new_route = route[:i] + [pickup] + route[i:j] + [delivery] + route[j:]
+            new_routes = routes[:v] + [new_route] + routes[v + 1 :]
+            if is_valid(new_routes):
+                routes = new_routes
+                inserted += 1
+                break
+    return routes, inserted
+
+
+def initial_assignment(manager, routing, routes, orders, transit, vehicles, starts=None):
+    """
+        initial solution of closed routing model from mapped routes (see map_routes),
+        routes which are invalid today (eg. changed windows) are emptied and their
+        orders are inserted again with new orders.
+
+        orders   : (pickup node or None, delivery node) of every order to be routed
+        vehicles : allowed vehicles of every order (None if all)
+        starts   : start node of every vehicle (warehouse if not given)
+        return (assignment or None, no of inserted orders)
+    """
+
+    def read(candidate_routes):
+        return routing.ReadAssignmentFromRoutes(
+            [[manager.NodeToIndex(node) for node in route] for route in candidate_routes],
+            True,  # orders not on routes are unperformed
+        )
+
+    def is_valid(candidate_routes):
+        return read(candidate_routes) is not None
+
+    routes = [list(route) for route in routes]
+    if not is_valid(routes):
+        for v in range(len(routes)):
+            single = [route if u == v else [] for u, route in enumerate(routes)]
+            if not is_valid(single):
+                routes[v] = []
+
+    routed = {node for route in routes for node in route}
+    missing = [
+        (order, allowed)
+        for order, allowed in zip(orders, vehicles)
+        if order[1] not in routed
+    ]
+    routes, inserted = insert_orders(
+        routes,
+        [order for order, _ in missing],
+        transit,
+        [allowed for _, allowed in missing],
+        is_valid,
+        starts,
+    )
+    return read(routes), inserted